@@ -0,0 +1,270 @@
+"""
+このファイルは、回答生成（LLM呼び出し）の同時実行数の制限と、同じ質問の同時処理の相乗りを行うファイルです。
+同時実行数の上限を超えた問い合わせは待ち行列で順番を待ち、待ち行列があふれた場合や待ち時間が上限を超えた場合は
+すぐにエラー（混雑中のメッセージ）を返して、アクセスの集中時にタイムアウトが積み重なるのを防ぎます。
+会話履歴のない同じ質問が同時に処理中の場合は、先に始まった1件の検索・回答生成の結果を共有します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import constants as ct
+import metrics
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+_lock = threading.Lock()
+_admission = None
+_single_flight = None
+
+
+############################################################
+# 関数定義
+############################################################
+
+def get_admission():
+    """
+    プロセス共有の同時実行数の制限を取得（全セッション・全回答モードで共有する）
+    """
+    global _admission
+    with _lock:
+        if _admission is None:
+            _admission = AdmissionController()
+            registry = metrics.get_registry()
+            registry.register_gauge("admission_active", lambda: _admission.active)
+            registry.register_gauge("admission_queued", lambda: _admission.queued)
+        return _admission
+
+
+def get_single_flight():
+    """
+    プロセス共有の処理中の質問の一覧を取得
+    """
+    global _single_flight
+    with _lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+            metrics.get_registry().register_gauge("coalescing_in_flight", lambda: len(_single_flight))
+        return _single_flight
+
+
+def response_events(response):
+    """
+    回答をストリーミングと同じ形式のイベントに変換
+    """
+    return [{"context": response.get("context") or []}, {"answer": response.get("answer") or ""}]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class AdmissionRejected(RuntimeError):
+    """
+    混雑のため、回答生成を受け付けられなかったことを表す例外
+    """
+
+    def __init__(self, reason):
+        super().__init__(ct.OVERLOADED_MESSAGE)
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    回答生成の同時実行数を制限するクラス
+    ※上限に達している間は到着順の待ち行列で待たせ、空きが出た時点で先頭の問い合わせに枠を引き渡す
+    """
+
+    def __init__(self, max_concurrency=None, max_queue=None, queue_timeout_sec=None):
+        self.max_concurrency = max_concurrency or ct.ADMISSION_MAX_CONCURRENCY
+        self.max_queue = ct.ADMISSION_MAX_QUEUE if max_queue is None else max_queue
+        self.queue_timeout_sec = queue_timeout_sec or ct.ADMISSION_QUEUE_TIMEOUT_SEC
+        self.active = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    @property
+    def queued(self):
+        return len(self._waiters)
+
+    @contextmanager
+    def slot(self):
+        """
+        回答生成の枠を確保し、処理が終わるまで保持する
+        ※待ち時間は「queue」の段階として計測する
+        """
+        if not ct.ADMISSION_ENABLED:
+            yield
+            return
+
+        with metrics.span("queue"):
+            self._acquire()
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _acquire(self):
+        with self._lock:
+            if self.active < self.max_concurrency and not self._waiters:
+                self.active += 1
+                metrics.annotate(admission="admitted")
+                return
+            if len(self._waiters) >= self.max_queue:
+                self._reject("queue_full")
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+
+        if waiter.wait(self.queue_timeout_sec):
+            metrics.annotate(admission="queued")
+            return
+
+        with self._lock:
+            # 待ち時間の上限と同時に枠を引き渡された場合は、そのまま処理する
+            if waiter.is_set():
+                metrics.annotate(admission="queued")
+                return
+            self._waiters.remove(waiter)
+            self._reject("queue_timeout")
+
+    def _release(self):
+        with self._lock:
+            if self._waiters:
+                # 実行数は減らさず、待ち行列の先頭へ枠をそのまま引き渡す
+                self._waiters.popleft().set()
+            else:
+                self.active -= 1
+
+    def _reject(self, reason):
+        metrics.annotate(admission="rejected")
+        logger.warning({
+            "admission_rejected": {
+                "reason": reason,
+                "active": self.active,
+                "queued": len(self._waiters),
+            }
+        })
+        raise AdmissionRejected(reason)
+
+
+class Flight:
+    """
+    処理中の質問1件分の回答（先に始まった問い合わせが生成し、相乗りした問い合わせが受け取る）
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.events = []
+        self.result = None
+        self.error = None
+        self.done = False
+        self.followers = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event):
+        """
+        ストリーミングのイベントを1件追加
+        """
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self, result=None, error=None):
+        """
+        回答の完了（または失敗）を通知
+        ※結果を渡さない場合は、追加済みのイベントから回答をまとめる
+        """
+        with self._cond:
+            if result is None and error is None:
+                context = [e["context"] for e in self.events if "context" in e]
+                result = {
+                    "answer": "".join(e["answer"] for e in self.events if "answer" in e),
+                    "context": context[-1] if context else [],
+                }
+            self.result = result
+            self.error = error
+            self.done = True
+            self._cond.notify_all()
+
+    def wait(self):
+        """
+        回答の完了を待って結果を取得（失敗した場合は同じ例外を送出）
+        """
+        with self._cond:
+            while not self.done:
+                self._cond.wait()
+        if self.error is not None:
+            raise self.error
+        return dict(self.result)
+
+    def replay(self):
+        """
+        追加済みのイベントから順に、完了までのイベントを返すイテレータ
+        ※先の問い合わせがストリーミングでない場合は、完了後にまとめて返す
+        """
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.events) and not self.done:
+                    self._cond.wait()
+                pending = self.events[index:]
+                index = len(self.events)
+                done = self.done
+            yield from pending
+            if done:
+                break
+
+        if self.error is not None:
+            raise self.error
+        if not self.events:
+            yield from response_events(self.result)
+
+
+class SingleFlight:
+    """
+    同じキーの処理が同時に行われないよう、処理中の質問を管理するクラス
+    """
+
+    def __init__(self):
+        # {キー: Flight}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._flights)
+
+    def join(self, key):
+        """
+        処理中の同じ質問があれば相乗りし、なければ新たに登録する
+
+        Returns:
+            (Flight, 先頭の問い合わせか)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            return flight, True
+
+    def finish(self, flight, result=None, error=None):
+        """
+        処理の完了を通知し、以降に届いた同じ質問は新たに処理させる
+        """
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        flight.finish(result=result, error=error)
+        if flight.followers:
+            logger.info({"coalesced": {"followers": flight.followers, "error": error is not None}})
@@ -0,0 +1,235 @@
+"""
+このファイルは、似た質問への回答を再利用するための回答キャッシュのファイルです。
+質問文の埋め込みベクトルの類似度でヒットを判定し、有効期限・LRU・メモリ上限で古いエントリを破棄します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import sys
+import time
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+
+import constants as ct
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+############################################################
+# データ定義
+############################################################
+
+@dataclass
+class CacheEntry:
+    """
+    キャッシュ1件分（質問の埋め込み・回答・回答の根拠となったソース）
+    """
+    key: str
+    mode: str
+    vector: np.ndarray
+    response: dict
+    sources: frozenset = field(default_factory=frozenset)
+    created_at: float = 0.0
+    size_bytes: int = 0
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_query(text):
+    """
+    キャッシュ判定用に質問文を正規化（全角・半角、大文字・小文字、空白、末尾の句読点の揺れを吸収）
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    text = " ".join(text.split())
+    return text.rstrip("?？。.!！ ")
+
+
+def _estimate_size(vector, response):
+    """
+    キャッシュ1件分のおおよそのメモリ使用量（バイト）を見積もる
+    """
+    size = vector.nbytes + sys.getsizeof(response.get("answer") or "")
+    for doc in response.get("context") or []:
+        size += sys.getsizeof(doc.page_content) + sys.getsizeof(str(doc.metadata))
+    return size
+
+
+def get_answer_cache():
+    """
+    プロセス共有の回答キャッシュを取得
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticAnswerCache()
+        return _cache
+
+
+############################################################
+# クラス定義
+############################################################
+
+class SemanticAnswerCache:
+    """
+    質問文の意味的な類似度で回答を再利用するキャッシュ
+    """
+
+    def __init__(self, threshold=None, ttl_sec=None, max_entries=None, max_bytes=None):
+        self.threshold = ct.ANSWER_CACHE_SIMILARITY_THRESHOLD if threshold is None else threshold
+        self.ttl_sec = ttl_sec or ct.ANSWER_CACHE_TTL_SEC
+        self.max_entries = max_entries or ct.ANSWER_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or ct.ANSWER_CACHE_MAX_BYTES
+        # {キー: CacheEntry}（末尾ほど最近使われたもの）
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "exact_hits": 0, "evictions": 0, "invalidations": 0}
+
+    def lookup(self, mode, query, embed_query):
+        """
+        キャッシュから回答を検索
+
+        Args:
+            mode: 回答モード
+            query: 質問文
+            embed_query: 質問文を埋め込む関数（完全一致でヒットしなかった場合のみ呼び出す）
+                ※検索と同じ文面（正規化前の質問文）を埋め込み、質問文の埋め込みのキャッシュを検索と共有する
+
+        Returns:
+            (ヒットした回答 or None, 質問の埋め込みベクトル or None)
+        """
+        key = self._key(mode, query)
+        now = time.time()
+
+        with self._lock:
+            self.stats["lookups"] += 1
+            self._purge_expired(now)
+
+            # 正規化後の質問文が完全一致すれば埋め込みを計算しない
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                self.stats["exact_hits"] += 1
+                return self._copy_response(entry.response), entry.vector
+            candidates = [e for e in self._entries.values() if e.mode == mode]
+
+        vector = self._normalize_vector(embed_query(query))
+        if not candidates:
+            return None, vector
+
+        matrix = np.stack([e.vector for e in candidates])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None, vector
+
+        with self._lock:
+            entry = candidates[best]
+            if self._entries.get(entry.key) is not entry:
+                return None, vector
+            self._entries.move_to_end(entry.key)
+            self.stats["hits"] += 1
+        return self._copy_response(entry.response), vector
+
+    def put(self, mode, query, vector, response):
+        """
+        回答をキャッシュに登録
+
+        Args:
+            vector: lookupで計算した質問の埋め込みベクトル
+            response: {"answer": str, "context": list[Document]}
+        """
+        if vector is None or not response.get("answer"):
+            return
+
+        cached_response = {"answer": response.get("answer"), "context": list(response.get("context") or [])}
+        sources = frozenset(
+            str(doc.metadata.get("source"))
+            for doc in cached_response["context"]
+            if doc.metadata.get("source")
+        )
+        key = self._key(mode, query)
+        entry = CacheEntry(
+            key=key,
+            mode=mode,
+            vector=vector,
+            response=cached_response,
+            sources=sources,
+            created_at=time.time(),
+            size_bytes=_estimate_size(vector, cached_response),
+        )
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._total_bytes += entry.size_bytes
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._total_bytes > self.max_bytes
+            ):
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.stats["evictions"] += 1
+
+    def invalidate_sources(self, sources):
+        """
+        指定したソースを根拠に含む回答をキャッシュから削除（インデックス更新時に呼び出す）
+
+        Returns:
+            削除した件数
+        """
+        sources = {str(s) for s in sources}
+        if not sources:
+            return 0
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if e.sources & sources]
+            for key in keys:
+                self._remove(key)
+            self.stats["invalidations"] += len(keys)
+        if keys:
+            logger.info(f"インデックス更新に伴い回答キャッシュを{len(keys)}件削除しました。")
+        return len(keys)
+
+    def clear(self):
+        """
+        キャッシュを全件削除
+        """
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def _key(self, mode, query):
+        return f"{mode}\n{normalize_query(query)}"
+
+    def _normalize_vector(self, vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _purge_expired(self, now):
+        expired = [k for k, e in self._entries.items() if now - e.created_at > self.ttl_sec]
+        for key in expired:
+            self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size_bytes
+
+    def _copy_response(self, response):
+        return {"answer": response["answer"], "context": list(response["context"])}
@@ -0,0 +1,94 @@
+"""
+このファイルは、改行区切りの文字数分割（character）と構造を考慮したチャンク分割（structured）の
+チャンク数・平均サイズ・埋め込みトークン数を比較するベンチマークです。
+APIは呼ばずにローカルのファイルだけで計測します（Webページは対象外）。
+
+    python -m benchmarks.bench_chunking
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import argparse
+import statistics
+from collections import defaultdict
+
+import constants as ct
+import ingest
+import chunker
+import embedding_client
+
+
+############################################################
+# 関数定義
+############################################################
+
+def load_groups(max_workers):
+    """
+    参照先ファイルを読み込み、定型文を学習するグループごとにまとめる
+
+    Returns:
+        {グループのキー: [(ファイルパス, Documentのリスト)]}
+    """
+    groups = defaultdict(list)
+    paths = ingest.list_source_files(ct.RAG_TOP_FOLDER_PATH)
+    for result in ingest.iter_loaded_files(paths, max_workers=max_workers):
+        if not result.error:
+            groups[chunker.dedup_group_key(result.path)].append((result.path, result.docs))
+    return groups
+
+
+def measure(groups, strategy):
+    """
+    指定方式でチャンク分割し、件数・サイズ・トークン数を集計
+    """
+    chunks = []
+    by_type = defaultdict(int)
+    near_duplicates = 0
+    paragraphs_removed = 0
+    for group_key, files in groups.items():
+        split = {path: chunker.split_documents([d.model_copy(deep=True) for d in docs], strategy) for path, docs in files}
+        # 議事録のグループは、indexer.pyと同じく学習した定型文の一覧で各ファイルから取り除く
+        dedup = None
+        if strategy == "structured" and group_key not in split:
+            dedup = chunker.BoilerplateFilter(chunker.learn_boilerplate(split))
+        for path, file_chunks in split.items():
+            for chunk in file_chunks:
+                if dedup is not None:
+                    content = dedup.deduplicate(chunk.page_content, path)
+                    if content is None:
+                        near_duplicates += 1
+                        continue
+                    chunk.page_content = content
+                chunks.append(chunk)
+                by_type[chunk.metadata.get("doc_type", "")] += 1
+        if dedup is not None:
+            paragraphs_removed += dedup.paragraphs_removed
+
+    sizes = [len(c.page_content) for c in chunks]
+    tokens = [embedding_client.count_tokens(c.page_content) for c in chunks]
+    return {
+        "chunks": len(chunks),
+        "chunks_by_type": dict(sorted(by_type.items())),
+        "avg_chars": round(statistics.mean(sizes), 1),
+        "max_chars": max(sizes),
+        "embedding_tokens": sum(tokens),
+        "avg_tokens": round(statistics.mean(tokens), 1),
+        "near_duplicates_removed": near_duplicates,
+        "near_duplicate_paragraphs_removed": paragraphs_removed,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="チャンク分割方式の比較")
+    parser.add_argument("--workers", type=int, default=1, help="ファイル読み込みのワーカープロセス数")
+    args = parser.parse_args(argv)
+
+    groups = load_groups(args.workers)
+    results = {strategy: measure(groups, strategy) for strategy in ["character", "structured"]}
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
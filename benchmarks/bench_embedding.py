@@ -0,0 +1,67 @@
+"""
+このファイルは、埋め込み処理（embedding_client.BatchedEmbeddings）のスループットを
+APIを呼ばずにオフラインで計測するベンチマークです。
+
+    python -m benchmarks.bench_embedding --texts 5000 --latency 0.05
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import time
+import argparse
+
+import embedding_client
+
+
+############################################################
+# 関数定義
+############################################################
+
+def make_texts(count, duplicate_ratio):
+    """
+    計測用のチャンクテキストを作成（一定割合で重複テキストを含める）
+    """
+    unique_count = max(1, int(count * (1 - duplicate_ratio)))
+    return [f"社内文書のチャンク{i % unique_count}。議事録・サービス説明・会社概要などの本文。" * 8 for i in range(count)]
+
+
+def run(texts, batch_size, max_concurrency, latency_sec):
+    """
+    指定設定で埋め込みを実行し、計測結果を返す
+    """
+    embeddings = embedding_client.BatchedEmbeddings(
+        embedding_client.HashEmbeddings(latency_sec=latency_sec),
+        batch_size=batch_size,
+        max_concurrency=max_concurrency,
+    )
+    started = time.perf_counter()
+    embeddings.embed_documents(texts)
+    elapsed = time.perf_counter() - started
+    return {
+        "batch_size": batch_size,
+        "max_concurrency": max_concurrency,
+        "elapsed_sec": round(elapsed, 3),
+        "texts_per_sec": round(len(texts) / elapsed, 1),
+        **embeddings.stats,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="埋め込み処理のオフライン計測")
+    parser.add_argument("--texts", type=int, default=5000, help="チャンク数")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.1, help="重複テキストの割合")
+    parser.add_argument("--latency", type=float, default=0.05, help="1リクエストあたりの疑似遅延（秒）")
+    args = parser.parse_args(argv)
+
+    texts = make_texts(args.texts, args.duplicate_ratio)
+    results = []
+    for batch_size in (16, 64, 256):
+        for max_concurrency in (1, 4, 16):
+            results.append(run(texts, batch_size, max_concurrency, args.latency))
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""
+このファイルは、インデックスの自動更新（index_reloader）について、更新の所要時間と、
+更新中も検索が待たされず構築途中のインデックスを参照しないことを確認するベンチマークです。
+dataフォルダの複製に対してファイルの追加・更新・削除を行い、その間も別スレッドから検索し続けます。
+埋め込みはAPIを呼ばないHashEmbeddingsを使うため、オフラインで実行できます。
+
+    python -m benchmarks.bench_index_reload
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+
+import constants as ct
+import indexer
+import embedding_client
+from index_reloader import IndexReloader, build_retriever
+
+
+############################################################
+# 設定関連
+############################################################
+QUERY = "新しく追加された研修制度について教えてください"
+NEW_FILE_TEXT = "新しく追加された研修制度：若手社員向けのメンター研修を毎月開催します。\n" * 5
+
+
+############################################################
+# 関数定義
+############################################################
+
+def percentile(values, ratio):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * ratio))], 3)
+
+
+class QueryLoad:
+    """
+    検索を繰り返し実行し、所要時間と参照した版を記録する負荷スレッド
+    """
+
+    def __init__(self, reloader):
+        self.reloader = reloader
+        self.latencies = []
+        self.versions = set()
+        self.errors = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            version, retriever = self.reloader.snapshot()
+            started = time.perf_counter()
+            try:
+                retriever.invoke(QUERY)
+            except Exception as e:
+                self.errors.append(f"{type(e).__name__}: {e}")
+            self.latencies.append((time.perf_counter() - started) * 1000)
+            self.versions.add(version)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        return {
+            "queries": len(self.latencies),
+            "errors": len(self.errors),
+            "latency_ms_p50": percentile(self.latencies, 0.5),
+            "latency_ms_p99": percentile(self.latencies, 0.99),
+            "versions_seen": sorted(self.versions),
+        }
+
+
+def wait_for_version(reloader, version, timeout_sec):
+    """
+    指定した版に切り替わるまで待機
+    """
+    deadline = time.perf_counter() + timeout_sec
+    while reloader.version < version and time.perf_counter() < deadline:
+        time.sleep(0.05)
+    return reloader.version >= version
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="インデックス自動更新の計測")
+    parser.add_argument("--timeout", type=float, default=120.0, help="1回の更新を待つ最大時間（秒）")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        data_dir = os.path.join(work_dir, "data")
+        index_dir = os.path.join(work_dir, "index")
+        shutil.copytree(ct.RAG_TOP_FOLDER_PATH, data_dir)
+
+        db = indexer.open_vector_store(index_dir, embedding_client.create_embeddings("fake"))
+        indexer.update_index(db, index_dir=index_dir, include_web=False, max_workers=1, data_dir=data_dir)
+
+        reloader = IndexReloader(
+            build_retriever(db),
+            index_dir=index_dir,
+            versions_dir=os.path.join(work_dir, "versions"),
+            data_dir=data_dir,
+        )
+        reloader.start()
+
+        results = {}
+        with QueryLoad(reloader) as load:
+            time.sleep(1.0)
+            results["idle"] = load.summary()
+
+        new_file = os.path.join(data_dir, "研修制度.txt")
+        steps = [
+            ("added", lambda: open(new_file, "w", encoding="utf-8").write(NEW_FILE_TEXT)),
+            ("updated", lambda: open(new_file, "a", encoding="utf-8").write("対象は入社3年目までの社員です。\n")),
+            ("deleted", lambda: os.remove(new_file)),
+        ]
+        for name, change in steps:
+            target = reloader.version + 1
+            with QueryLoad(reloader) as load:
+                started = time.perf_counter()
+                change()
+                swapped = wait_for_version(reloader, target, args.timeout)
+                detect_to_swap = time.perf_counter() - started
+            # 切り替え後の版で、追加したファイルが検索結果に含まれるか
+            docs = reloader.current.invoke(QUERY)
+            found = any(str(d.metadata.get("source", "")) == new_file for d in docs)
+            results[name] = {
+                "swapped": swapped,
+                "change_to_swap_sec": round(detect_to_swap, 3),
+                "new_file_in_results": found,
+                "during_reload": load.summary(),
+            }
+
+        results["status"] = reloader.status()
+        reloader.stop()
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+このファイルは、質問文の埋め込み（embedding_client.QueryEmbedder）のキャッシュとまとめて送信の効果を、
+同時実行数を変えた検索のレイテンシで比較するベンチマークです。
+埋め込みはHashEmbeddingsに1リクエストあたりの疑似遅延と同時接続数の上限を加えたものを使い、
+APIの呼び出し回数が接続待ちとして検索のレイテンシに表れるようにしています。
+検索全体のレイテンシには、ベクターストアの同時検索による待ち時間も含まれるため、
+質問文の埋め込みにかかった時間（embed_latency_ms_*）も分けて出力します。
+
+    python -m benchmarks.bench_query_embedding
+    python -m benchmarks.bench_query_embedding --latency 0.1 --max-connections 4 --requests 256
+    python -m benchmarks.bench_query_embedding --vector-store numpy
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+
+import constants as ct
+import indexer
+import embedding_client
+from benchmarks.bench_suite import CONCURRENCY_LEVELS, load_questions, percentile, run_concurrently
+
+
+############################################################
+# 設定関連
+############################################################
+# 比較する設定（キャッシュの件数, まとめて送信する際の待ち時間（ミリ秒）, 1回にまとめる最大件数）
+# ※baselineは1件ずつ送信し、キャッシュしない（変更前と同じ呼び出し回数）
+VARIANTS = {
+    "baseline": (0, 0, 1),
+    "batching": (0, ct.QUERY_EMBEDDING_BATCH_WAIT_MS, ct.QUERY_EMBEDDING_MAX_BATCH_SIZE),
+    "batching_and_cache": (
+        ct.QUERY_EMBEDDING_CACHE_SIZE,
+        ct.QUERY_EMBEDDING_BATCH_WAIT_MS,
+        ct.QUERY_EMBEDDING_MAX_BATCH_SIZE,
+    ),
+}
+
+
+############################################################
+# クラス定義
+############################################################
+
+class PooledHashEmbeddings(embedding_client.HashEmbeddings):
+    """
+    同時接続数に上限のある埋め込みAPIを模したHashEmbeddings
+    ※接続の空きを待つ時間も含めて、1リクエストごとにlatency_secかかる
+    """
+
+    def __init__(self, max_connections, **kwargs):
+        super().__init__(**kwargs)
+        self._connections = threading.BoundedSemaphore(max_connections)
+        self.requests = 0
+
+    def embed_documents(self, texts):
+        with self._connections:
+            self.requests += 1
+            return super().embed_documents(texts)
+
+    async def aembed_documents(self, texts):
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def run_variant(index_dir, questions, variant, args):
+    """
+    指定設定の質問文の埋め込みで、同時実行数ごとに検索のレイテンシを計測
+    """
+    cache_size, batch_wait_ms, max_batch_size = VARIANTS[variant]
+    results = {}
+    for concurrency in CONCURRENCY_LEVELS:
+        # 同時実行数ごとにキャッシュ・集計を作り直す
+        base = PooledHashEmbeddings(args.max_connections, latency_sec=args.latency)
+        embeddings = embedding_client.BatchedEmbeddings(base)
+        embedder = embedding_client.QueryEmbedder(
+            embeddings,
+            cache_size=cache_size,
+            batch_wait_ms=batch_wait_ms,
+            max_batch_size=max_batch_size,
+        )
+        embeddings._query_embedder = embedder
+        db = indexer.open_vector_store(index_dir, embeddings)
+        embed_latencies = []
+
+        def search(question):
+            started = time.perf_counter()
+            vector = embeddings.embed_query(question)
+            embed_latencies.append((time.perf_counter() - started) * 1000)
+            db.similarity_search_by_vector(vector, k=ct.TOP_K)
+
+        results[f"concurrency_{concurrency}"] = {
+            **run_concurrently(search, questions, concurrency, max(args.requests, concurrency)),
+            "embed_latency_ms_p50": percentile(embed_latencies, 0.5),
+            "embed_latency_ms_p95": percentile(embed_latencies, 0.95),
+            "embedding_requests": base.requests,
+            "hit_ratio": embedder.hit_ratio,
+            "batch_size_mean": embedder.mean_batch_size,
+            "batch_size_max": embedder.stats["max_batch_size"],
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="質問文の埋め込みのキャッシュ・まとめて送信の効果の計測")
+    parser.add_argument("--requests", type=int, default=128, help="同時実行数ごとの最小リクエスト数")
+    parser.add_argument("--latency", type=float, default=0.05, help="埋め込み1リクエストあたりの疑似遅延（秒）")
+    parser.add_argument("--max-connections", type=int, default=ct.EMBEDDING_MAX_CONCURRENCY, help="埋め込みAPIの同時接続数の上限")
+    parser.add_argument("--vector-store", choices=["chroma", "numpy"], default=ct.VECTOR_STORE_BACKEND, help="検索するベクターストア")
+    args = parser.parse_args(argv)
+
+    ct.VECTOR_STORE_BACKEND = args.vector_store
+
+    questions = [question for question, _ in load_questions()]
+    with tempfile.TemporaryDirectory() as index_dir:
+        db = indexer.open_vector_store(index_dir, embedding_client.create_embeddings("fake"))
+        indexer.update_index(db, index_dir=index_dir, include_web=False, max_workers=1)
+
+        report = {
+            "questions": len(questions),
+            "latency_sec": args.latency,
+            "max_connections": args.max_connections,
+            "vector_store": args.vector_store,
+        }
+        for variant in VARIANTS:
+            report[variant] = run_variant(index_dir, questions, variant, args)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+このファイルは、固定件数（TOP_K）の検索結果と、再ランキング + 適応的な件数決定の結果について、
+回答生成に渡すチャンク数・トークン数・正解ソースの出現率・再ランキングの所要時間を比較するベンチマークです。
+埋め込みはAPIを呼ばないHashEmbeddingsを使うため、オフラインで実行できます。
+
+    python -m benchmarks.bench_rerank
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+import constants as ct
+import indexer
+import embedding_client
+import hybrid_retriever
+from reranker import RerankingRetriever, create_scorer
+from benchmarks.bench_retrieval import build_queries
+
+
+############################################################
+# 関数定義
+############################################################
+
+def measure(retriever, queries):
+    """
+    回答生成に渡すチャンク数・トークン数と、正解ソースの出現率を計測
+    """
+    doc_counts = []
+    token_counts = []
+    latencies = []
+    hits = 0
+    for query, expected in queries:
+        started = time.perf_counter()
+        docs = retriever.invoke(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+        doc_counts.append(len(docs))
+        token_counts.append(sum(embedding_client.count_tokens(d.page_content) for d in docs))
+        if any(str(d.metadata.get("source", "")).startswith(expected) for d in docs):
+            hits += 1
+
+    return {
+        "queries": len(queries),
+        "hit_rate": round(hits / len(queries), 3),
+        "avg_docs": round(statistics.mean(doc_counts), 2),
+        "avg_context_tokens": round(statistics.mean(token_counts), 1),
+        "latency_ms_p50": round(statistics.median(latencies), 3),
+    }
+
+
+def measure_rerank_cost(retriever, queries):
+    """
+    候補取得を除いた再ランキング単体の所要時間を計測
+    """
+    costs = []
+    for query, _ in queries:
+        candidates = retriever.base.invoke(query)
+        _, metrics = retriever.rerank(query, candidates)
+        costs.append(metrics["rerank_ms"])
+    costs.sort()
+    return {
+        "rerank_ms_p50": round(statistics.median(costs), 3),
+        "rerank_ms_p95": round(costs[int(len(costs) * 0.95) - 1], 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="固定件数と再ランキング + 適応的件数の比較")
+    parser.add_argument("--scorer", choices=["lexical", "cross_encoder"], default=None, help="再ランキングのスコアラー")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        db = indexer.open_vector_store(index_dir, embedding_client.create_embeddings("fake"))
+        indexer.update_index(db, index_dir=index_dir, include_web=False, max_workers=1)
+        base = hybrid_retriever.build_hybrid_retriever(db, k=ct.TOP_K)
+        reranking = RerankingRetriever.wrap(base, scorer=create_scorer(args.scorer))
+
+        queries = build_queries()
+        results = {
+            f"fixed_top{ct.TOP_K}": measure(base, queries),
+            "rerank_adaptive": {**measure(reranking, queries), **measure_rerank_cost(reranking, queries)},
+        }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
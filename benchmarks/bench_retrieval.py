@@ -0,0 +1,97 @@
+"""
+このファイルは、ベクトル検索のみの場合とハイブリッド検索（BM25 + ベクトル検索）の
+検索レイテンシ・完全一致語の検索精度を比較するベンチマークです。
+埋め込みはAPIを呼ばないHashEmbeddingsを使うため、オフラインで実行できます。
+
+    python -m benchmarks.bench_retrieval
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import csv
+import json
+import time
+import argparse
+import tempfile
+import statistics
+
+import constants as ct
+import indexer
+import embedding_client
+import hybrid_retriever
+
+
+############################################################
+# 関数定義
+############################################################
+
+def build_queries():
+    """
+    完全一致語（社名・氏名）を含む質問と、正解のソースを作成
+
+    Returns:
+        (質問文, 正解ソースのパス) のリスト
+    """
+    queries = []
+
+    customer_dir = os.path.join(ct.RAG_TOP_FOLDER_PATH, "MTG議事録", "顧客")
+    for status in sorted(os.listdir(customer_dir)):
+        for company in sorted(os.listdir(os.path.join(customer_dir, status))):
+            queries.append((f"{company}との打ち合わせ内容", os.path.join(customer_dir, status, company)))
+
+    csv_path = os.path.join(ct.RAG_TOP_FOLDER_PATH, "社員について", "社員名簿.csv")
+    with open(csv_path, encoding="utf-8") as f:
+        for row in list(csv.DictReader(f))[:10]:
+            queries.append((f"{row['氏名（フルネーム）']}の所属部署", csv_path))
+
+    return queries
+
+
+def measure(retriever, queries, k):
+    """
+    検索レイテンシと正解ソースの上位k件への出現率を計測
+    """
+    latencies = []
+    hits = 0
+    for query, expected in queries:
+        started = time.perf_counter()
+        docs = retriever.invoke(query)[:k]
+        latencies.append((time.perf_counter() - started) * 1000)
+        if any(str(doc.metadata.get("source", "")).startswith(expected) for doc in docs):
+            hits += 1
+
+    latencies.sort()
+    return {
+        "queries": len(queries),
+        f"hit_rate@{k}": round(hits / len(queries), 3),
+        "latency_ms_p50": round(statistics.median(latencies), 3),
+        "latency_ms_p95": round(latencies[int(len(latencies) * 0.95) - 1], 3),
+        "latency_ms_mean": round(statistics.mean(latencies), 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベクトル検索とハイブリッド検索の比較")
+    parser.add_argument("--k", type=int, default=ct.TOP_K, help="評価する上位件数")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        db = indexer.open_vector_store(index_dir, embedding_client.create_embeddings("fake"))
+        indexer.update_index(db, index_dir=index_dir, include_web=False, max_workers=1)
+
+        started = time.perf_counter()
+        hybrid = hybrid_retriever.build_hybrid_retriever(db, k=args.k)
+        bm25_build_ms = (time.perf_counter() - started) * 1000
+
+        queries = build_queries()
+        results = {
+            "vector": measure(db.as_retriever(search_kwargs={"k": args.k}), queries, args.k),
+            "hybrid": {**measure(hybrid, queries, args.k), "bm25_build_ms": round(bm25_build_ms, 3)},
+        }
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
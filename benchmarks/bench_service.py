@@ -0,0 +1,193 @@
+"""
+このファイルは、検索・回答APIのサービス（rag_service.py）の応答性能を計測するベンチマークです。
+計測用のLLM・埋め込みでサービスを別プロセスとして起動し、回答・関連ファイル検索・ストリーミングの各APIに
+同時実行数を変えて問い合わせます。ストリーミングでは初回トークンまでの時間も計測します。
+検索・回答生成はスレッドプールで実行されるため、LLMの待ち時間の間も他の問い合わせを受け付けられることを確認できます。
+
+    python -m benchmarks.bench_service
+    python -m benchmarks.bench_service --llm-first-token-sec 0.5 --requests 64
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import statistics
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import constants as ct
+from benchmarks.bench_suite import CONCURRENCY_LEVELS, load_questions, percentile, run_concurrently
+
+
+############################################################
+# 設定関連
+############################################################
+SERVICE_START_TIMEOUT_SEC = 300
+
+
+############################################################
+# 関数定義
+############################################################
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def run_service(port, index_dir, first_token_sec, token_interval_sec):
+    """
+    （子プロセス）計測用のLLM・埋め込みでサービスを起動
+    """
+    import uvicorn
+    import rag_service
+    import chain_factory
+
+    ct.INDEX_DIR_PATH = index_dir
+    ct.INDEX_VERSIONS_DIR_PATH = os.path.join(index_dir, "versions")
+    ct.EMBEDDING_BACKEND = "fake"
+    ct.LLM_BACKEND = "fake"
+    ct.WEB_URL_LOAD_TARGETS = []
+    chain_factory._llm = chain_factory.FakeChatModel(
+        first_token_sec=first_token_sec,
+        token_interval_sec=token_interval_sec,
+    )
+    # 繰り返す質問が回答キャッシュに当たると検索・回答生成を計測できないため、キャッシュを使わない
+    ct.ANSWER_CACHE_ENABLED = False
+    uvicorn.run(rag_service.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def wait_for_service(client, proc):
+    """
+    サービスの起動（インデックスの構築を含む）を待ち、所要時間を返す
+    """
+    started = time.perf_counter()
+    while time.perf_counter() - started < SERVICE_START_TIMEOUT_SEC:
+        if proc.poll() is not None:
+            raise RuntimeError("サービスの起動に失敗しました。")
+        try:
+            client.get("/healthz").raise_for_status()
+            return round(time.perf_counter() - started, 3)
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise TimeoutError("サービスの起動がタイムアウトしました。")
+
+
+def service_rss_mb(pid):
+    with open(f"/proc/{pid}/status", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return round(int(line.split()[1]) / 1024, 1)
+    return None
+
+
+def bench_stream(client, questions, concurrency, requests):
+    """
+    ストリーミングAPIの初回トークンまでの時間と全体の時間
+    """
+    workload = [questions[i % len(questions)] for i in range(requests)]
+    errors = []
+
+    def timed_call(question):
+        started = time.perf_counter()
+        first_token_ms = None
+        try:
+            with client.stream("POST", "/v1/stream", json={"message": question}) as response:
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    if first_token_ms is None and line.startswith('{"answer"'):
+                        first_token_ms = (time.perf_counter() - started) * 1000
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        return first_token_ms, (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        measured = list(executor.map(timed_call, workload))
+    elapsed = time.perf_counter() - started
+
+    first_tokens = [m[0] for m in measured if m[0] is not None]
+    totals = [m[1] for m in measured]
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "time_to_first_token_ms_p50": percentile(first_tokens, 0.5) if first_tokens else None,
+        "time_to_first_token_ms_p95": percentile(first_tokens, 0.95) if first_tokens else None,
+        "latency_ms_p50": percentile(totals, 0.5),
+        "latency_ms_p95": percentile(totals, 0.95),
+        "latency_ms_mean": round(statistics.mean(totals), 3),
+        "throughput_qps": round(requests / elapsed, 2),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="検索・回答APIのサービスの応答性能の計測")
+    parser.add_argument("--requests", type=int, default=64, help="同時実行数ごとの最小リクエスト数")
+    parser.add_argument("--llm-first-token-sec", type=float, default=0.2, help="計測用LLMの初回トークンまでの秒数")
+    parser.add_argument("--llm-token-interval-sec", type=float, default=0.0, help="計測用LLMのトークンごとの秒数")
+    parser.add_argument("--child", nargs=2, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # 子プロセス：サービスを起動
+    if args.child:
+        port, index_dir = args.child
+        run_service(int(port), index_dir, args.llm_first_token_sec, args.llm_token_interval_sec)
+        return
+
+    questions = [question for question, _ in load_questions()]
+    port = free_port()
+    limits = httpx.Limits(max_connections=max(CONCURRENCY_LEVELS))
+    with tempfile.TemporaryDirectory() as index_dir, \
+            httpx.Client(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=120) as client:
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "benchmarks.bench_service", "--child", str(port), index_dir,
+             "--llm-first-token-sec", str(args.llm_first_token_sec),
+             "--llm-token-interval-sec", str(args.llm_token_interval_sec)],
+            cwd=os.getcwd(),
+        )
+        try:
+            report = {
+                "llm_first_token_sec": args.llm_first_token_sec,
+                "llm_token_interval_sec": args.llm_token_interval_sec,
+                "service_start_sec": wait_for_service(client, proc),
+                "service_rss_mb_after_start": service_rss_mb(proc.pid),
+            }
+
+            def post(path, mode):
+                def call(question):
+                    client.post(path, json={"message": question, "mode": mode}).raise_for_status()
+                return call
+
+            for name, func in [
+                ("answer", post("/v1/answer", ct.ANSWER_MODE_2)),
+                ("search", post("/v1/search", ct.ANSWER_MODE_1)),
+            ]:
+                report[name] = {
+                    f"concurrency_{c}": run_concurrently(
+                        func, questions, c, max(args.requests, c)
+                    )
+                    for c in CONCURRENCY_LEVELS
+                }
+            report["stream"] = {
+                f"concurrency_{c}": bench_stream(client, questions, c, max(args.requests, c))
+                for c in CONCURRENCY_LEVELS
+            }
+            report["service_rss_mb_after_queries"] = service_rss_mb(proc.pid)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+このファイルは、複数のワーカープロセスが同じインデックスを開いた場合の起動時間とメモリ使用量を、
+コーパスのスナップショット（メモリマップ）とベクターストア（プロセスごとに読み込み）で比較するベンチマークです。
+全ワーカーが検索を終えてRetrieverを保持している時点で、各プロセスのRSSとPSS（共有ページを按分した使用量）を取得します。
+PSSの合計が、ホスト全体で実際に使われている物理メモリの目安です（Linuxのみ）。
+埋め込みはAPIを呼ばないHashEmbeddingsを使うため、オフラインで実行できます。
+
+    python -m benchmarks.bench_snapshot
+    python -m benchmarks.bench_snapshot --workers 8 --chunks 20000 --baseline numpy
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import multiprocessing
+
+import constants as ct
+import indexer
+import embedding_client
+import corpus_snapshot
+from index_reloader import build_retriever, open_retriever
+from benchmarks.bench_suite import load_questions
+from benchmarks.bench_vector_store import EMBEDDING_DIM, build_corpus
+
+
+############################################################
+# 関数定義
+############################################################
+
+def memory_rollup():
+    """
+    現在のプロセスのRSS・PSS・共有ページ（MB）
+    """
+    values = {}
+    with open("/proc/self/smaps_rollup", encoding="utf-8") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if key in ("Rss", "Pss", "Shared_Clean", "Shared_Dirty"):
+                values[key] = int(rest.split()[0]) / 1024
+    return {
+        "rss_mb": round(values["Rss"], 1),
+        "pss_mb": round(values["Pss"], 1),
+        "shared_mb": round(values["Shared_Clean"] + values["Shared_Dirty"], 1),
+    }
+
+
+def build_index(index_dir, backend, chunks):
+    """
+    指定件数のコーパスでインデックスとスナップショットを作成
+    """
+    ct.VECTOR_STORE_BACKEND = backend
+    texts, metadatas = build_corpus(chunks)
+    ids = [f"bench-{i}" for i in range(len(texts))]
+    db = indexer.open_vector_store(index_dir, embedding_client.HashEmbeddings(size=EMBEDDING_DIM))
+    for start in range(0, len(texts), ct.EMBEDDING_FLUSH_SIZE):
+        end = start + ct.EMBEDDING_FLUSH_SIZE
+        db.add_texts(texts[start:end], metadatas[start:end], ids=ids[start:end])
+
+    manifest = {"settings": indexer.index_settings(), "sources": {"bench": {"chunks": [{"id": i} for i in ids]}}}
+    indexer.save_manifest(manifest, index_dir)
+    return corpus_snapshot.write_snapshot(db, index_dir, manifest)
+
+
+def worker(index_dir, backend, mode, questions, barrier, results):
+    """
+    （ワーカープロセス）Retrieverを開いて検索し、全ワーカーが揃った時点のメモリを報告
+    """
+    started = time.perf_counter()
+    embeddings = embedding_client.HashEmbeddings(size=EMBEDDING_DIM)
+    ct.VECTOR_STORE_BACKEND = backend
+    if mode == "snapshot":
+        retriever = open_retriever(index_dir, embeddings)
+    else:
+        retriever = build_retriever(indexer.open_vector_store(index_dir, embeddings))
+    ready_ms = (time.perf_counter() - started) * 1000
+
+    latencies = []
+    for question in questions:
+        query_started = time.perf_counter()
+        retriever.invoke(question)
+        latencies.append((time.perf_counter() - query_started) * 1000)
+
+    # 全ワーカーがRetrieverを保持している状態で計測する
+    barrier.wait()
+    results.put({
+        "ready_ms": round(ready_ms, 1),
+        "query_ms_mean": round(statistics.mean(latencies), 3),
+        "retriever": type(retriever.vectorstore).__name__,
+        **memory_rollup(),
+    })
+    barrier.wait()
+
+
+def run_workers(index_dir, backend, mode, workers, questions):
+    """
+    ワーカープロセスを同時に起動し、結果を集計
+    """
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(workers)
+    results = context.Queue()
+    processes = [
+        context.Process(target=worker, args=(index_dir, backend, mode, questions, barrier, results))
+        for _ in range(workers)
+    ]
+    for p in processes:
+        p.start()
+    measured = [results.get() for _ in processes]
+    for p in processes:
+        p.join()
+
+    return {
+        "retriever": measured[0]["retriever"],
+        "ready_ms_mean": round(statistics.mean(m["ready_ms"] for m in measured), 1),
+        "ready_ms_max": max(m["ready_ms"] for m in measured),
+        "query_ms_mean": round(statistics.mean(m["query_ms_mean"] for m in measured), 3),
+        "rss_mb_per_worker": round(statistics.mean(m["rss_mb"] for m in measured), 1),
+        "shared_mb_per_worker": round(statistics.mean(m["shared_mb"] for m in measured), 1),
+        "pss_mb_total": round(sum(m["pss_mb"] for m in measured), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ワーカープロセス間でのコーパス共有の計測")
+    parser.add_argument("--workers", type=int, default=4, help="同時に起動するワーカープロセス数")
+    parser.add_argument("--chunks", type=int, default=10000, help="コーパスのチャンク数")
+    parser.add_argument("--baseline", choices=["chroma", "numpy"], default="chroma", help="比較するベクターストア")
+    args = parser.parse_args(argv)
+
+    questions = [question for question, _ in load_questions()]
+    with tempfile.TemporaryDirectory() as index_dir:
+        snapshot = build_index(index_dir, args.baseline, args.chunks)
+        report = {
+            "workers": args.workers,
+            "chunks": args.chunks,
+            "snapshot_mb": snapshot["size_mb"],
+            "snapshot_write_sec": snapshot["elapsed_sec"],
+            "snapshot": run_workers(index_dir, args.baseline, "snapshot", args.workers, questions),
+            args.baseline: run_workers(index_dir, args.baseline, "store", args.workers, questions),
+        }
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
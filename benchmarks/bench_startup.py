@@ -0,0 +1,154 @@
+"""
+このファイルは、Streamlitアプリの起動時間を計測するベンチマークです。
+モジュールごとのimport時間と、初期表示（タイトル・モード選択・初期メッセージ）までの時間、
+チャット入力を受け付けられるようになるまでの時間（time-to-interactive）を出力します。
+埋め込みはAPIを呼ばないHashEmbeddingsを使うため、オフラインで実行できます。
+
+    python -m benchmarks.bench_startup
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+
+
+############################################################
+# 設定関連
+############################################################
+# アプリ起動時（main.pyの実行開始時）に読み込まれるモジュール
+APP_ENTRY_MODULES = ["streamlit", "constants", "components", "utils", "initialize"]
+# 初期表示後に読み込まれるモジュール
+DEFERRED_MODULES = ["indexer", "hybrid_retriever", "chain_factory", "doc_search", "answer_cache", "structured_query"]
+
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+############################################################
+# 関数定義
+############################################################
+
+def import_profile(modules, limit):
+    """
+    新しいプロセスでモジュールを読み込み、-X importtime の結果を集計
+
+    Returns:
+        {"total_ms", "modules": {モジュール: 累積ms}, "heaviest": [(モジュール, 累積ms)]}
+    """
+    code = "; ".join(f"import {m}" for m in modules)
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True, text=True, check=True,
+    )
+    total_ms = (time.perf_counter() - started) * 1000
+
+    cumulative = {}
+    top_level = []
+    for line in proc.stderr.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if not match:
+            continue
+        name = match.group(4)
+        ms = int(match.group(2)) / 1000
+        cumulative[name] = round(ms, 1)
+        # 字下げが最小（空白1つ）のものが、そのプロセスで直接読み込まれたモジュール
+        if len(match.group(3)) == 1:
+            top_level.append((name, round(ms, 1)))
+
+    return {
+        "process_ms": round(total_ms, 1),
+        "modules": {m: cumulative.get(m) for m in modules},
+        "heaviest": sorted(top_level, key=lambda x: x[1], reverse=True)[:limit],
+    }
+
+
+def build_index(index_dir):
+    """
+    計測用のインデックスを作成（APIを呼ばない埋め込みで、Webページは対象外）
+    """
+    import indexer
+    import embedding_client
+
+    db = indexer.open_vector_store(index_dir, embedding_client.create_embeddings("fake"))
+    indexer.update_index(db, index_dir=index_dir, include_web=False, max_workers=1)
+
+
+def measure_app(index_dir):
+    """
+    Streamlitのテスト用ランナー（AppTest）でmain.pyを実行し、起動時間を計測
+    ※新しいプロセスで実行され、import済みモジュールのない起動直後の状態を計測する
+    """
+    started = time.perf_counter()
+
+    import constants as ct
+    ct.INDEX_DIR_PATH = index_dir
+    ct.EMBEDDING_BACKEND = "fake"
+    ct.WEB_URL_LOAD_TARGETS = []
+
+    import components
+    from streamlit.testing.v1 import AppTest
+
+    # 初期表示（タイトル・モード選択・初期メッセージ）が終わった時刻を記録
+    marks = {}
+    display_initial_ai_message = components.display_initial_ai_message
+
+    def marked_display_initial_ai_message():
+        display_initial_ai_message()
+        marks.setdefault("first_paint", time.perf_counter())
+
+    components.display_initial_ai_message = marked_display_initial_ai_message
+
+    app = AppTest.from_file("main.py", default_timeout=300)
+    app.run()
+    interactive = time.perf_counter()
+    ready = bool(app.chat_input) and not app.exception
+
+    rerun_started = time.perf_counter()
+    app.run()
+    rerun_ms = (time.perf_counter() - rerun_started) * 1000
+
+    return {
+        "time_to_first_paint_ms": round((marks.get("first_paint", interactive) - started) * 1000, 1),
+        "time_to_interactive_ms": round((interactive - started) * 1000, 1),
+        "interactive": ready,
+        "rerun_ms": round(rerun_ms, 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="アプリ起動時間の計測")
+    parser.add_argument("--limit", type=int, default=10, help="import時間の上位表示件数")
+    parser.add_argument("--app-child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # 子プロセス：AppTestでの計測結果のみを出力
+    if args.app_child:
+        print(json.dumps(measure_app(args.app_child)))
+        return
+
+    results = {
+        "startup_imports": import_profile(APP_ENTRY_MODULES, args.limit),
+        "deferred_imports": import_profile(DEFERRED_MODULES, args.limit),
+    }
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        build_index(index_dir)
+        proc = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_startup", "--app-child", index_dir],
+            capture_output=True, text=True, check=True, cwd=os.getcwd(),
+        )
+        results["app"] = json.loads(proc.stdout.strip().splitlines()[-1])
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
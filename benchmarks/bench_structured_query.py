@@ -0,0 +1,102 @@
+"""
+このファイルは、構造化クエリエンジン（structured_query.py）の振り分けの正確さと応答時間を計測するベンチマークです。
+テーブルで回答すべき質問（絞り込み・件数・平均・内訳）と、通常のRAGで回答すべき質問
+（「社員」「従業員」や部署名などを含むが、社内制度や部署の計画などを尋ねる質問）を用意し、
+それぞれ期待どおりに振り分けられるかを確認します。
+
+    python -m benchmarks.bench_structured_query
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import time
+import argparse
+import statistics
+
+import constants as ct
+import structured_query
+
+
+############################################################
+# データ定義
+############################################################
+# (質問文, 期待する質問の種類) ※Noneは通常のRAGで回答すべき質問
+CASES = [
+    # テーブルで回答すべき質問
+    ("人事部に所属している従業員情報を一覧化して", "list"),
+    ("営業部は何人？", "count"),
+    ("40歳以上の社員の一覧", "list"),
+    ("30代の従業員は何人いますか", "count"),
+    ("部署ごとの人数を教えて", "group_count"),
+    ("社員の平均年齢は？", "average"),
+    ("マネージャーは何名いますか", "count"),
+    ("役職がスタッフの社員の一覧", "list"),
+    ("社員名簿を一覧にして", "list"),
+    ("営業部の社員は何人いますか", "count"),
+    ("正社員の一覧を教えて", "list"),
+    # 通常のRAGで回答すべき質問（対象を表す語・一覧や件数の語を含むもの）
+    ("社員の育成方針をリストにして", None),
+    ("従業員の福利厚生を一覧で教えて", None),
+    ("社員旅行は何件予定されていますか", None),
+    ("スタッフ向けの研修制度の一覧", None),
+    ("メンバーの評価制度を教えて", None),
+    ("有給休暇の申請方法を教えてください", None),
+    ("株式会社EcoTeeの概要", None),
+    # 通常のRAGで回答すべき質問（部署名などの索引の値と、一覧・件数の語を含むもの）
+    ("営業部の売上目標はいくつ？", None),
+    ("マーケティング部の施策は何件ありますか", None),
+    ("人事部の採用計画で採用予定は何人？", None),
+    ("人事部が担当する研修の一覧を教えて", None),
+    ("正社員の福利厚生の一覧", None),
+    ("人事部長は誰？", None),
+]
+
+
+############################################################
+# 関数定義
+############################################################
+
+def measure(engine, cases, repeat):
+    """
+    振り分けの正解率と、1問あたりの応答時間を計測
+    """
+    mismatches = []
+    latencies = []
+    for question, expected in cases:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            result = engine.answer(question)
+            latencies.append((time.perf_counter() - started) * 1000)
+        actual = result["context"][0].metadata["structured_query"] if result else None
+        if actual != expected:
+            mismatches.append({"question": question, "expected": expected, "actual": actual})
+
+    positives = [c for c in cases if c[1] is not None]
+    negatives = [c for c in cases if c[1] is None]
+    missed = [m for m in mismatches if m["expected"] is not None]
+    false_routes = [m for m in mismatches if m["expected"] is None]
+    latencies.sort()
+    return {
+        "cases": len(cases),
+        "accuracy": round(1 - len(mismatches) / len(cases), 3),
+        "structured_recall": round(1 - len(missed) / len(positives), 3),
+        "rag_fallback_rate": round(1 - len(false_routes) / len(negatives), 3),
+        "latency_ms_p50": round(statistics.median(latencies), 4),
+        "latency_ms_p95": round(latencies[int(len(latencies) * 0.95) - 1], 4),
+        "mismatches": mismatches,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="構造化クエリエンジンの振り分けの計測")
+    parser.add_argument("--repeat", type=int, default=20, help="1問あたりの繰り返し回数")
+    args = parser.parse_args(argv)
+
+    engine = structured_query.StructuredQueryEngine.from_folder(ct.RAG_TOP_FOLDER_PATH)
+    print(json.dumps(measure(engine, CASES, args.repeat), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""
+このファイルは、APIを呼ばずにRAG全体の性能を計測するベンチマークです。
+埋め込みはHashEmbeddings、回答生成・質問文の書き換えは計測用のFakeChatModelを使うため、オフラインかつ決定的に実行できます。
+
+計測項目:
+    ingest:            dataフォルダのファイル読み込みのスループット
+    index:             インデックスの新規構築・差分更新（変更なし）の所要時間、Retrieverの準備時間
+    query_latency:     同時実行数ごとの質問応答（Chain全体・文書検索）のレイテンシとスループット
+    memory:            セッションあたりのメモリ使用量、全セッション共有のRetrieverのメモリ使用量
+    retrieval_quality: ラベル付き質問セット（benchmarks/questions.json）に対するrecall@k・MRR
+
+結果はバージョン間で比較できるJSON形式で保存します。
+
+    python -m benchmarks.bench_suite                                  # 計測して benchmarks/results/ に保存
+    python -m benchmarks.bench_suite --compare benchmarks/results/前回.json  # 前回の結果との差分も表示
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import constants as ct
+import ingest
+import indexer
+import doc_search
+import chain_factory
+import embedding_client
+from chat_history import ChatHistory
+from index_reloader import build_retriever
+from reranker import RerankingRetriever
+from benchmarks.bench_retrieval import build_queries
+
+
+############################################################
+# 設定関連
+############################################################
+# 出力形式の版（項目の追加・変更時に上げる）
+RESULT_SCHEMA_VERSION = 1
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+QUESTIONS_PATH = os.path.join(BENCH_DIR, "questions.json")
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+CONCURRENCY_LEVELS = [1, 8, 32]
+
+
+############################################################
+# 関数定義（共通）
+############################################################
+
+def percentile(values, ratio):
+    values = sorted(values)
+    if not values:
+        return None
+    return round(values[min(len(values) - 1, max(0, int(len(values) * ratio + 0.5) - 1))], 3)
+
+
+def git_revision():
+    """
+    計測対象のコミット（未コミットの変更がある場合は末尾に "-dirty"）
+    """
+    try:
+        revision = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        return f"{revision}-dirty" if dirty else revision
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def environment_info():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def load_questions():
+    """
+    ラベル付き質問セットを読み込む
+
+    Returns:
+        (質問文, 正解ソースのパス（前方一致）) のリスト
+    """
+    with open(QUESTIONS_PATH, encoding="utf-8") as f:
+        items = json.load(f)
+    return [(item["question"], os.path.join(ct.RAG_TOP_FOLDER_PATH, item["source"])) for item in items]
+
+
+def flatten(results, prefix=""):
+    """
+    入れ子の結果を「項目.項目」形式のキーと数値の組に展開（比較用）
+    """
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+############################################################
+# 関数定義（計測）
+############################################################
+
+def bench_ingest(paths):
+    """
+    ファイル読み込みのスループット（逐次・プロセス並列）
+    """
+    total_bytes = sum(os.path.getsize(p) for p in paths)
+    results = {}
+    for label, workers in [("sequential", 1), ("parallel", ct.INGEST_MAX_WORKERS)]:
+        started = time.perf_counter()
+        documents = 0
+        failed = 0
+        for result in ingest.iter_loaded_files(paths, max_workers=workers):
+            documents += len(result.docs)
+            failed += bool(result.error)
+        elapsed = time.perf_counter() - started
+        results[label] = {
+            "files": len(paths),
+            "documents": documents,
+            "failed": failed,
+            "elapsed_sec": round(elapsed, 3),
+            "files_per_sec": round(len(paths) / elapsed, 2),
+            "mb_per_sec": round(total_bytes / elapsed / 1024 / 1024, 3),
+        }
+    return results
+
+
+def bench_index(index_dir, embeddings):
+    """
+    インデックスの新規構築・差分更新の所要時間と、Retrieverの準備時間（initialize_retriever相当）
+    """
+    db = indexer.open_vector_store(index_dir, embeddings)
+    build = indexer.update_index(db, index_dir=index_dir, include_web=False)
+    noop = indexer.update_index(db, index_dir=index_dir, include_web=False)
+
+    started = time.perf_counter()
+    db = indexer.open_vector_store(index_dir, embeddings)
+    retriever = build_retriever(db)
+    load_sec = time.perf_counter() - started
+
+    disk_bytes = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(index_dir)
+        for name in names
+    )
+    results = {
+        "build_sec": build["elapsed_sec"],
+        "chunks": build["chunks_embedded"],
+        "chunks_per_sec": round(build["chunks_embedded"] / build["elapsed_sec"], 1),
+        "noop_update_sec": noop["elapsed_sec"],
+        "retriever_load_sec": round(load_sec, 3),
+        "disk_mb": round(disk_bytes / 1024 / 1024, 3),
+    }
+    return results, retriever
+
+
+def run_concurrently(func, questions, concurrency, requests):
+    """
+    指定した同時実行数で質問を処理し、レイテンシとスループットを計測
+    """
+    workload = [questions[i % len(questions)] for i in range(requests)]
+    errors = []
+
+    def timed_call(question):
+        started = time.perf_counter()
+        try:
+            func(question)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = list(executor.map(timed_call, workload))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "errors": len(errors),
+        "latency_ms_p50": percentile(latencies, 0.5),
+        "latency_ms_p95": percentile(latencies, 0.95),
+        "latency_ms_p99": percentile(latencies, 0.99),
+        "latency_ms_mean": round(statistics.mean(latencies), 3),
+        "throughput_qps": round(requests / elapsed, 2),
+    }
+
+
+def bench_query_latency(retriever, questions, requests_per_level):
+    """
+    同時実行数ごとの質問応答のレイテンシ
+    rag:        「社内問い合わせ」モードのChain全体（書き換え判定 → 検索 → 再ランキング → 回答生成）
+    doc_search: 「社内文書検索」モード（検索結果をファイル単位に集約、回答生成なし）
+    """
+    chain = chain_factory.get_chain(ct.ANSWER_MODE_2, retriever)
+    search_retriever = retriever.with_routing() if hasattr(retriever, "with_routing") else retriever
+
+    targets = {
+        "rag": lambda q: chain.invoke({"input": q, "chat_history": []}),
+        "doc_search": lambda q: doc_search.search_documents(search_retriever, q),
+    }
+    texts = [question for question, _ in questions]
+    results = {}
+    for name, func in targets.items():
+        func(texts[0])  # 初回のみの読み込み・初期化を計測から除く
+        results[name] = {
+            f"concurrency_{c}": run_concurrently(func, texts, c, max(requests_per_level, c * 4))
+            for c in CONCURRENCY_LEVELS
+        }
+    return results
+
+
+def bench_memory(index_dir, embeddings, sessions, turns):
+    """
+    セッションあたりのメモリ使用量（会話履歴・画面表示用の会話ログ）と、共有Retrieverのメモリ使用量
+    ※Pythonのヒープのみを計測する（ベクターストアのネイティブ領域は含まない）
+    """
+    answer = chain_factory.FakeChatModel().invoke("社内規程について教えてください").content
+
+    tracemalloc.start()
+    baseline = tracemalloc.take_snapshot()
+    states = []
+    for i in range(sessions):
+        history = ChatHistory()
+        messages = []
+        for turn in range(turns):
+            question = f"セッション{i}の{turn}回目の質問：有給休暇の申請方法を教えてください"
+            history.append(question, answer)
+            messages.append({"role": "user", "content": question})
+            messages.append({"role": "assistant", "content": {"mode": ct.ANSWER_MODE_2, "answer": answer}})
+        history.for_prompt()
+        states.append((history, messages))
+    session_bytes = sum(s.size_diff for s in tracemalloc.take_snapshot().compare_to(baseline, "filename"))
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    db = indexer.open_vector_store(index_dir, embeddings)
+    retriever = build_retriever(db)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del retriever
+
+    return {
+        "sessions": sessions,
+        "turns_per_session": turns,
+        "kb_per_session": round(session_bytes / sessions / 1024, 2),
+        "shared_retriever_mb": round(current / 1024 / 1024, 3),
+        "shared_retriever_peak_mb": round(peak / 1024 / 1024, 3),
+    }
+
+
+def evaluate(retriever, queries, k):
+    """
+    正解ソースの上位k件への出現率（recall@k）と、最初の正解の順位の逆数の平均（MRR）
+    """
+    hits = 0
+    reciprocal_ranks = []
+    for question, expected in queries:
+        docs = retriever.invoke(question)[:k]
+        rank = next(
+            (i + 1 for i, d in enumerate(docs) if str(d.metadata.get("source", "")).startswith(expected)),
+            None,
+        )
+        hits += rank is not None
+        reciprocal_ranks.append(1 / rank if rank else 0.0)
+    return {
+        "queries": len(queries),
+        f"recall@{k}": round(hits / len(queries), 3),
+        "mrr": round(statistics.mean(reciprocal_ranks), 3),
+    }
+
+
+def bench_retrieval_quality(retriever, questions, k):
+    """
+    ラベル付き質問セット・固有名詞の質問セットに対する検索精度（固定件数・再ランキング後）
+    """
+    sets = {"labelled": questions, "named_entities": build_queries()}
+    reranking = RerankingRetriever.wrap(retriever)
+    return {
+        name: {
+            "hybrid": evaluate(retriever, queries, k),
+            "rerank": evaluate(reranking, queries, k),
+        }
+        for name, queries in sets.items()
+    }
+
+
+############################################################
+# 関数定義（結果の保存・比較）
+############################################################
+
+def save_results(report, output):
+    """
+    計測結果をJSONで保存
+    """
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        output = os.path.join(RESULTS_DIR, f"bench_suite-{stamp}-{report['git_revision']}.json")
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return output
+
+
+def compare_results(baseline_path, report):
+    """
+    前回の計測結果との差分を表形式の文字列にする
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("schema_version") != report["schema_version"]:
+        return f"出力形式の版が異なるため比較できません: {baseline.get('schema_version')} → {report['schema_version']}"
+
+    before = flatten(baseline["results"])
+    after = flatten(report["results"])
+    lines = [f"baseline: {baseline['git_revision']} ({baseline['created_at']}) → current: {report['git_revision']}"]
+    for key in sorted(before.keys() & after.keys()):
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        lines.append(f"{key:<70}{old:>14}{new:>14}{change:>10}")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="オフラインでのRAG全体の性能計測")
+    parser.add_argument("--requests", type=int, default=44, help="同時実行数ごとの最小リクエスト数")
+    parser.add_argument("--llm-first-token-sec", type=float, default=0.05, help="計測用LLMの初回トークンまでの秒数")
+    parser.add_argument("--llm-token-interval-sec", type=float, default=0.0, help="計測用LLMのトークンごとの秒数")
+    parser.add_argument("--sessions", type=int, default=50, help="メモリ計測のセッション数")
+    parser.add_argument("--turns", type=int, default=10, help="メモリ計測の1セッションあたりの往復数")
+    parser.add_argument("--k", type=int, default=ct.TOP_K, help="検索精度を評価する上位件数")
+    parser.add_argument("--output", default=None, help="結果の保存先（未指定時は benchmarks/results/ 配下）")
+    parser.add_argument("--compare", default=None, help="比較する前回の結果ファイル")
+    args = parser.parse_args(argv)
+
+    # API呼び出しを行わない構成に切り替える
+    ct.EMBEDDING_BACKEND = "fake"
+    ct.LLM_BACKEND = "fake"
+    ct.WEB_URL_LOAD_TARGETS = []
+    chain_factory._llm = chain_factory.FakeChatModel(
+        first_token_sec=args.llm_first_token_sec,
+        token_interval_sec=args.llm_token_interval_sec,
+    )
+    embeddings = embedding_client.create_embeddings("fake")
+    questions = load_questions()
+
+    results = {}
+    results["ingest"] = bench_ingest(ingest.list_source_files(ct.RAG_TOP_FOLDER_PATH))
+    with tempfile.TemporaryDirectory() as index_dir:
+        results["index"], retriever = bench_index(index_dir, embeddings)
+        results["query_latency"] = bench_query_latency(retriever, questions, args.requests)
+        results["memory"] = bench_memory(index_dir, embeddings, args.sessions, args.turns)
+        results["retrieval_quality"] = bench_retrieval_quality(retriever, questions, args.k)
+
+    report = {
+        "schema_version": RESULT_SCHEMA_VERSION,
+        "benchmark": "bench_suite",
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "environment": environment_info(),
+        "config": {
+            "embedding_backend": "fake",
+            "llm_backend": "fake",
+            "llm_first_token_sec": args.llm_first_token_sec,
+            "llm_token_interval_sec": args.llm_token_interval_sec,
+            "concurrency_levels": CONCURRENCY_LEVELS,
+            "requests_per_level": args.requests,
+            "top_k": args.k,
+            "retriever_mode": ct.RETRIEVER_MODE,
+            "chunking_strategy": ct.CHUNKING_STRATEGY,
+        },
+        "results": results,
+    }
+    output = save_results(report, args.output)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    print(f"保存先: {output}", file=sys.stderr)
+
+    if args.compare:
+        print(compare_results(args.compare, report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+このファイルは、ChromaとNumPyのベクターストア（float32 / float16 / int8）の
+メモリ使用量・検索レイテンシ・検索結果の一致率を比較するベンチマークです。
+dataフォルダのチャンクを複製して指定件数のコーパスを作り、ストアごとに別プロセスで開いて計測します。
+埋め込みはAPIを呼ばないHashEmbeddings（OpenAIの埋め込みと同じ1536次元）を使うため、オフラインで実行できます。
+
+    python -m benchmarks.bench_vector_store
+    python -m benchmarks.bench_vector_store --chunks 50000
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import subprocess
+
+import numpy as np
+
+import constants as ct
+import ingest
+import indexer
+import embedding_client
+from benchmarks.bench_suite import load_questions, percentile
+
+
+############################################################
+# 設定関連
+############################################################
+# 計測対象（名前, ベクターストアの種類, 保持形式）
+STORES = [
+    ("chroma", "chroma", None),
+    ("numpy_float32", "numpy", "float32"),
+    ("numpy_float16", "numpy", "float16"),
+    ("numpy_int8", "numpy", "int8"),
+]
+EMBEDDING_DIM = 1536
+TOP_K = 10
+
+
+############################################################
+# 関数定義
+############################################################
+
+def rss_mb():
+    """
+    現在のプロセスの常駐メモリ（MB）
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # /procがない環境では最大常駐メモリで代用（Linux: KB, macOS: バイト）
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def build_corpus(size):
+    """
+    dataフォルダのチャンクを複製し、指定件数のコーパスを作成
+
+    Returns:
+        (本文のリスト, メタデータのリスト)
+    """
+    chunks = []
+    for result in ingest.iter_loaded_files(ingest.list_source_files(ct.RAG_TOP_FOLDER_PATH), max_workers=1):
+        chunks.extend(indexer.split_documents(indexer.adjust_documents(result.docs)))
+
+    # 2件目以降の複製は別のチャンクの後半と組み合わせ、同一・ほぼ同一のベクトルが並ばないようにする
+    rng = np.random.default_rng(0)
+    texts = []
+    metadatas = []
+    for i in range(size):
+        chunk = chunks[i % len(chunks)]
+        text = chunk.page_content
+        if i >= len(chunks):
+            other = chunks[rng.integers(len(chunks))].page_content
+            text = text[:len(text) // 2] + other[len(other) // 2:]
+        texts.append(text)
+        metadatas.append({k: v for k, v in chunk.metadata.items() if isinstance(v, (str, int, float, bool))})
+    return texts, metadatas
+
+
+def open_store(backend, dtype, store_dir, embeddings):
+    ct.VECTOR_STORE_BACKEND = backend
+    if dtype:
+        ct.NUMPY_STORE_DTYPE = dtype
+    return indexer.open_vector_store(store_dir, embeddings)
+
+
+def build_store(backend, dtype, store_dir, embeddings, texts, metadatas):
+    """
+    ベクターストアを作成し、所要時間とディスク上のサイズを返す
+    """
+    db = open_store(backend, dtype, store_dir, embeddings)
+    started = time.perf_counter()
+    for start in range(0, len(texts), ct.EMBEDDING_FLUSH_SIZE):
+        end = start + ct.EMBEDDING_FLUSH_SIZE
+        db.add_texts(texts[start:end], metadatas[start:end], ids=[str(i) for i in range(start, min(end, len(texts)))])
+    build_sec = time.perf_counter() - started
+
+    disk_bytes = sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(store_dir)
+        for name in names
+    )
+    return {"build_sec": round(build_sec, 3), "disk_mb": round(disk_bytes / 1024 / 1024, 2)}
+
+
+def measure_store(backend, dtype, store_dir, query_vectors, chunks):
+    """
+    （子プロセス）ストアを開いた後のメモリ増加量と、検索レイテンシを計測
+    """
+    embeddings = embedding_client.HashEmbeddings(size=EMBEDDING_DIM)
+    # 開く前の時点で、検索に使うライブラリの読み込みを済ませておく
+    if backend == "chroma":
+        from langchain_community.vectorstores import Chroma  # noqa: F401
+    else:
+        import numpy_vector_store  # noqa: F401
+    before = rss_mb()
+
+    started = time.perf_counter()
+    db = open_store(backend, dtype, store_dir, embeddings)
+    # Chromaは最初の検索時にHNSWのインデックスを読み込むため、1回検索するまでを準備時間とする
+    db.similarity_search_by_vector(query_vectors[0], k=TOP_K)
+    open_sec = time.perf_counter() - started
+    opened = rss_mb()
+
+    latencies = []
+    results = []
+    for vector in query_vectors:
+        started = time.perf_counter()
+        docs = db.similarity_search_by_vector(vector, k=TOP_K)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append([d.page_content for d in docs])
+    after = rss_mb()
+
+    measured = {
+        "open_sec": round(open_sec, 3),
+        "rss_mb_after_open": round(opened - before, 2),
+        "rss_mb_after_queries": round(after - before, 2),
+        "rss_mb_per_10k_chunks": round((after - before) * 10000 / chunks, 2),
+        "query_ms_p50": percentile(latencies, 0.5),
+        "query_ms_p95": percentile(latencies, 0.95),
+        "query_ms_p99": percentile(latencies, 0.99),
+    }
+
+    # まとめて検索した場合の1件あたりの時間（1回の行列積で全質問を処理）
+    if hasattr(db, "search_by_vectors"):
+        started = time.perf_counter()
+        db.search_by_vectors(query_vectors, k=TOP_K)
+        measured["batched_query_ms_per_query"] = round((time.perf_counter() - started) * 1000 / len(query_vectors), 3)
+        measured["matrix_mb"] = round(db.nbytes / 1024 / 1024, 2)
+
+    return measured, results
+
+
+def recall_against(reference, results):
+    """
+    厳密な検索結果（NumPy float32）の上位k件のうち、同じチャンクが返った割合
+    """
+    recalls = [len(set(r) & set(e)) / len(set(e)) for r, e in zip(results, reference) if e]
+    return round(float(np.mean(recalls)), 4)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="ベクターストアのメモリ使用量・検索レイテンシの比較")
+    parser.add_argument("--chunks", type=int, default=10000, help="コーパスのチャンク数")
+    parser.add_argument("--queries", type=int, default=200, help="計測する検索回数")
+    parser.add_argument("--child", nargs=3, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    # 子プロセス：1つのストアを開いて計測し、結果のみを出力
+    if args.child:
+        backend, dtype, work_dir = args.child
+        with open(os.path.join(work_dir, "queries.json"), encoding="utf-8") as f:
+            query_vectors = json.load(f)
+        measured, results = measure_store(
+            backend, dtype if dtype != "-" else None, os.path.join(work_dir, f"{backend}_{dtype}"),
+            query_vectors, args.chunks,
+        )
+        print(json.dumps({"measured": measured, "results": results}, ensure_ascii=False))
+        return
+
+    embeddings = embedding_client.HashEmbeddings(size=EMBEDDING_DIM)
+    texts, metadatas = build_corpus(args.chunks)
+    questions = [question for question, _ in load_questions()]
+    query_vectors = embeddings.embed_documents([questions[i % len(questions)] for i in range(args.queries)])
+
+    report = {"chunks": args.chunks, "dim": EMBEDDING_DIM, "queries": args.queries, "top_k": TOP_K, "stores": {}}
+    outputs = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        with open(os.path.join(work_dir, "queries.json"), "w", encoding="utf-8") as f:
+            json.dump(query_vectors, f)
+
+        for name, backend, dtype in STORES:
+            store_dir = os.path.join(work_dir, f"{backend}_{dtype or '-'}")
+            built = build_store(backend, dtype, store_dir, embeddings, texts, metadatas)
+            proc = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_vector_store", "--chunks", str(args.chunks),
+                 "--child", backend, dtype or "-", work_dir],
+                capture_output=True, text=True, check=True, cwd=os.getcwd(),
+            )
+            output = json.loads(proc.stdout.strip().splitlines()[-1])
+            outputs[name] = output["results"]
+            report["stores"][name] = {**built, **output["measured"]}
+
+    reference = outputs["numpy_float32"]
+    for name in report["stores"]:
+        report["stores"][name][f"recall@{TOP_K}_vs_exact"] = recall_against(reference, outputs[name])
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+このファイルは、Webページの読み込み処理（web_loader）を、ローカルに起動した代替HTTPサーバーに対して
+計測するベンチマークです。並列取得・条件付きリクエスト（304）・タイムアウト・取得失敗時のキャッシュ代用を確認します。
+
+    python -m benchmarks.bench_web_loader --pages 8 --delay 0.2
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import time
+import argparse
+import tempfile
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import web_loader
+
+
+############################################################
+# クラス定義
+############################################################
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    代替HTTPサーバーのハンドラ
+    /page/<n>: 一定時間待ってからETag付きのHTMLを返す（If-None-Matchが一致すれば304）
+    /error:    500を返す
+    /hang:     タイムアウトより長く応答しない
+    """
+
+    delay_sec = 0.0
+    hang_sec = 0.0
+
+    def do_GET(self):
+        if self.path.startswith("/page/"):
+            time.sleep(self.delay_sec)
+            etag = f'"{self.path}-v1"'
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.end_headers()
+                return
+            body = f"<html lang='ja'><head><title>{self.path}</title></head><body>本文 {self.path}</body></html>"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("ETag", etag)
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+        elif self.path == "/hang":
+            time.sleep(self.hang_sec)
+            self.send_response(200)
+            self.end_headers()
+        else:
+            self.send_response(500)
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+############################################################
+# 関数定義
+############################################################
+
+def run(urls, cache_dir, timeout_sec):
+    """
+    全URLを取得し、所要時間と取得結果の内訳を返す
+    """
+    fetcher = web_loader.WebPageFetcher(cache_dir, timeout_sec=timeout_sec)
+    started = time.perf_counter()
+    results = web_loader.run_sync(fetcher.fetch_all(urls))
+    return {
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+        "status": dict(Counter(r.status for r in results.values())),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Webページ読み込みの計測（ローカルの代替サーバー）")
+    parser.add_argument("--pages", type=int, default=8, help="取得するページ数")
+    parser.add_argument("--delay", type=float, default=0.2, help="1ページあたりの応答時間（秒）")
+    parser.add_argument("--timeout", type=float, default=1.0, help="1リクエストあたりのタイムアウト（秒）")
+    args = parser.parse_args(argv)
+
+    StandInHandler.delay_sec = args.delay
+    StandInHandler.hang_sec = args.timeout * 2
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    pages = [f"{base}/page/{i}" for i in range(args.pages)]
+    urls = pages + [f"{base}/error", f"{base}/hang"]
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        results = {
+            "serial_estimate_sec": round(args.pages * args.delay, 3),
+            # 初回：全ページを取得（エラー・無応答のURLはキャッシュがないためfailed）
+            "cold": run(urls, cache_dir, args.timeout),
+            # 2回目：ETagが一致するためすべて304（not_modified）
+            "warm": run(urls, cache_dir, args.timeout),
+        }
+        # サーバー停止後：前回取得時のキャッシュで代用（stale）
+        server.shutdown()
+        server.server_close()
+        results["server_down"] = run(pages, cache_dir, args.timeout)
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""
+このファイルは、RAGのChain（質問文の独立化 → 検索 → 回答生成）を組み立てるファイルです。
+Chainは回答モードごとにプロセス内で1度だけ作成し、メッセージごとには再構築しません。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import time
+import threading
+
+import httpx
+from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+from langchain.chains import create_retrieval_chain
+from langchain.chains.combine_documents import create_stuff_documents_chain
+
+import constants as ct
+from query_rewriter import QueryRewriter
+from reranker import RerankingRetriever
+
+
+############################################################
+# 設定関連
+############################################################
+_lock = threading.Lock()
+_llm = None
+_rewriter = None
+# {回答モード: (作成時のRetriever, Chain)}
+_chains = {}
+
+
+############################################################
+# 関数定義
+############################################################
+
+def create_llm(backend=None):
+    """
+    バックエンド名に応じたLLMを作成
+
+    Args:
+        backend: "openai" または "fake"（未指定時は定数LLM_BACKEND）
+    """
+    backend = backend or ct.LLM_BACKEND
+    if backend == "fake":
+        return FakeChatModel()
+    if backend == "openai":
+        limits = httpx.Limits(
+            max_connections=ct.LLM_HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=ct.LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        )
+        return ChatOpenAI(
+            model=ct.MODEL,
+            temperature=ct.TEMPERATURE,
+            http_client=httpx.Client(limits=limits, timeout=ct.LLM_HTTP_TIMEOUT_SEC),
+            http_async_client=httpx.AsyncClient(limits=limits, timeout=ct.LLM_HTTP_TIMEOUT_SEC),
+        )
+    raise ValueError(f"未対応のLLMバックエンドです: {backend}")
+
+
+def get_llm():
+    """
+    プロセス共有のLLMを取得
+    ※HTTPクライアントを共有し、接続（TLSセッション）をメッセージ間で再利用する
+    """
+    global _llm
+    with _lock:
+        if _llm is None:
+            _llm = create_llm()
+        return _llm
+
+
+def get_rewriter():
+    """
+    プロセス共有の質問文書き換え処理を取得（書き換え結果のキャッシュを全モードで共有する）
+    """
+    global _rewriter
+    llm = get_llm()
+    with _lock:
+        if _rewriter is None:
+            # 会話履歴があっても「単体で意味が通る質問文」に変換するプロンプト
+            question_generator_prompt = ChatPromptTemplate.from_messages(
+                [
+                    ("system", ct.SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT),
+                    MessagesPlaceholder("chat_history"),
+                    ("human", "{input}"),
+                ]
+            )
+            _rewriter = QueryRewriter(llm, question_generator_prompt)
+        return _rewriter
+
+
+def get_answer_template(mode):
+    """
+    回答モードに応じた回答生成用のシステムプロンプトを取得
+    """
+    if mode == ct.ANSWER_MODE_1:
+        return ct.SYSTEM_PROMPT_DOC_SEARCH
+    return ct.SYSTEM_PROMPT_INQUIRY
+
+
+def build_chain(mode, retriever):
+    """
+    回答モード1つ分のChainを作成
+    """
+    llm = get_llm()
+
+    # モードでプロンプト切替
+    question_answer_prompt = ChatPromptTemplate.from_messages(
+        [
+            ("system", get_answer_template(mode)),
+            MessagesPlaceholder("chat_history"),
+            ("human", "{input}"),
+        ]
+    )
+
+    # 検索範囲の推定に対応したRetrieverでは、対象モードのみ質問文から範囲を絞り込む
+    if mode in ct.QUERY_ROUTER_MODES and hasattr(retriever, "with_routing"):
+        retriever = retriever.with_routing()
+
+    # 対象モードでは候補を多めに取得して再ランキングし、回答生成に渡す件数を質問ごとに決める
+    if mode in ct.RERANK_MODES:
+        retriever = RerankingRetriever.wrap(retriever)
+
+    # 書き換えが不要な質問ではLLMを呼ばずに検索する
+    history_aware_retriever = get_rewriter().as_retriever_chain(retriever)
+
+    question_answer_chain = create_stuff_documents_chain(llm, question_answer_prompt)
+
+    return create_retrieval_chain(history_aware_retriever, question_answer_chain)
+
+
+def get_chain(mode, retriever):
+    """
+    回答モードに対応するChainを取得（未作成の場合のみ作成）
+    ※Retrieverが差し替えられた場合は、そのモードのChainを作り直す
+    """
+    with _lock:
+        cached = _chains.get(mode)
+        if cached and cached[0] is retriever:
+            return cached[1]
+
+    chain = build_chain(mode, retriever)
+
+    with _lock:
+        _chains[mode] = (retriever, chain)
+    return chain
+
+
+############################################################
+# クラス定義
+############################################################
+
+class FakeChatModel(BaseChatModel):
+    """
+    APIを呼ばない決定的なチャットモデル（オフラインでの性能計測用）
+    ※最後のユーザー入力を繰り返した固定長の回答を、疑似的な応答時間を挟みながらトークン単位で返す
+    """
+
+    first_token_sec: float = ct.FAKE_LLM_FIRST_TOKEN_SEC
+    token_interval_sec: float = ct.FAKE_LLM_TOKEN_INTERVAL_SEC
+    answer_chars: int = ct.FAKE_LLM_ANSWER_CHARS
+    chars_per_token: int = 4
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _answer(self, messages):
+        question = next((m.content for m in reversed(messages) if m.type == "human"), "")
+        filler = "（計測用の回答）"
+        text = question + filler * (self.answer_chars // len(filler) + 1)
+        return text[:max(self.answer_chars, len(question))]
+
+    def _tokens(self, text):
+        return [text[i:i + self.chars_per_token] for i in range(0, len(text), self.chars_per_token)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self._answer(messages)
+        time.sleep(self.first_token_sec + self.token_interval_sec * len(self._tokens(text)))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_sec)
+        for token in self._tokens(self._answer(messages)):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            time.sleep(self.token_interval_sec)
@@ -0,0 +1,188 @@
+"""
+このファイルは、LLMに渡す会話履歴をトークン数の上限内に収めるための履歴管理のファイルです。
+直近の会話は必ず残し、上限を超えた古い会話は要点だけを残して要約欄へ移します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import threading
+
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+
+import constants as ct
+from embedding_client import count_tokens
+
+
+############################################################
+# 関数定義
+############################################################
+
+def count_message_tokens(message):
+    """
+    メッセージ1件のトークン数を計算（チャットモデルのエンコーディング）
+    """
+    return count_tokens(message.content or "", ct.CHAT_TOKEN_ENCODING) + ct.CHAT_MESSAGE_OVERHEAD_TOKENS
+
+
+def _clip(text, max_chars):
+    """
+    要約用にテキストを先頭から指定文字数で切り詰める
+    """
+    text = " ".join((text or "").split())
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + "…"
+
+
+############################################################
+# クラス定義
+############################################################
+
+class ChatHistory:
+    """
+    トークン数の上限付きで会話履歴を保持するクラス
+    ※直近HISTORY_PINNED_TURNS往復は必ずプロンプトに含める
+    ※それより古い往復は上限に収まる範囲で新しい順に含め、収まらない往復は要点を要約欄へ移して破棄する
+    """
+
+    def __init__(self, token_budget=None, pinned_turns=None):
+        self.token_budget = token_budget or ct.HISTORY_TOKEN_BUDGET
+        self.pinned_turns = ct.HISTORY_PINNED_TURNS if pinned_turns is None else pinned_turns
+        # [(HumanMessage, AIMessage, トークン数)]
+        self.turns = []
+        # 破棄した往復の要点（1往復1行、古いものから）
+        self.summary_lines = []
+        # 破棄した往復の元のトークン数（削減量の集計用）
+        self.evicted_tokens = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_messages(cls, messages):
+        """
+        旧形式（HumanMessage / AIMessage のリスト）から履歴を作成
+        """
+        history = cls()
+        pending_user = None
+        for message in messages or []:
+            if isinstance(message, HumanMessage):
+                pending_user = message.content
+            elif isinstance(message, AIMessage) and pending_user is not None:
+                history.append(pending_user, message.content)
+                pending_user = None
+        return history
+
+    @classmethod
+    def from_dicts(cls, items):
+        """
+        APIのリクエスト形式（{"role": "system" / "user" / "assistant", "content": str} のリスト）から履歴を作成
+        ※systemメッセージは要約欄として引き継ぐ
+        """
+        history = cls()
+        pending_user = None
+        for item in items or []:
+            role = item.get("role")
+            content = item.get("content") or ""
+            if role == "system":
+                history.summary_lines.extend(
+                    line for line in content.splitlines() if line and line != ct.HISTORY_SUMMARY_HEADER
+                )
+            elif role == "user":
+                pending_user = content
+            elif role == "assistant" and pending_user is not None:
+                history.append(pending_user, content)
+                pending_user = None
+        return history
+
+    def to_dicts(self):
+        """
+        プロンプトに渡す会話履歴をAPIのリクエスト形式に変換
+        """
+        roles = {"system": "system", "human": "user", "ai": "assistant"}
+        messages, _ = self.for_prompt()
+        return [{"role": roles[m.type], "content": m.content} for m in messages]
+
+    def __len__(self):
+        return len(self.turns)
+
+    def append(self, user_text, assistant_text):
+        """
+        1往復分の会話を追加
+        """
+        user_message = HumanMessage(content=user_text)
+        ai_message = AIMessage(content=assistant_text)
+        tokens = count_message_tokens(user_message) + count_message_tokens(ai_message)
+        with self._lock:
+            self.turns.append((user_message, ai_message, tokens))
+
+    def for_prompt(self):
+        """
+        プロンプトに渡す会話履歴を作成
+
+        Returns:
+            (メッセージのリスト, トークン数の集計)
+        """
+        with self._lock:
+            pinned_count = min(self.pinned_turns, len(self.turns))
+            pinned = self.turns[len(self.turns) - pinned_count:]
+            older = self.turns[:len(self.turns) - pinned_count]
+
+            # 要約欄の上限分はあらかじめ確保しておく
+            remaining = self.token_budget - sum(t[2] for t in pinned) - ct.HISTORY_SUMMARY_MAX_TOKENS
+
+            # 固定分より古い往復は、上限に収まる範囲で新しい順に残す
+            kept = []
+            for turn in reversed(older):
+                if turn[2] > remaining:
+                    break
+                kept.append(turn)
+                remaining -= turn[2]
+            kept.reverse()
+
+            # 収まらなかった往復は今後も収まらないため、要点を要約欄へ移して破棄する
+            evicted = older[:len(older) - len(kept)]
+            if evicted:
+                self._summarize(evicted)
+                self.turns = kept + pinned
+
+            messages = []
+            summary = self._summary_text()
+            if summary:
+                messages.append(SystemMessage(content=summary))
+            for user_message, ai_message, _ in self.turns:
+                messages.extend([user_message, ai_message])
+
+            sent_tokens = sum(t[2] for t in self.turns) + self._summary_tokens()
+            stats = {
+                "history_tokens_sent": sent_tokens,
+                "history_tokens_full": sum(t[2] for t in self.turns) + self.evicted_tokens,
+                "turns_sent": len(self.turns),
+                "turns_summarized": len(self.summary_lines),
+            }
+        return messages, stats
+
+    def _summarize(self, turns):
+        """
+        破棄する往復の要点を要約欄へ追加（LLMを呼ばず、質問と回答の冒頭を残す）
+        ※要約欄も上限を超えた場合は古い行から削除する
+        """
+        for user_message, ai_message, tokens in turns:
+            self.summary_lines.append(
+                f"- 質問: {_clip(user_message.content, ct.HISTORY_SUMMARY_CHARS_PER_TURN)}"
+                f" / 回答: {_clip(ai_message.content, ct.HISTORY_SUMMARY_CHARS_PER_TURN)}"
+            )
+            self.evicted_tokens += tokens
+
+        while self.summary_lines and self._summary_tokens() > ct.HISTORY_SUMMARY_MAX_TOKENS:
+            self.summary_lines.pop(0)
+
+    def _summary_text(self):
+        if not self.summary_lines:
+            return ""
+        return "\n".join([ct.HISTORY_SUMMARY_HEADER, *self.summary_lines])
+
+    def _summary_tokens(self):
+        text = self._summary_text()
+        if not text:
+            return 0
+        return count_tokens(text, ct.CHAT_TOKEN_ENCODING) + ct.CHAT_MESSAGE_OVERHEAD_TOKENS
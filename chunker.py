@@ -0,0 +1,519 @@
+"""
+このファイルは、読み込んだDocumentを検索用のチャンクに分割するチャンク分割処理のファイルです。
+見出し・段落・表・文（「。」）の境界でチャンクを区切り、CSVは複数行をヘッダー付きでまとめます。
+また、議事録のファイル間で共通する定型文を、全体構築時に学習した一覧をもとに取り除き、重複登録しないようにします。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import re
+import unicodedata
+from collections import Counter
+
+from langchain_core.documents import Document
+from langchain.text_splitter import CharacterTextSplitter
+
+import constants as ct
+
+
+############################################################
+# 設定関連
+############################################################
+# 見出し（「1.」「3.2」「第1章」「■」「【】」「#」で始まる短い行）
+HEADING_PATTERN = re.compile(
+    r"^(?:(?P<number>[0-9０-９]+(?:[.．][0-9０-９]+)*)[.．、]?\s|第[0-9０-９一二三四五六七八九十]+[章節条]|[■◆【]|#+\s)"
+)
+# 新しい段落の始まりとみなす行（発言者・項目名「〇〇:」、箇条書き）
+PARAGRAPH_START_PATTERN = re.compile(r"^(?:[0-9]{1,2}:[0-9]{2}\s|[^\s:：]{1,20}[:：]|[・\-*•●○※])")
+# 文の区切り（句点・感嘆符・疑問符の後。閉じ括弧は前の文に含める）
+SENTENCE_PATTERN = re.compile(r"[^。！？!?]*[。！？!?]+[」』）)]*|[^。！？!?]+$")
+# 見出しの階層に数えない見出し（番号なし）
+UNNUMBERED_HEADING_LEVEL = 1
+
+
+############################################################
+# 関数定義
+############################################################
+
+def split_documents(docs, strategy=None):
+    """
+    Documentをチャンク分割
+
+    Args:
+        docs: 読み込んだDocumentのリスト
+        strategy: "structured"（構造を考慮）または "character"（改行区切りの文字数分割）
+
+    Returns:
+        チャンク分割後のDocumentのリスト
+    """
+    strategy = strategy or ct.CHUNKING_STRATEGY
+    if strategy == "character":
+        # チャンク分割（課題②：定数化）
+        text_splitter = CharacterTextSplitter(
+            chunk_size=ct.CHUNK_SIZE,
+            chunk_overlap=ct.CHUNK_OVERLAP,
+            separator="\n"
+        )
+        return text_splitter.split_documents(docs)
+
+    csv_docs = [doc for doc in docs if "row" in (doc.metadata or {})]
+    text_docs = [doc for doc in docs if "row" not in (doc.metadata or {})]
+
+    chunks = []
+    for doc in text_docs:
+        chunks.extend(split_structured(doc))
+    chunks.extend(group_csv_rows(csv_docs))
+    return chunks
+
+
+def _is_table_line(line):
+    return "\t" in line or line.count("|") >= 2
+
+
+def _heading_level(line):
+    """
+    見出しの階層を判定（見出しでない場合はNone）
+    例: "3. 議題ごとの記録" → 1, "3.2 市場動向" → 2
+    """
+    if len(line) > ct.CHUNK_HEADING_MAX_CHARS or line.endswith(("。", "、")):
+        return None
+    match = HEADING_PATTERN.match(line)
+    if not match:
+        return None
+    number = match.group("number")
+    if number:
+        return len(re.split(r"[.．]", number))
+    return UNNUMBERED_HEADING_LEVEL
+
+
+def _join_wrapped(previous, line):
+    """
+    PDFの折り返しで分断された行を連結（英数字同士の場合のみ空白を挟む）
+    """
+    if previous and line and previous[-1].isascii() and previous[-1].isalnum() \
+            and line[0].isascii() and line[0].isalnum():
+        return previous + " " + line
+    return previous + line
+
+
+def parse_blocks(text):
+    """
+    本文を見出し・段落・表のブロックに分解
+
+    Returns:
+        (種類, 内容, 見出しの階層) のリスト
+        種類は "heading" / "paragraph" / "table"
+    """
+    blocks = []
+    paragraph = ""
+    table = []
+
+    def flush_paragraph():
+        nonlocal paragraph
+        if paragraph.strip():
+            blocks.append(("paragraph", paragraph.strip(), None))
+        paragraph = ""
+
+    def flush_table():
+        if table:
+            blocks.append(("table", "\n".join(table), None))
+            table.clear()
+
+    for raw_line in (text or "").replace("\r\n", "\n").split("\n"):
+        line = raw_line.strip()
+        if not line:
+            flush_paragraph()
+            flush_table()
+            continue
+
+        if _is_table_line(raw_line):
+            flush_paragraph()
+            table.append(line)
+            continue
+        flush_table()
+
+        level = _heading_level(line)
+        if level is not None:
+            flush_paragraph()
+            blocks.append(("heading", line, level))
+            continue
+
+        if PARAGRAPH_START_PATTERN.match(line):
+            flush_paragraph()
+            paragraph = line
+            continue
+
+        # 句点で終わる行の次は新しい段落、それ以外はPDFの折り返しとみなして連結
+        if paragraph.endswith(("。", "！", "？", "!", "?")):
+            flush_paragraph()
+            paragraph = line
+        else:
+            paragraph = _join_wrapped(paragraph, line)
+
+    flush_paragraph()
+    flush_table()
+    return blocks
+
+
+def split_sentences(paragraph):
+    """
+    段落を文に分割
+    """
+    return [s for s in SENTENCE_PATTERN.findall(paragraph) if s.strip()]
+
+
+def _hard_split(text, size, overlap):
+    """
+    区切りのない長い文を文字数で分割
+    """
+    step = max(1, size - overlap)
+    return [text[i:i + size] for i in range(0, len(text), step) if text[i:i + size].strip()]
+
+
+def _split_table(table, size):
+    """
+    大きな表を行単位で分割し、各チャンクの先頭にヘッダー行を付ける
+    """
+    rows = table.split("\n")
+    header, body = rows[0], rows[1:]
+    pieces = []
+    current = [header]
+    for row in body:
+        if len(current) > 1 and len("\n".join(current + [row])) > size:
+            pieces.append("\n".join(current))
+            current = [header]
+        current.append(row)
+    pieces.append("\n".join(current))
+    return pieces
+
+
+def split_structured(doc, size=None, overlap=None):
+    """
+    見出し・段落・表・文の境界を考慮してDocumentをチャンク分割
+    ※見出しの切れ目でチャンクを区切り、各チャンクの先頭に所属する見出しを付けて文脈を補う
+    ※段落・文はチャンクの途中で切らず、溢れた場合のみ直前の文を重複させて次のチャンクを始める
+
+    Returns:
+        チャンク分割後のDocumentのリスト
+    """
+    size = size or ct.CHUNK_SIZE
+    overlap = ct.CHUNK_OVERLAP if overlap is None else overlap
+
+    chunks = []
+    # 現在の見出しの階層 [(階層, 見出し)]
+    headings = []
+    # 作成中のチャンク [(文, 段落の先頭かどうか)]
+    units = []
+    chunk_section = ""
+
+    def section_path():
+        return " > ".join(h for _, h in headings)
+
+    def render(items):
+        text = ""
+        for sentence, starts_paragraph in items:
+            text += ("\n" if text and starts_paragraph else "") + sentence
+        return text
+
+    def flush(keep_overlap):
+        nonlocal units, chunk_section
+        body = render(units)
+        if body.strip():
+            content = body
+            # チャンクが見出しから始まらない場合は、所属する見出しを先頭に付ける
+            if chunk_section and not body.startswith(chunk_section.split(" > ")[-1]):
+                content = f"{chunk_section}\n{body}"
+            metadata = dict(doc.metadata or {})
+            if chunk_section:
+                metadata["section"] = chunk_section
+            chunks.append(Document(page_content=content, metadata=metadata))
+
+        carried = []
+        if keep_overlap:
+            for sentence, starts_paragraph in reversed(units):
+                if len(render(carried)) + len(sentence) > overlap:
+                    break
+                carried.insert(0, (sentence, starts_paragraph))
+        units = carried
+        chunk_section = section_path()
+
+    def add(sentence, starts_paragraph):
+        if units and len(render(units + [(sentence, starts_paragraph)])) > size:
+            flush(keep_overlap=True)
+            # 重複させた文と合わせて溢れる場合は重複なしで始める
+            if units and len(render(units + [(sentence, starts_paragraph)])) > size:
+                units.clear()
+        units.append((sentence, starts_paragraph))
+
+    for kind, content, level in parse_blocks(doc.page_content):
+        if kind == "heading":
+            # 十分な長さがあれば見出しの手前で区切る（短い節は次の節とまとめる）
+            if len(render(units)) >= ct.CHUNK_MIN_SIZE:
+                flush(keep_overlap=False)
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            headings.append((level, content))
+            if not units:
+                chunk_section = section_path()
+            add(content, True)
+            continue
+
+        if kind == "table":
+            pieces = _split_table(content, size) if len(content) > size else [content]
+            for piece in pieces:
+                add(piece, True)
+            continue
+
+        for i, sentence in enumerate(split_sentences(content)):
+            if len(sentence) > size:
+                for j, piece in enumerate(_hard_split(sentence, size, overlap)):
+                    add(piece, i == 0 and j == 0)
+            else:
+                add(sentence, i == 0)
+
+    flush(keep_overlap=False)
+    return chunks
+
+
+def _parse_csv_row(text):
+    """
+    CSVLoaderが作成した「列名: 値」形式の本文を、(列名, 値) のリストへ戻す
+    """
+    fields = []
+    for line in (text or "").split("\n"):
+        key, sep, value = line.partition(": ")
+        if sep:
+            fields.append([key.strip(), value.strip()])
+        elif fields:
+            # 値に改行を含む場合は直前の列の続きとして扱う
+            fields[-1][1] += " " + line.strip()
+    return fields
+
+
+def group_csv_rows(docs, max_chars=None, max_rows=None):
+    """
+    CSVの行（1行1Document）を、ヘッダー行付きの複数行チャンクにまとめる
+    ※1行ずつ埋め込むと小さなチャンクが大量にでき、件数・埋め込みコストが膨らむため
+
+    Returns:
+        チャンクのリスト（メタデータのrowは先頭行、row_endは末尾行の番号）
+    """
+    max_chars = max_chars or ct.CSV_CHUNK_SIZE
+    max_rows = max_rows or ct.CSV_CHUNK_MAX_ROWS
+
+    by_source = {}
+    for doc in docs:
+        by_source.setdefault((doc.metadata or {}).get("source"), []).append(doc)
+
+    chunks = []
+    for source, rows in by_source.items():
+        rows = sorted(rows, key=lambda d: d.metadata.get("row", 0))
+        header = None
+        group = []
+        group_len = 0
+
+        def header_line():
+            return f"{os.path.basename(str(source))}（列: {' | '.join(header)}）"
+
+        def flush():
+            if not group:
+                return
+            first, last = group[0][0], group[-1][0]
+            metadata = dict(first.metadata)
+            metadata["row_end"] = last.metadata.get("row")
+            lines = [header_line()]
+            lines.extend(line for _, line in group)
+            chunks.append(Document(page_content="\n".join(lines), metadata=metadata))
+            group.clear()
+
+        for doc in rows:
+            fields = _parse_csv_row(doc.page_content)
+            columns = [k for k, _ in fields]
+            # 列構成が変わった場合（ヘッダーが異なる）は別のチャンクにする
+            if header is not None and columns != header:
+                flush()
+            header = columns
+            line = " | ".join(v for _, v in fields)
+            # ヘッダー行を含めた文字数で上限を判定する（1行だけで上限を超える場合は、その行だけのチャンクにする）
+            if not group:
+                group_len = len(header_line())
+            if group and (len(group) >= max_rows or group_len + 1 + len(line) > max_chars):
+                flush()
+                group_len = len(header_line())
+            group.append((doc, line))
+            group_len += len(line) + 1
+        flush()
+    return chunks
+
+
+def dedup_group_key(path, data_dir=None):
+    """
+    定型文をまとめて学習するファイルのグループを判定
+    ※議事録フォルダのファイル（PDFの文字起こし・Wordの議事録）は、全体で1グループとする
+      （対になるPDFとWordは本文がほぼ重ならず、定型文はフォルダをまたいで共通のため）
+
+    Args:
+        path: ファイルパス
+        data_dir: 参照先ファイルのフォルダ（未指定時はRAG_TOP_FOLDER_PATH）
+
+    Returns:
+        グループのキー（対象外のファイルはファイルパス自体）
+    """
+    data_dir = data_dir or ct.RAG_TOP_FOLDER_PATH
+    parts = os.path.normpath(os.path.relpath(path, data_dir)).split(os.sep)
+    if len(parts) >= 2 and parts[0] == ct.MEETING_CATEGORY_NAME:
+        return os.path.join(data_dir, ct.MEETING_CATEGORY_NAME)
+    return path
+
+
+def dedup_priority(path):
+    """
+    定型文の学習時の処理順（先に処理したファイルに定型文を残す）
+    ※要点がまとまっているWordの議事録を優先する
+    """
+    extension = os.path.splitext(path)[1].lower()
+    return (0 if extension == ".docx" else 1, path)
+
+
+def learn_boilerplate(files):
+    """
+    グループ内のファイルに共通する段落（定型文）を学習（全体構築時に1回だけ行う）
+
+    Args:
+        files: {ファイルパス: チャンクのリスト}
+
+    Returns:
+        定型文の一覧 [[定型文を残すファイルのパス, 正規化した段落]]（BoilerplateFilterに渡す）
+    """
+    dedup = NearDuplicateFilter()
+    for path in sorted(files, key=dedup_priority):
+        for chunk in files[path]:
+            dedup.deduplicate(chunk.page_content, path)
+    # 同じ定型文が複数のファイルで取り除かれた場合も、一覧には1件だけ記録する
+    return [list(entry) for entry in dict.fromkeys(dedup.boilerplate)]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class NearDuplicateFilter:
+    """
+    同じグループの他のファイルに既に含まれる段落（定型文）を、チャンクから取り除くフィルタ
+    ※ファイルを優先順に1件ずつ処理し、段落の文字n-gram（シングル）のうち、先に処理した他のファイルのシングルに
+      含まれる割合（包含率）で判定する（全体構築時の定型文の学習に使う）
+    ※同じファイル内の段落とは比較しない（チャンク間の重複部分や、ファイル内で繰り返す見出しを残すため）
+    """
+
+    def __init__(self, threshold=None, shingle_size=None, min_paragraph_chars=None):
+        self.threshold = ct.CHUNK_DEDUP_THRESHOLD if threshold is None else threshold
+        self.shingle_size = shingle_size or ct.CHUNK_DEDUP_SHINGLE_SIZE
+        self.min_paragraph_chars = min_paragraph_chars or ct.CHUNK_DEDUP_MIN_PARAGRAPH_CHARS
+        # 処理済みのファイルのシングルと、そのシングルを最初に含んでいたファイル
+        self._owners = {}
+        # 処理中のファイルのシングル（次のファイルに移った時点で_ownersに加える）
+        self._current_source = None
+        self._current = set()
+        # 取り除いた段落と、その段落を残したファイルの組 [(ファイルパス, 正規化した段落)]
+        self.boilerplate = []
+        self.paragraphs_removed = 0
+
+    def _normalize(self, text):
+        return "".join(unicodedata.normalize("NFKC", text or "").split())
+
+    def _shingles(self, text):
+        n = self.shingle_size
+        if len(text) <= n:
+            return {text}
+        return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+    def _filter_lines(self, text, is_duplicate):
+        """
+        チャンクの各段落を判定し、重複する段落を取り除く
+        ※見出し・短い行（項目名など）は判定せずに残す
+
+        Returns:
+            取り除いた後の本文（判定対象の段落がすべて重複していた場合はNone）
+        """
+        lines = []
+        checked = 0
+        removed = 0
+        for line in (text or "").split("\n"):
+            normalized = self._normalize(line)
+            if len(normalized) < self.min_paragraph_chars or _heading_level(line.strip()) is not None:
+                lines.append(line)
+                continue
+            checked += 1
+            if is_duplicate(normalized, self._shingles(normalized)):
+                removed += 1
+                continue
+            lines.append(line)
+
+        self.paragraphs_removed += removed
+        if checked and removed == checked:
+            return None
+        return "\n".join(lines)
+
+    def deduplicate(self, text, source):
+        """
+        チャンクから、先に処理した他のファイルの段落とほぼ同一の段落を取り除く
+
+        Returns:
+            取り除いた後の本文（判定対象の段落がすべて重複していた場合はNone）
+        """
+        if source != self._current_source:
+            for shingle in self._current:
+                self._owners.setdefault(shingle, self._current_source)
+            self._current = set()
+            self._current_source = source
+
+        def is_duplicate(normalized, shingles):
+            self._current |= shingles
+            owners = Counter(self._owners[s] for s in shingles if s in self._owners)
+            if sum(owners.values()) / len(shingles) < self.threshold:
+                return False
+            # 最も多くのシングルを含んでいたファイルを、この段落を残すファイルとする
+            self.boilerplate.append((owners.most_common(1)[0][0], normalized))
+            return True
+
+        return self._filter_lines(text, is_duplicate)
+
+
+class BoilerplateFilter(NearDuplicateFilter):
+    """
+    全体構築時に学習した定型文の一覧（learn_boilerplate）で、チャンクから定型文を取り除くフィルタ
+    ※ファイルごとに固定の一覧と比較するため、他のファイルの追加・更新・削除で結果が変わらない
+    ※定型文を残すファイル（学習時に最初に含んでいたファイル）からは取り除かない
+    """
+
+    def __init__(self, boilerplate, **kwargs):
+        """
+        Args:
+            boilerplate: [(定型文を残すファイルのパス, 正規化した段落)]
+        """
+        super().__init__(**kwargs)
+        self.boilerplate = [tuple(entry) for entry in boilerplate]
+        # ファイルごとの比較対象のシングル（そのファイルが残す定型文を除く）
+        self._references = {}
+
+    def deduplicate(self, text, source):
+        """
+        チャンクから、定型文の一覧とほぼ同一の段落を取り除く
+
+        Returns:
+            取り除いた後の本文（判定対象の段落がすべて定型文だった場合はNone）
+        """
+        reference = self._references.get(source)
+        if reference is None:
+            reference = set()
+            for owner, paragraph in self.boilerplate:
+                if owner != source:
+                    reference |= self._shingles(paragraph)
+            self._references[source] = reference
+
+        def is_duplicate(normalized, shingles):
+            return bool(reference) and len(shingles & reference) / len(shingles) >= self.threshold
+
+        return self._filter_lines(text, is_duplicate)
@@ -8,6 +8,7 @@
 import os
 import streamlit as st
 import utils
+import metrics
 import constants as ct
 
 
@@ -155,6 +156,9 @@ def display_conversation_log():
                     icon = utils.get_source_icon(main_file_path)
                     st.success(main_file_path, icon=icon)
 
+                if content.get("main_snippet"):
+                    st.caption(content["main_snippet"])
+
                 sub_message = content.get("sub_message")
                 sub_choices = _normalize_sub_choices(content.get("sub_choices"))
 
@@ -186,6 +190,7 @@ def display_conversation_log():
 # LLMレスポンス表示（検索）
 ############################################################
 
+@metrics.timed("render")
 def display_search_llm_response(llm_response):
     """
     「社内文書検索」モードにおけるLLMレスポンスを表示し、
@@ -220,6 +225,11 @@ def display_search_llm_response(llm_response):
         icon = utils.get_source_icon(main_display)
         st.success(main_display, icon=icon)
 
+    # 検索のみ（回答生成なし）の場合は、該当箇所の抜粋を添える
+    main_snippet = (getattr(context_docs[0], "metadata", {}) or {}).get("snippet", "")
+    if main_snippet:
+        st.caption(main_snippet)
+
     sub_candidates = []
     for doc in context_docs[1:]:
         s = _format_source_with_page(doc)
@@ -232,6 +242,8 @@ def display_search_llm_response(llm_response):
         "main_message": main_message,
         "main_file_path": main_display,
     }
+    if main_snippet:
+        content["main_snippet"] = main_snippet
 
     if sub_candidates:
         sub_message = "その他、ファイルありかの候補を提示します。"
@@ -251,11 +263,16 @@ def display_search_llm_response(llm_response):
 # LLMレスポンス表示（問い合わせ）
 ############################################################
 
+@metrics.timed("render")
 def display_inquiry_llm_response(llm_response):
     """
     「社内問い合わせ」モードにおけるLLMレスポンスを表示し、
     画面表示用の辞書を返す（落ちない完全安定版）
+    ※utils.stream_llm_responseのイテレータを渡した場合は、トークンの到着に合わせて逐次表示する
     """
+    if not isinstance(llm_response, dict):
+        return _display_inquiry_llm_stream(llm_response)
+
     context_docs = llm_response.get("context") or []
     answer_text = _get_answer_text(llm_response)
 
@@ -264,6 +281,53 @@ def display_inquiry_llm_response(llm_response):
 
     st.markdown(final_answer)
 
+    content = {
+        "mode": ct.ANSWER_MODE_2,
+        "answer": final_answer,
+    }
+    content.update(_display_inquiry_sources(context_docs))
+
+    return content
+
+
+def _display_inquiry_llm_stream(events):
+    """
+    「社内問い合わせ」モードの回答をストリーミング表示
+    ※情報源は検索完了時点で回答欄の下に表示し、回答本文はトークンごとに更新する
+    """
+    answer_box = st.empty()
+    sources_box = st.container()
+
+    answer_parts = []
+    source_content = {}
+
+    for event in events:
+        if "context" in event:
+            with sources_box:
+                source_content = _display_inquiry_sources(event["context"] or [])
+
+        token = event.get("answer")
+        if token:
+            answer_parts.append(token)
+            answer_box.markdown("".join(answer_parts) + ct.STREAMING_CURSOR)
+
+    no_match = getattr(ct, "INQUIRY_NO_MATCH_ANSWER", "回答に必要な情報が見つかりませんでした。")
+    final_answer = "".join(answer_parts) or no_match
+    answer_box.markdown(final_answer)
+
+    content = {
+        "mode": ct.ANSWER_MODE_2,
+        "answer": final_answer,
+    }
+    content.update(source_content)
+
+    return content
+
+
+def _display_inquiry_sources(context_docs):
+    """
+    「社内問い合わせ」モードの情報源を表示し、画面表示用の辞書に追加する項目を返す
+    """
     # 情報源（PDFのみページ付き）
     sources = []
     for doc in context_docs:
@@ -272,23 +336,17 @@ def display_inquiry_llm_response(llm_response):
             sources.append(s)
     sources = _unique_in_order(sources)
 
-    content = {
-        "mode": ct.ANSWER_MODE_2,
-        "answer": final_answer,
-    }
-
     # 情報源があるときだけ付与
-    if sources:
-        st.divider()
-        st.markdown("##### 情報源")
-        for s in sources:
-            icon = utils.get_source_icon(s)
-            st.info(s, icon=icon)
+    if not sources:
+        return {}
 
-        content["message"] = "情報源"
-        content["file_info_list"] = sources
+    st.divider()
+    st.markdown("##### 情報源")
+    for s in sources:
+        icon = utils.get_source_icon(s)
+        st.info(s, icon=icon)
 
-    return content
+    return {"message": "情報源", "file_info_list": sources}
 
 
 # ==========================================================
@@ -1,6 +1,3 @@
-from langchain_community.document_loaders import PyMuPDFLoader, Docx2txtLoader, TextLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
-
 APP_NAME = "社内情報特化型生成AI検索アプリ"
 ANSWER_MODE_1 = "社内文書検索"
 ANSWER_MODE_2 = "社内問い合わせ"
@@ -10,32 +7,291 @@ LINK_SOURCE_ICON = ":material/link: "
 WARNING_ICON = ":material/warning:"
 ERROR_ICON = ":material/error:"
 SPINNER_TEXT = "回答生成中..."
+INDEX_LOADING_TEXT = "検索インデックスを準備しています..."
+# 検索インデックスの準備完了後、バックグラウンドで事前に読み込む回答生成用のモジュール
+PREWARM_MODULES = ["chain_factory", "doc_search", "query_rewriter", "answer_cache", "structured_query"]
+# 「社内問い合わせ」モードの回答をトークン単位で逐次表示するか
+STREAMING_ENABLED = True
+STREAMING_CURSOR = "▌"
 
 LOG_DIR_PATH = "./logs"
 LOGGER_NAME = "ApplicationLog"
 LOG_FILE = "application.log"
 APP_BOOT_MESSAGE = "アプリが起動されました。"
 
+# 質問1件ごとの処理段階別の所要時間（JSON形式でログ出力し、プロセス内で集計する）
+METRICS_ENABLED = True
+# 集計値を返すHTTPエンドポイント（Prometheus形式：/metrics、JSON形式：/metrics.json）
+METRICS_SERVER_ENABLED = True
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9464
+# パーセンタイルの算出に使う直近の計測数（処理段階ごと）
+METRICS_WINDOW_SIZE = 1000
+METRICS_QUANTILES = [0.5, 0.95, 0.99]
+# 処理段階（読み込み・質問文の書き換え・回答キャッシュ検索・回答生成の順番待ち・検索・再ランキング・回答生成・画面表示）
+METRICS_STAGES = ["load", "rewrite", "cache_lookup", "queue", "retrieve", "rerank", "generate", "render"]
+
 MODEL = "gpt-4o-mini"
 TEMPERATURE = 0.5
+# 回答生成・質問文の書き換えに使うLLM（"openai" または APIを呼ばない計測用の "fake"）
+LLM_BACKEND = "openai"
+# 計測用LLMの疑似的な応答時間（初回トークンまでの秒数・トークンごとの秒数）と回答の長さ（文字数）
+FAKE_LLM_FIRST_TOKEN_SEC = 0.0
+FAKE_LLM_TOKEN_INTERVAL_SEC = 0.0
+FAKE_LLM_ANSWER_CHARS = 200
+
+# LLM呼び出し用HTTPクライアント（プロセス内で共有し、接続を再利用する）
+LLM_HTTP_MAX_CONNECTIONS = 50
+LLM_HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+LLM_HTTP_TIMEOUT_SEC = 60.0
+
+# 回答生成（LLM呼び出しを伴う検索・回答生成）のプロセス内での同時実行数の上限
+ADMISSION_ENABLED = True
+ADMISSION_MAX_CONCURRENCY = 16
+# 上限に達している間に順番を待てる問い合わせ数と、待ち時間の上限（秒）※超えた場合は混雑中のメッセージを返す
+ADMISSION_MAX_QUEUE = 64
+ADMISSION_QUEUE_TIMEOUT_SEC = 20.0
+# 混雑中に再試行を促すまでの秒数（APIのRetry-Afterヘッダー）
+ADMISSION_RETRY_AFTER_SEC = 5
+# 会話履歴のない同じ質問（正規化後の文面・回答モード・インデックスの版が同じ）が処理中の場合、その回答を共有する
+REQUEST_COALESCING_ENABLED = True
+
+# 検索・回答APIのサービス（rag_service.py）
+# ※URLを設定した場合（環境変数 RAG_SERVICE_URL でも可）、画面はインデックスを開かずにサービスへ問い合わせる
+RAG_SERVICE_URL = ""
+RAG_SERVICE_HOST = "127.0.0.1"
+RAG_SERVICE_PORT = 8000
+RAG_SERVICE_LOG_FILE = "rag_service.log"
+# 検索・回答生成を同時に実行するスレッド数（ストリーミング中の回答も1件につき1スレッドを使う）
+RAG_SERVICE_WORKER_THREADS = 40
+# 画面からサービスへの問い合わせのタイムアウト（秒）と、接続の上限数
+RAG_SERVICE_TIMEOUT_SEC = 120.0
+RAG_SERVICE_MAX_CONNECTIONS = 50
 
 RAG_TOP_FOLDER_PATH = "./data"
+# フォルダ構成から作成するメタデータ（顧客フォルダ配下は「既存/見込み」「会社名」も付与）
+CUSTOMER_FOLDER_NAME = "顧客"
+MEETING_CATEGORY_NAME = "MTG議事録"
+WEB_CATEGORY_NAME = "Web"
+# 検索時の絞り込みに使えるメタデータ
+FILTERABLE_METADATA_KEYS = ["category", "topic", "customer_status", "company", "doc_type"]
 
 # ▼課題①②用（マジックナンバー排除）
 TOP_K = 5
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 50
 
+# チャンク分割方式（"structured": 見出し・段落・表・文の境界を考慮 / "character": 改行区切りの文字数分割）
+CHUNKING_STRATEGY = "structured"
+# 見出しの手前でチャンクを区切る最小文字数（これ未満の短い節は次の節とまとめる）
+CHUNK_MIN_SIZE = 300
+# 見出しとみなす行の最大文字数
+CHUNK_HEADING_MAX_CHARS = 40
+# CSVの行をまとめる際の1チャンクあたりの最大文字数（先頭の列名の行を含む）・最大行数
+# ※1行が短い定型の項目のため、CHUNK_SIZEより大きくして列名の行の繰り返しと件数を抑える（埋め込みの上限には十分収まる）
+CSV_CHUNK_SIZE = 1500
+CSV_CHUNK_MAX_ROWS = 8
+# 議事録のファイル間で重複（定型文）とみなす段落の割合（段落の文字n-gramのうち、他のファイルに含まれる割合）
+CHUNK_DEDUP_THRESHOLD = 0.8
+CHUNK_DEDUP_SHINGLE_SIZE = 5
+# この文字数未満の短い行（見出し・項目名など）は重複の判定をせずに残す
+CHUNK_DEDUP_MIN_PARAGRAPH_CHARS = 15
+
+# 検索方式（"hybrid": BM25 + ベクトル検索をRRFで統合 / "vector": ベクトル検索のみ）
+RETRIEVER_MODE = "hybrid"
+# ハイブリッド検索で各検索方式から取得する候補数
+HYBRID_FETCH_K = 20
+HYBRID_RRF_K = 60
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# 回答生成の前に、多めに取得した候補を再ランキングして件数を適応的に決める回答モード
+RERANK_MODES = [ANSWER_MODE_2]
+# スコアラー（"lexical": 語彙の一致度 / "cross_encoder": 小型のCross-Encoder。sentence-transformersが必要）
+RERANK_SCORER = "lexical"
+RERANK_CROSS_ENCODER_MODEL = "hotchpotch/japanese-reranker-cross-encoder-xsmall-v1"
+# 再ランキングの候補数
+RERANK_FETCH_K = 40
+# 回答生成に渡すチャンク数の下限・上限
+RERANK_MIN_K = 2
+RERANK_MAX_K = 8
+# 最上位のスコアに対してこの割合を下回る候補は渡さない
+RERANK_RELATIVE_THRESHOLD = 0.6
+# 直前の候補からスコアがこの割合以上落ち込んだ時点で打ち切る
+RERANK_SCORE_GAP_RATIO = 0.3
+# 回答生成に渡すチャンクの合計トークン数の上限
+RERANK_CONTEXT_TOKEN_BUDGET = 2000
+# 語彙一致のスコアに加味する、検索時の順位の重み
+RERANK_RANK_WEIGHT = 0.3
+
+# 「社内文書検索」モードはLLMを呼ばず、検索スコアをファイル単位に集約して返す
+DOC_SEARCH_RETRIEVAL_ONLY = True
+# ファイル単位の集約方法（"max": 最も関連の強いチャンク / "sum": 関連チャンクの合計）
+DOC_SEARCH_POOLING = "max"
+DOC_SEARCH_FETCH_K = 30
+DOC_SEARCH_SNIPPET_CHARS = 120
+
+# 質問文から検索範囲を推定して絞り込む回答モード
+QUERY_ROUTER_MODES = [ANSWER_MODE_1]
+QUERY_ROUTER_CUSTOMER_STATUS_KEYWORDS = {
+    "既存": ["既存顧客", "既存のお客様", "既存取引先"],
+    "見込み": ["見込み顧客", "見込み客", "見込みのお客様", "商談中"],
+}
+QUERY_ROUTER_CATEGORY_KEYWORDS = {
+    MEETING_CATEGORY_NAME: ["議事録", "MTG", "ミーティング", "会議"],
+    "社員について": ["社員名簿", "従業員", "社員情報"],
+    "サービスについて": ["サービス", "EcoTee", "利用ガイド", "デザイン"],
+    "会社について": ["会社概要", "株主", "優待", "環境", "エシカル"],
+    "顧客について": ["お客様情報", "顧客情報"],
+}
+
+# プロセス共有のベクターストア
+VECTOR_STORE_COLLECTION_NAME = "company_docs"
+# ベクターストアの種類（"chroma" または 埋め込みを1つの行列で保持する "numpy"）
+VECTOR_STORE_BACKEND = "chroma"
+# numpyのベクターストアでの埋め込みの保持形式（"float32" / "float16" / "int8"）
+# ※float16は約1/2、int8は約1/4のメモリで保持する（int8は行ごとの倍率で量子化）
+# ※float16・int8は検索のたびにfloat32へ戻すため、1件ずつの検索はfloat32より遅い（まとめて検索すると差は小さい）
+NUMPY_STORE_DTYPE = "float32"
+# ディスク上の埋め込みをメモリマップで開くか（複数プロセス間でページキャッシュを共有できる）
+NUMPY_STORE_MMAP = True
+# float16・int8の行列をfloat32へ戻して内積を計算する際の1ブロックあたりの行数（一時メモリの上限）
+NUMPY_STORE_BLOCK_ROWS = 4096
+
+# ディスク上のインデックス（indexer.pyで構築・差分更新）
+INDEX_DIR_PATH = "./index"
+INDEX_MANIFEST_FILE = "manifest.json"
+# インデックスの更新時に、検索用コーパスの読み取り専用スナップショットを書き出し、起動時はそれをメモリマップで開く
+# ※同じホスト上の複数のワーカープロセスが1つの物理メモリを共有でき、ベクターストアを開かずに検索を始められる
+CORPUS_SNAPSHOT_ENABLED = True
+CORPUS_SNAPSHOT_FILE = "corpus.snapshot"
+INDEX_SCHEMA_VERSION = 5
+# インデックス未作成時のみ、アプリ起動時に構築するか（Falseの場合は起動エラー）
+INDEX_BUILD_ON_BOOT_IF_MISSING = True
+
+# 起動中のインデックス自動更新（dataフォルダの変更を検知し、バックグラウンドで差分更新して切り替える）
+# ※同じホストの複数のワーカープロセスのうち、ロックファイルを取得した1プロセスのみが更新・公開し、
+#   他のプロセスは公開された最新の版を開くだけにする（再起動後も公開された最新の版を開く）
+INDEX_HOT_RELOAD_ENABLED = True
+# 更新版のインデックスの保存先（版ごとにサブフォルダを作成）
+INDEX_VERSIONS_DIR_PATH = "./index_versions"
+# 公開した最新の版の情報・更新を担当するプロセスのロックファイル（INDEX_VERSIONS_DIR_PATH配下）
+INDEX_PUBLISHED_FILE = "published.json"
+INDEX_RELOAD_LOCK_FILE = "reload.lock"
+# 保持する版の数（これを超えた古い版も、INDEX_RETIRE_GRACE_SECが経過するまでは削除しない）
+INDEX_KEEP_VERSIONS = 2
+# 切り替え前の版を削除するまでの猶予（秒）
+# ※切り替え前に版を取得した質問が処理を終えるまで残すため、他のワーカープロセスが新しい版に切り替えるまでの
+#   時間（INDEX_RELOAD_POLL_INTERVAL_SEC）・受付待ち（ADMISSION_QUEUE_TIMEOUT_SEC）・回答生成（RAG_SERVICE_TIMEOUT_SEC）の
+#   上限の合計より長くする
+INDEX_RETIRE_GRACE_SEC = 300.0
+# 変更の確認間隔（秒）※ファイル監視（watchdog）が使えない環境ではこの間隔でのみ確認する
+INDEX_RELOAD_POLL_INTERVAL_SEC = 10.0
+# ファイル変更の通知後、続けて変更されなくなるまで待つ時間（秒）
+INDEX_RELOAD_DEBOUNCE_SEC = 1.0
+# 監視状態の出力先（INDEX_VERSIONS_DIR_PATH配下）
+INDEX_STATUS_FILE = "status.json"
+
+# ファイル読み込みの並列化（Noneの場合はCPU数、1の場合はプロセスを使わず逐次読み込み）
+INGEST_MAX_WORKERS = None
+# ワーカー1つあたりの投入済み・未回収ファイル数の上限（メモリ使用量の抑制）
+INGEST_QUEUE_SIZE_PER_WORKER = 2
+# ファイル読み込みのワーカープロセスの起動方式（"forkserver" / "spawn"。未対応の環境では"spawn"）
+INGEST_MP_START_METHOD = "forkserver"
+
+# 埋め込み処理（"openai" または APIを呼ばない計測用の "fake"）
+EMBEDDING_BACKEND = "openai"
+EMBEDDING_BATCH_SIZE = 256
+EMBEDDING_MAX_CONCURRENCY = 4
+EMBEDDING_MAX_BATCH_TOKENS = 100000
+EMBEDDING_TOKEN_ENCODING = "cl100k_base"
+EMBEDDING_MAX_RETRIES = 6
+EMBEDDING_BACKOFF_BASE_SEC = 1.0
+EMBEDDING_BACKOFF_MAX_SEC = 60.0
+# この件数の追加チャンクが溜まるごとにまとめて埋め込み・登録する
+EMBEDDING_FLUSH_SIZE = 1024
+FAKE_EMBEDDING_SIZE = 256
+# 質問文の埋め込み（検索時・回答キャッシュの照合時）のLRUキャッシュの件数（0の場合はキャッシュしない）
+QUERY_EMBEDDING_CACHE_SIZE = 4096
+# 同時に届いた質問をまとめて埋め込む際の待ち時間（ミリ秒）と、1回にまとめる最大件数
+QUERY_EMBEDDING_BATCH_WAIT_MS = 5
+QUERY_EMBEDDING_MAX_BATCH_SIZE = 64
+
+# 拡張子ごとのローダー（"モジュール.クラス名", 追加の引数）
+# ※ローダーのimportは重いため、名前で定義して初めて読み込むときに解決する
 SUPPORTED_EXTENSIONS = {
-    ".pdf": PyMuPDFLoader,
-    ".docx": Docx2txtLoader,
-    ".csv": lambda path: CSVLoader(path, encoding="utf-8"),
-    ".txt": lambda path: TextLoader(path, encoding="utf-8"),  # ←課題⑤
+    ".pdf": ("langchain_community.document_loaders.PyMuPDFLoader", {}),
+    ".docx": ("langchain_community.document_loaders.Docx2txtLoader", {}),
+    ".csv": ("langchain_community.document_loaders.csv_loader.CSVLoader", {"encoding": "utf-8"}),
+    ".txt": ("langchain_community.document_loaders.TextLoader", {"encoding": "utf-8"}),  # ←課題⑤
 }
 
 WEB_URL_LOAD_TARGETS = [
     "https://generative-ai.web-camp.io/"
 ]
+# Webページの取得（ホストごとの同時接続数・タイムアウト）
+WEB_PER_HOST_CONCURRENCY = 2
+WEB_MAX_CONNECTIONS = 10
+WEB_FETCH_TIMEOUT_SEC = 10.0
+WEB_USER_AGENT = "company-search-indexer"
+# ETag・Last-Modified付きで取得したページのキャッシュ（インデックスの保存先の配下）
+WEB_CACHE_DIR_NAME = "web_cache"
+
+# 質問文の独立化（書き換え）を省略する判定
+# ※以下の語を含む質問・短すぎる質問は会話履歴に依存するとみなしてLLMで書き換える
+REWRITE_REFERENCE_MARKERS = [
+    "それ", "その", "これ", "この", "あれ", "あの", "どれ", "前述", "上記", "先ほど", "さっき",
+    "前の", "同じ", "他に", "ほかに", "他の", "ほかの", "もっと", "さらに", "詳しく", "続き",
+    "彼", "彼女", "そこ", "ここ", "そちら", "こちら", "そっち", "一方", "逆に",
+]
+REWRITE_MIN_SELF_CONTAINED_CHARS = 8
+REWRITE_CACHE_SIZE = 1000
+
+# LLMに渡す会話履歴の上限（トークン数）
+HISTORY_TOKEN_BUDGET = 2000
+# 上限に関わらず必ず残す直近の往復数
+HISTORY_PINNED_TURNS = 2
+# 上限を超えた古い往復は、質問・回答の冒頭だけを要約欄に残す
+HISTORY_SUMMARY_HEADER = "これまでの会話の要点:"
+HISTORY_SUMMARY_CHARS_PER_TURN = 60
+HISTORY_SUMMARY_MAX_TOKENS = 400
+CHAT_TOKEN_ENCODING = "o200k_base"
+CHAT_MESSAGE_OVERHEAD_TOKENS = 4
+
+# 類似質問の回答キャッシュ
+ANSWER_CACHE_ENABLED = True
+ANSWER_CACHE_MODES = [ANSWER_MODE_2]
+# 質問ベクトルのコサイン類似度がこの値以上ならキャッシュの回答を返す
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95
+ANSWER_CACHE_TTL_SEC = 60 * 60
+ANSWER_CACHE_MAX_ENTRIES = 1000
+ANSWER_CACHE_MAX_BYTES = 64 * 1024 * 1024
+
+# 表形式データ（CSV）への絞り込み・一覧・件数の質問は、RAGを使わずテーブルから直接回答する
+STRUCTURED_QUERY_ENABLED = True
+STRUCTURED_QUERY_MODES = [ANSWER_MODE_2]
+STRUCTURED_QUERY_EXTENSIONS = [".csv"]
+# 値の種類が行数に対してこの割合以下の列に索引を作成する（氏名・メールアドレスなどは対象外）
+STRUCTURED_QUERY_INDEX_MAX_DISTINCT_RATIO = 0.5
+# この割合以上の行で区切り文字を含む列は、複数の値を持つ列として値ごとに索引を作成する
+STRUCTURED_QUERY_MULTI_VALUE_SEPARATOR = ","
+STRUCTURED_QUERY_MULTI_VALUE_MIN_RATIO = 0.3
+# 数値条件の単位と対象の列（例: 「40歳以上」「30代」）
+STRUCTURED_QUERY_NUMBER_UNITS = {"歳": "年齢", "才": "年齢", "代": "年齢"}
+# テーブルの対象を表す語
+# ※テーブル名・列名・これらの語・人数を尋ねる語のいずれかを含む質問のみ、テーブルを対象とした質問とみなす
+# ※索引の値と同じ語（役職の「スタッフ」など）は、列名と併せて指定された場合のみ絞り込みに使う
+STRUCTURED_QUERY_SUBJECT_KEYWORDS = ["社員", "従業員", "名簿", "スタッフ", "メンバー"]
+# 人数を尋ねる語（「いくつ」「件数」は人数以外の質問にも使われるため含めない）
+STRUCTURED_QUERY_HEADCOUNT_KEYWORDS = ["何人", "何名", "人数"]
+# 質問の種類を判定する語
+STRUCTURED_QUERY_LIST_KEYWORDS = ["一覧", "リスト", "全員", "列挙", "洗い出", "表にして", "表で", "誰"]
+STRUCTURED_QUERY_COUNT_KEYWORDS = STRUCTURED_QUERY_HEADCOUNT_KEYWORDS + ["数は"]
+STRUCTURED_QUERY_AVERAGE_KEYWORDS = ["平均"]
+STRUCTURED_QUERY_GROUP_KEYWORDS = ["ごと", "別の", "別に", "内訳"]
+# 絞り込み・数値条件・質問の種類のいずれにも当たらなくても、テーブルへの質問に含まれうる語
+# ※これ以外の語（漢字・カタカナ・英数字）が残る質問（「営業部の売上目標」「人事部長」など）は通常のRAGで回答する
+STRUCTURED_QUERY_GENERIC_WORDS = ["教えて", "所属", "在籍", "持つ", "情報", "データ", "該当", "一覧化", "全", "数", "何"]
 
 SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT = "会話履歴と最新の入力をもとに、会話履歴なしでも理解できる独立した入力テキストを生成してください。"
 
@@ -58,4 +314,5 @@ INITIALIZE_ERROR_MESSAGE = "初期化処理に失敗しました。"
 NO_DOC_MATCH_MESSAGE = "入力内容と関連する社内文書が見つかりませんでした。"
 CONVERSATION_LOG_ERROR_MESSAGE = "過去の会話履歴の表示に失敗しました。"
 GET_LLM_RESPONSE_ERROR_MESSAGE = "回答生成に失敗しました。"
+OVERLOADED_MESSAGE = "現在アクセスが集中しているため、回答を生成できませんでした。しばらく待ってから再度お試しください。"
 DISP_ANSWER_ERROR_MESSAGE = "回答表示に失敗しました。"
\ No newline at end of file
@@ -0,0 +1,565 @@
+"""
+このファイルは、検索に使うコーパス（チャンクの本文・メタデータ・埋め込み・BM25の転置インデックス）を
+1つの読み取り専用ファイル（スナップショット）に書き出し、メモリマップで開くためのファイルです。
+本文は1つの文字列領域とオフセット配列、メタデータは列ごとの辞書符号化した配列、埋め込みは連続した行列で保持し、
+開く際にPythonのオブジェクトへ展開しないため、同じホスト上の複数のワーカープロセスが1つの物理メモリを共有でき、
+ワーカーの起動時もインデックスの読み込みを待たずに検索を始められます。
+
+    python corpus_snapshot.py                     # ./index のスナップショットを書き出す
+    python corpus_snapshot.py --index-dir ./index --info
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import time
+import struct
+import hashlib
+import argparse
+import logging
+from collections.abc import Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+import constants as ct
+import indexer
+import embedding_client
+from hybrid_retriever import BM25Index, HybridRetriever, tokenize
+from numpy_vector_store import NumpyVectorStore, StoreState, normalize_rows, quantize
+from query_router import QueryRouter, to_chroma_filter
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+SNAPSHOT_MAGIC = b"RAGSNAP\x01"
+SNAPSHOT_FORMAT_VERSION = 1
+# 各領域の先頭位置の境界（バイト）
+SECTION_ALIGNMENT = 64
+# メタデータの列で値がないことを表す符号
+MISSING_CODE = -1
+
+
+############################################################
+# 関数定義（書き出し）
+############################################################
+
+def snapshot_path(index_dir=None):
+    """
+    スナップショットのパスを取得
+    """
+    return os.path.join(index_dir or ct.INDEX_DIR_PATH, ct.CORPUS_SNAPSHOT_FILE)
+
+
+def token_hash(token):
+    """
+    BM25のトークンを64bitの値に変換（トークン表を文字列のまま持たず、二分探索で引けるようにする）
+    """
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def _string_arena(texts):
+    """
+    文字列のリストを、連結したUTF-8のバイト列とオフセット配列（件数 + 1）に変換
+    """
+    encoded = [(t or "").encode("utf-8") for t in texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in encoded], out=offsets[1:])
+    return np.frombuffer(b"".join(encoded), dtype=np.uint8), offsets
+
+
+def _metadata_columns(metadatas):
+    """
+    メタデータを列ごとに辞書符号化（列ごとの値の一覧 + チャンクごとの符号）
+
+    Returns:
+        (列情報のリスト, 符号の行列（列数 × チャンク数）)
+    """
+    keys = list(dict.fromkeys(key for meta in metadatas for key in (meta or {})))
+    columns = []
+    codes = np.full((len(keys), len(metadatas)), MISSING_CODE, dtype=np.int32)
+    for c, key in enumerate(keys):
+        values = {}
+        for i, meta in enumerate(metadatas):
+            if key not in (meta or {}):
+                continue
+            value = meta[key]
+            # 真偽値と整数（True と 1）を別の値として扱う
+            lookup = (type(value).__name__, value)
+            if lookup not in values:
+                values[lookup] = len(values)
+            codes[c, i] = values[lookup]
+        columns.append({"key": key, "values": [value for _, value in values]})
+    return columns, codes
+
+
+def _bm25_arrays(texts, metadatas):
+    """
+    BM25の転置インデックスを、トークンのハッシュ順に並べたCSR形式の配列に変換
+    ※スコアの計算式を共通にするため、転置インデックス自体はBM25Indexで作成する
+    """
+    bm25 = BM25Index(Document(page_content=t, metadata=m) for t, m in zip(texts, metadatas))
+    tokens = sorted(bm25.postings, key=token_hash)
+    hashes = np.array([token_hash(t) for t in tokens], dtype=np.uint64)
+    if len(np.unique(hashes)) != len(hashes):
+        raise ValueError("トークンのハッシュが衝突しました。")
+
+    indptr = np.zeros(len(tokens) + 1, dtype=np.int64)
+    np.cumsum([len(bm25.postings[t]) for t in tokens], out=indptr[1:])
+    doc_ids = np.array([i for t in tokens for i, _ in bm25.postings[t]], dtype=np.int32)
+    tfs = np.array([tf for t in tokens for _, tf in bm25.postings[t]], dtype=np.int32)
+    return {
+        "bm25_token_hashes": hashes,
+        "bm25_indptr": indptr,
+        "bm25_doc_ids": doc_ids,
+        "bm25_tfs": tfs,
+        "bm25_idf": np.array([bm25.idf[t] for t in tokens], dtype=np.float64),
+        "bm25_doc_lengths": np.array(bm25.doc_lengths, dtype=np.int32),
+    }, {"k1": bm25.k1, "b": bm25.b, "avg_doc_length": bm25.avg_doc_length}
+
+
+def _store_contents(db):
+    """
+    ベクターストアから本文・メタデータ・埋め込みを取得
+
+    Returns:
+        (IDのリスト, 本文のリスト, メタデータのリスト, 埋め込み, int8の倍率, 保持形式)
+    """
+    if isinstance(db, NumpyVectorStore):
+        state = db._state
+        return (
+            list(state.ids), list(state.texts), list(state.metadatas),
+            state.vectors, state.scales, db.dtype,
+        )
+
+    data = db.get(include=["documents", "metadatas", "embeddings"])
+    dtype = ct.NUMPY_STORE_DTYPE
+    vectors, scales = (None, None)
+    if len(data["ids"]):
+        vectors, scales = quantize(normalize_rows(data["embeddings"]), dtype)
+    return data["ids"], data["documents"], data["metadatas"], vectors, scales, dtype
+
+
+def write_snapshot(db, index_dir=None, manifest=None):
+    """
+    ベクターストアの中身をスナップショットとして書き出す（一時ファイル経由で置き換え）
+
+    Returns:
+        書き出した内容の集計
+    """
+    started = time.perf_counter()
+    manifest = manifest or indexer.load_manifest(index_dir)
+    ids, texts, metadatas, vectors, scales, dtype = _store_contents(db)
+    metadatas = [meta or {} for meta in metadatas]
+
+    sections = {}
+    sections["text_arena"], sections["text_offsets"] = _string_arena(texts)
+    sections["id_arena"], sections["id_offsets"] = _string_arena(ids)
+    columns, sections["metadata_codes"] = _metadata_columns(metadatas)
+    bm25_sections, bm25_params = _bm25_arrays(texts, metadatas)
+    sections.update(bm25_sections)
+    if vectors is not None:
+        sections["vectors"] = np.ascontiguousarray(vectors)
+    if scales is not None:
+        sections["scales"] = np.ascontiguousarray(scales, dtype=np.float32)
+
+    # 先頭に、各領域の位置・型・形状を記したヘッダー（JSON）を置く
+    header = {
+        "format_version": SNAPSHOT_FORMAT_VERSION,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "manifest_digest": indexer.manifest_digest(manifest),
+        "count": len(ids),
+        "dtype": dtype,
+        "metadata_columns": columns,
+        "bm25": bm25_params,
+        "sections": {},
+    }
+    offset = 0
+    for name, array in sections.items():
+        offset = -(-offset // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+        header["sections"][name] = {"offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)}
+        offset += array.nbytes
+    header_bytes = json.dumps(header, ensure_ascii=False).encode("utf-8")
+    data_start = -(-(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes)) // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+    path = snapshot_path(index_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(SNAPSHOT_MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in sections.items():
+            f.seek(data_start + header["sections"][name]["offset"])
+            f.write(array.tobytes())
+    # メモリマップで開いている旧版のファイルは、置き換え後も開いたプロセスから読める（POSIX）
+    os.replace(tmp_path, path)
+
+    stats = {
+        "path": path,
+        "chunks": len(ids),
+        "size_mb": round(os.path.getsize(path) / 1024 / 1024, 3),
+        "elapsed_sec": round(time.perf_counter() - started, 3),
+    }
+    logger.info({"corpus_snapshot": stats})
+    return stats
+
+
+############################################################
+# 関数定義（読み込み）
+############################################################
+
+def open_snapshot(index_dir=None):
+    """
+    最新のインデックスに対応するスナップショットを開く
+
+    Returns:
+        CorpusSnapshot（存在しない・インデックスより古い・壊れている場合はNone）
+    """
+    path = snapshot_path(index_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        snapshot = CorpusSnapshot(path)
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"コーパスのスナップショットを開けませんでした。\n{e}")
+        return None
+
+    if snapshot.manifest_digest != indexer.manifest_digest(indexer.load_manifest(index_dir)):
+        logger.info(f"コーパスのスナップショットがインデックスより古いため使用しません: {path}")
+        return None
+    return snapshot
+
+
+def build_snapshot_retriever(snapshot, embeddings=None):
+    """
+    スナップショットから検索用のRetrieverを作成（ベクターストアを開かない）
+    """
+    store = SnapshotVectorStore(snapshot, embeddings or embedding_client.create_embeddings())
+    if ct.RETRIEVER_MODE != "hybrid":
+        return store.as_retriever(search_kwargs={"k": ct.TOP_K})
+
+    category = snapshot.column("category")
+    meetings = category == snapshot.code("category", ct.MEETING_CATEGORY_NAME)
+    return HybridRetriever(
+        vectorstore=store,
+        bm25=SnapshotBM25Index(snapshot),
+        router=QueryRouter(
+            companies=snapshot.distinct("company"),
+            topics=snapshot.distinct("topic", meetings),
+        ),
+        k=ct.TOP_K,
+    )
+
+
+############################################################
+# クラス定義
+############################################################
+
+class ReadOnlySnapshotError(RuntimeError):
+    """
+    読み取り専用のスナップショットを更新しようとしたことを表す例外
+    """
+
+    def __init__(self, operation):
+        super().__init__(f"スナップショットは読み取り専用のため{operation}できません。indexer.pyでインデックスを更新してください。")
+        self.operation = operation
+
+
+class LazyColumn(Sequence):
+    """
+    要素を参照されたときにのみスナップショットから取り出す読み取り専用のリスト
+    """
+
+    def __init__(self, length, getter):
+        self._length = length
+        self._getter = getter
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._getter(i) for i in range(*index.indices(self._length))]
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        return self._getter(index)
+
+
+class CorpusSnapshot:
+    """
+    メモリマップで開いたスナップショット（各領域はファイル上のバイト列をそのまま参照する）
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"スナップショットの形式が異なります: {path}")
+            (header_length,) = struct.unpack("<Q", f.read(8))
+            header = json.loads(f.read(header_length).decode("utf-8"))
+        if header["format_version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"スナップショットの版が異なります: {header['format_version']}")
+
+        self.header = header
+        self.count = header["count"]
+        self.dtype = header["dtype"]
+        self.manifest_digest = header["manifest_digest"]
+        self.bm25_params = header["bm25"]
+
+        data_start = -(-(len(SNAPSHOT_MAGIC) + 8 + header_length) // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        self.sections = {}
+        for name, info in header["sections"].items():
+            dtype = np.dtype(info["dtype"])
+            size = int(np.prod(info["shape"])) * dtype.itemsize
+            start = data_start + info["offset"]
+            self.sections[name] = buffer[start:start + size].view(dtype).reshape(info["shape"])
+
+        self.columns = {c["key"]: i for i, c in enumerate(header["metadata_columns"])}
+        self.column_values = [c["values"] for c in header["metadata_columns"]]
+        self._column_codes = [
+            {(type(v).__name__, v): code for code, v in enumerate(values)} for values in self.column_values
+        ]
+
+        self.ids = LazyColumn(self.count, self.id)
+        self.texts = LazyColumn(self.count, self.text)
+        self.metadatas = LazyColumn(self.count, self.metadata)
+        self.documents = LazyColumn(self.count, self.document)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def vectors(self):
+        return self.sections.get("vectors")
+
+    @property
+    def scales(self):
+        return self.sections.get("scales")
+
+    def _string(self, arena, offsets, i):
+        start, end = self.sections[offsets][i], self.sections[offsets][i + 1]
+        return self.sections[arena][start:end].tobytes().decode("utf-8")
+
+    def id(self, i):
+        return self._string("id_arena", "id_offsets", i)
+
+    def text(self, i):
+        return self._string("text_arena", "text_offsets", i)
+
+    def metadata(self, i):
+        codes = self.sections["metadata_codes"][:, i]
+        return {
+            key: self.column_values[c][codes[c]]
+            for key, c in self.columns.items()
+            if codes[c] != MISSING_CODE
+        }
+
+    def document(self, i):
+        return Document(id=self.id(i), page_content=self.text(i), metadata=self.metadata(i))
+
+    def column(self, key):
+        """
+        メタデータの列の符号（値がない・列がない場合はMISSING_CODE）
+        """
+        if key not in self.columns:
+            return np.full(self.count, MISSING_CODE, dtype=np.int32)
+        return self.sections["metadata_codes"][self.columns[key]]
+
+    def code(self, key, value):
+        """
+        メタデータの値に対応する符号（存在しない値はNone）
+        """
+        if key not in self.columns:
+            return None
+        return self._column_codes[self.columns[key]].get((type(value).__name__, value))
+
+    def distinct(self, key, mask=None):
+        """
+        メタデータの列に含まれる値の一覧（maskを指定した場合は対象の行のみ）
+        """
+        codes = self.column(key) if mask is None else self.column(key)[mask]
+        return [self.column_values[self.columns[key]][c] for c in np.unique(codes) if c != MISSING_CODE]
+
+    def mask(self, where):
+        """
+        Chroma形式の絞り込み条件（where句）を満たす行の真偽値配列（列の符号の比較のみで求める）
+        """
+        result = np.ones(self.count, dtype=bool)
+        for key, condition in (where or {}).items():
+            if key == "$and":
+                for c in condition:
+                    result &= self.mask(c)
+                continue
+            if key == "$or":
+                matched = np.zeros(self.count, dtype=bool)
+                for c in condition:
+                    matched |= self.mask(c)
+                result &= matched
+                continue
+
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            codes = self.column(key)
+            for op, value in condition.items():
+                values = value if op in ("$in", "$nin") else [value]
+                wanted = [c for c in (self.code(key, v) for v in values) if c is not None]
+                matched = np.isin(codes, wanted)
+                if op in ("$eq", "$in"):
+                    result &= matched
+                elif op in ("$ne", "$nin"):
+                    result &= ~matched
+                else:
+                    raise ValueError(f"未対応の絞り込み条件です: {op}")
+        return result
+
+
+class SnapshotVectorStore(NumpyVectorStore):
+    """
+    スナップショットの埋め込み行列をそのまま検索する読み取り専用のベクターストア
+    """
+
+    def __init__(self, snapshot, embedding_function=None):
+        super().__init__(embedding_function=embedding_function, dtype=snapshot.dtype)
+        self.snapshot = snapshot
+        self.persist_directory = os.path.dirname(snapshot.path)
+        self._state = StoreState(
+            ids=snapshot.ids,
+            texts=snapshot.texts,
+            metadatas=snapshot.metadatas,
+            vectors=snapshot.vectors,
+            scales=snapshot.scales,
+        )
+
+    def _filter_mask(self, state, where):
+        return self.snapshot.mask(where)
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        raise ReadOnlySnapshotError("チャンクを追加")
+
+    def delete(self, ids=None, **kwargs):
+        raise ReadOnlySnapshotError("チャンクを削除")
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None):
+        if ids is not None:
+            wanted = set(ids)
+            rows = [i for i in range(len(self.snapshot)) if self.snapshot.id(i) in wanted]
+        else:
+            rows = np.flatnonzero(self.snapshot.mask(where)).tolist()
+        rows = rows[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+
+        include = include or ["documents", "metadatas"]
+        return {
+            "ids": [self.snapshot.id(i) for i in rows],
+            "documents": [self.snapshot.text(i) for i in rows] if "documents" in include else None,
+            "metadatas": [self.snapshot.metadata(i) for i in rows] if "metadatas" in include else None,
+        }
+
+
+class SnapshotBM25Index:
+    """
+    スナップショットのCSR形式の転置インデックスでBM25スコアを計算する（BM25Indexと同じ計算式）
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.documents = snapshot.documents
+        self.k1 = snapshot.bm25_params["k1"]
+        self.b = snapshot.bm25_params["b"]
+        self.avg_doc_length = snapshot.bm25_params["avg_doc_length"]
+        sections = snapshot.sections
+        self.hashes = sections["bm25_token_hashes"]
+        self.indptr = sections["bm25_indptr"]
+        self.doc_ids = sections["bm25_doc_ids"]
+        self.tfs = sections["bm25_tfs"]
+        self.idf = sections["bm25_idf"]
+        self.doc_lengths = sections["bm25_doc_lengths"]
+
+    def candidates(self, filter_dict):
+        """
+        絞り込み条件を満たすチャンクの真偽値配列（条件なしの場合はNone）
+        """
+        if not filter_dict:
+            return None
+        return self.snapshot.mask(to_chroma_filter(filter_dict))
+
+    def search(self, query, k, filter_dict=None):
+        """
+        BM25スコアの上位k件を検索
+
+        Returns:
+            (Document, スコア) のリスト（スコアの高い順）
+        """
+        allowed = self.candidates(filter_dict)
+        if allowed is not None and not allowed.any():
+            return []
+
+        scores = np.zeros(len(self.snapshot), dtype=np.float64)
+        matched = np.zeros(len(self.snapshot), dtype=bool)
+        norm_base = self.k1 * (1 - self.b)
+        norm_scale = self.k1 * self.b / (self.avg_doc_length or 1)
+        for token in set(tokenize(query)):
+            h = np.uint64(token_hash(token))
+            t = int(np.searchsorted(self.hashes, h))
+            if t >= len(self.hashes) or self.hashes[t] != h:
+                continue
+            start, end = self.indptr[t], self.indptr[t + 1]
+            docs = self.doc_ids[start:end]
+            tfs = self.tfs[start:end].astype(np.float64)
+            norm = norm_base + norm_scale * self.doc_lengths[docs]
+            scores[docs] += self.idf[t] * tfs * (self.k1 + 1) / (tfs + norm)
+            matched[docs] = True
+
+        if allowed is not None:
+            matched &= allowed
+        hits = np.flatnonzero(matched)
+        top = hits[np.argsort(-scores[hits], kind="stable")[:k]]
+        return [(self.snapshot.document(i), float(scores[i])) for i in top]
+
+
+############################################################
+# コマンドライン実行
+############################################################
+
+def main(argv=None):
+    """
+    インデックスのスナップショットをコマンドラインから書き出す
+    """
+    parser = argparse.ArgumentParser(description="検索用コーパスのスナップショットの書き出し")
+    parser.add_argument("--index-dir", default=ct.INDEX_DIR_PATH, help="インデックスの保存先")
+    parser.add_argument("--info", action="store_true", help="書き出さずに既存のスナップショットの内容を表示する")
+    parser.add_argument("--embedding-backend", choices=["openai", "fake"], default=None, help="埋め込みモデル")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(asctime)s %(message)s")
+
+    if args.info:
+        snapshot = open_snapshot(args.index_dir)
+        if snapshot is None:
+            print("利用可能なスナップショットがありません。", file=sys.stderr)
+            sys.exit(1)
+        info = {k: v for k, v in snapshot.header.items() if k not in ("metadata_columns", "sections")}
+        info["metadata_columns"] = {c["key"]: len(c["values"]) for c in snapshot.header["metadata_columns"]}
+        info["sections_mb"] = {name: round(a.nbytes / 1024 / 1024, 3) for name, a in snapshot.sections.items()}
+        print(json.dumps(info, ensure_ascii=False, indent=2))
+        return
+
+    if not indexer.index_exists(args.index_dir):
+        print("インデックスが未作成です。`python indexer.py` を実行してください。", file=sys.stderr)
+        sys.exit(1)
+    db = indexer.open_vector_store(args.index_dir, embedding_client.create_embeddings(args.embedding_backend))
+    print(json.dumps(write_snapshot(db, args.index_dir), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
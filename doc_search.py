@@ -0,0 +1,147 @@
+"""
+このファイルは、「社内文書検索」モードの検索処理のファイルです。
+LLMで回答文を生成せず、検索したチャンクのスコアをファイル・ページ単位に集約して、
+関連ファイルの一覧（スコア・抜粋付き）を返します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import logging
+from collections import defaultdict
+
+from langchain_core.documents import Document
+
+import constants as ct
+import metrics
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def retrieve_with_scores(retriever, query, k):
+    """
+    Retrieverの種類に応じて、スコア付きでチャンクを検索
+
+    Returns:
+        (Document, スコア) のリスト（スコアの高い順）
+    """
+    # ハイブリッド検索（絞り込み・検索範囲の推定を含む）
+    if hasattr(retriever, "search_with_scores"):
+        return retriever.search_with_scores(query, k=k)
+
+    # ベクトル検索のみ（距離は小さいほど関連が強いため、大きいほど関連が強いスコアへ変換）
+    results = retriever.vectorstore.similarity_search_with_score(query, k=k)
+    return [(doc, 1.0 / (1.0 + distance)) for doc, distance in results]
+
+
+def _make_snippet(text):
+    """
+    表示用の抜粋を作成
+    """
+    text = " ".join((text or "").split())
+    if len(text) <= ct.DOC_SEARCH_SNIPPET_CHARS:
+        return text
+    return text[:ct.DOC_SEARCH_SNIPPET_CHARS] + "…"
+
+
+def _pool(scores, pooling):
+    """
+    チャンクのスコアのリストを1つのスコアに集約
+    """
+    return sum(scores) if pooling == "sum" else max(scores)
+
+
+def aggregate_by_file(scored_docs, pooling=None):
+    """
+    チャンク単位のスコアをファイル単位・ページ単位に集約
+    ※ファイルのスコアはファイル内の全チャンクで集約し、代表ページはページ単位の集約スコアが最も高いページとする
+
+    Args:
+        scored_docs: (Document, スコア) のリスト
+        pooling: "max"（最も関連の強いチャンクで評価）または "sum"（関連チャンクの合計で評価）
+
+    Returns:
+        ファイルごとの集約結果のリスト（スコアの高い順）
+        [{"source", "score", "page", "page_score", "pages", "snippet", "doc"}]
+        ※pagesは [(ページ, スコア)] のリスト（スコアの高い順）
+    """
+    pooling = pooling or ct.DOC_SEARCH_POOLING
+    file_scores = defaultdict(list)
+    page_scores = defaultdict(list)
+    # (ファイル, ページ) ごとの最もスコアの高いチャンク
+    best_chunks = {}
+
+    for doc, score in scored_docs:
+        source = (doc.metadata or {}).get("source")
+        if not source:
+            continue
+        key = (source, (doc.metadata or {}).get("page"))
+        file_scores[source].append(score)
+        page_scores[key].append(score)
+        best = best_chunks.get(key)
+        if best is None or score > best[1]:
+            best_chunks[key] = (doc, score)
+
+    pages_by_file = defaultdict(list)
+    for (source, page), scores in page_scores.items():
+        pages_by_file[source].append((page, round(float(_pool(scores, pooling)), 6)))
+
+    results = []
+    for source, scores in file_scores.items():
+        pages = sorted(pages_by_file[source], key=lambda x: x[1], reverse=True)
+        page, page_score = pages[0]
+        # 代表ページ内で最もスコアの高いチャンクの抜粋を表示する
+        doc = best_chunks[(source, page)][0]
+        results.append({
+            "source": source,
+            "score": round(float(_pool(scores, pooling)), 6),
+            "page": page,
+            "page_score": page_score,
+            "pages": pages,
+            "snippet": _make_snippet(doc.page_content),
+            "doc": doc,
+        })
+    results.sort(key=lambda x: x["score"], reverse=True)
+    return results
+
+
+def search_documents(retriever, query, max_files=None):
+    """
+    関連ファイルを検索（LLMによる回答生成は行わない）
+
+    Returns:
+        {"answer": "", "context": 代表チャンクのリスト（ファイルのスコア順）, "files": 集約結果}
+        ※contextは回答生成ありの場合と同じ形式のため、画面表示処理をそのまま使える
+    """
+    max_files = max_files or ct.TOP_K
+    with metrics.span("retrieve"):
+        scored_docs = retrieve_with_scores(retriever, query, ct.DOC_SEARCH_FETCH_K)
+    files = aggregate_by_file(scored_docs)[:max_files]
+
+    # 検索結果のDocumentはインデックスと共有のため、複製してからスコア・抜粋を付与する
+    for file_info in files:
+        doc = file_info["doc"]
+        file_info["doc"] = Document(
+            page_content=doc.page_content,
+            metadata={**(doc.metadata or {}), "score": file_info["score"], "snippet": file_info["snippet"]},
+        )
+
+    logger.info({
+        "doc_search": {
+            "chunks": len(scored_docs),
+            "files": [(f["source"], f["score"]) for f in files],
+        }
+    })
+    return {
+        "answer": "",
+        "context": [f["doc"] for f in files],
+        "files": [{k: v for k, v in f.items() if k != "doc"} for f in files],
+    }
@@ -0,0 +1,434 @@
+"""
+このファイルは、ベクターストアへ登録するチャンクの埋め込み処理を担うファイルです。
+バッチ分割・同時実行数の制御・レート制限時の再試行・重複テキストの除外を行います。
+検索時の質問文の埋め込みは、LRUキャッシュと、複数セッションから同時に届いた質問のまとめて送信を行います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import time
+import zlib
+import random
+import asyncio
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+import constants as ct
+import metrics
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義（トークン数）
+############################################################
+
+_encodings = {}
+
+
+def count_tokens(text, encoding_name=None):
+    """
+    テキストのトークン数を計算（既定は埋め込みモデルのエンコーディング）
+    ※tiktokenが使えない環境では文字数で代用する（日本語は概ね1文字1トークン以上のため安全側）
+    """
+    encoding_name = encoding_name or ct.EMBEDDING_TOKEN_ENCODING
+    if encoding_name not in _encodings:
+        try:
+            import tiktoken
+            _encodings[encoding_name] = tiktoken.get_encoding(encoding_name)
+        except Exception:
+            _encodings[encoding_name] = None
+    encoding = _encodings[encoding_name]
+    if encoding is None:
+        return len(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def make_batches(texts, batch_size, max_batch_tokens):
+    """
+    テキストを件数・トークン数の上限に収まるバッチへ分割
+
+    Returns:
+        バッチ（テキストのリスト）のリスト
+    """
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = count_tokens(text)
+        if current and (len(current) >= batch_size or current_tokens + tokens > max_batch_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def is_retryable_error(e):
+    """
+    再試行すべきエラー（レート制限・サーバー側の一時エラー）かを判定
+    """
+    status = getattr(e, "status_code", None)
+    if status is None:
+        status = getattr(getattr(e, "response", None), "status_code", None)
+    return status == 429 or (isinstance(status, int) and status >= 500)
+
+
+def _retry_after_sec(e):
+    """
+    エラーレスポンスのRetry-Afterヘッダーから待機秒数を取得（無ければNone）
+    """
+    headers = getattr(getattr(e, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_query_text(text):
+    """
+    質問文の埋め込み用に表記の揺れ（全角・半角、空白）を吸収
+    ※キャッシュのキーと実際に埋め込む文面を同じにするため、正規化後の文面を埋め込む
+    """
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+def run_sync(coro):
+    """
+    同期処理からコルーチンを実行
+    ※イベントループ実行中のスレッドから呼ばれた場合は、別スレッドで実行する
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+
+    result = {}
+
+    def runner():
+        try:
+            result["value"] = asyncio.run(coro)
+        except BaseException as e:
+            result["error"] = e
+
+    thread = threading.Thread(target=runner)
+    thread.start()
+    thread.join()
+    if "error" in result:
+        raise result["error"]
+    return result["value"]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class BatchedEmbeddings(Embeddings):
+    """
+    埋め込みモデルをラップし、バッチ分割・並列送信・再試行を行う埋め込みクラス
+    """
+
+    def __init__(
+        self,
+        base,
+        batch_size=None,
+        max_concurrency=None,
+        max_batch_tokens=None,
+        max_retries=None,
+        backoff_base_sec=None,
+        backoff_max_sec=None,
+    ):
+        self.base = base
+        self.batch_size = batch_size or ct.EMBEDDING_BATCH_SIZE
+        self.max_concurrency = max_concurrency or ct.EMBEDDING_MAX_CONCURRENCY
+        self.max_batch_tokens = max_batch_tokens or ct.EMBEDDING_MAX_BATCH_TOKENS
+        self.max_retries = ct.EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.backoff_base_sec = backoff_base_sec or ct.EMBEDDING_BACKOFF_BASE_SEC
+        self.backoff_max_sec = backoff_max_sec or ct.EMBEDDING_BACKOFF_MAX_SEC
+        self.stats = {"texts_requested": 0, "texts_sent": 0, "batches": 0, "retries": 0}
+        # 質問文の埋め込み（最初の検索時に作成する。インデックス構築時は使わない）
+        self._query_embedder = None
+        self._query_embedder_lock = threading.Lock()
+
+    @property
+    def query_embedder(self):
+        """
+        質問文の埋め込み処理（まとめた質問はチャンクと同じく再試行付きで送信する）
+        """
+        with self._query_embedder_lock:
+            if self._query_embedder is None:
+                embedder = QueryEmbedder(self)
+                registry = metrics.get_registry()
+                registry.register_gauge("query_embedding_hit_ratio", lambda: embedder.hit_ratio)
+                registry.register_gauge("query_embedding_batch_size_mean", lambda: embedder.mean_batch_size)
+                self._query_embedder = embedder
+            return self._query_embedder
+
+    def embed_documents(self, texts):
+        """
+        チャンクの埋め込み（同期版）
+        """
+        return run_sync(self.aembed_documents(texts))
+
+    def embed_query(self, text):
+        """
+        質問文の埋め込み（キャッシュを参照し、同時に届いた質問とまとめて送信）
+        """
+        return self.query_embedder.embed(text)
+
+    async def aembed_query(self, text):
+        """
+        質問文の埋め込み（非同期版）
+        ※キャッシュ・まとめて送信は同期版と共有するため、待機はスレッドで行う
+        """
+        return await asyncio.to_thread(self.query_embedder.embed, text)
+
+    async def aembed_documents(self, texts):
+        """
+        チャンクの埋め込み（非同期版）
+        ※同一テキストは1回だけ送信し、結果を元の並び順に展開して返す
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+
+        unique_texts = list(dict.fromkeys(texts))
+        batches = make_batches(unique_texts, self.batch_size, self.max_batch_tokens)
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*[self._embed_batch(batch, semaphore) for batch in batches])
+
+        vectors = {}
+        for batch, batch_vectors in zip(batches, results):
+            vectors.update(zip(batch, batch_vectors))
+
+        self.stats["texts_requested"] += len(texts)
+        self.stats["texts_sent"] += len(unique_texts)
+        self.stats["batches"] += len(batches)
+        logger.info(
+            f"埋め込みを作成しました: {len(texts)}件（重複除外後{len(unique_texts)}件, "
+            f"{len(batches)}バッチ, {time.perf_counter() - started:.3f}秒）"
+        )
+        return [vectors[text] for text in texts]
+
+    async def _embed_batch(self, batch, semaphore):
+        """
+        バッチ1件分の埋め込み（レート制限時は指数バックオフで再試行）
+        """
+        attempt = 0
+        while True:
+            async with semaphore:
+                try:
+                    return await self.base.aembed_documents(batch)
+                except Exception as e:
+                    if attempt >= self.max_retries or not is_retryable_error(e):
+                        raise
+                    wait_sec = _retry_after_sec(e)
+
+            # 待機中は同時実行枠を解放し、他のバッチを先に進める
+            if wait_sec is None:
+                wait_sec = min(self.backoff_max_sec, self.backoff_base_sec * (2 ** attempt))
+                wait_sec *= random.uniform(0.5, 1.0)
+            attempt += 1
+            self.stats["retries"] += 1
+            logger.warning(f"埋め込みAPIのレート制限等により再試行します（{attempt}回目, {wait_sec:.2f}秒後）")
+            await asyncio.sleep(wait_sec)
+
+
+class QueryEmbedder:
+    """
+    質問文の埋め込みを、プロセス内の全セッションで共有して行うクラス
+    ※正規化後の文面をキーとするLRUキャッシュにあれば、APIを呼ばずに返す
+    ※キャッシュにない質問は、最初の1件が届いてからQUERY_EMBEDDING_BATCH_WAIT_MSの間に届いたものと
+      まとめて1回のAPI呼び出しで埋め込み、それぞれの呼び出し元へ結果を返す
+    ※同じ質問が埋め込みの処理中に届いた場合は、その結果を待って共有する
+    """
+
+    def __init__(self, base, cache_size=None, batch_wait_ms=None, max_batch_size=None):
+        self.base = base
+        self.cache_size = ct.QUERY_EMBEDDING_CACHE_SIZE if cache_size is None else cache_size
+        self.batch_wait_sec = (ct.QUERY_EMBEDDING_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms) / 1000
+        self.max_batch_size = max_batch_size or ct.QUERY_EMBEDDING_MAX_BATCH_SIZE
+        # {正規化後の文面: 埋め込み}（末尾ほど最近使われたもの）
+        self._cache = OrderedDict()
+        # {正規化後の文面: Future}（送信待ち・送信中の質問）
+        self._pending = {}
+        # 送信待ちの質問（到着順）
+        self._queue = []
+        self._collecting = False
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "shared": 0, "batches": 0, "batched_texts": 0, "max_batch_size": 0}
+
+    @property
+    def hit_ratio(self):
+        total = self.stats["hits"] + self.stats["misses"] + self.stats["shared"]
+        return round((self.stats["hits"] + self.stats["shared"]) / total, 4) if total else 0.0
+
+    @property
+    def mean_batch_size(self):
+        batches = self.stats["batches"]
+        return round(self.stats["batched_texts"] / batches, 3) if batches else 0.0
+
+    def embed(self, text):
+        """
+        質問文1件を埋め込む
+        """
+        key = normalize_query_text(text)
+        batch = None
+        lead = False
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is not None:
+                self._cache.move_to_end(key)
+                self._count("hit")
+                return list(vector)
+
+            future = self._pending.get(key)
+            if future is None:
+                future = Future()
+                self._pending[key] = future
+                self._queue.append(key)
+                self._count("miss")
+                if len(self._queue) >= self.max_batch_size:
+                    # 上限件数に達した場合は待たずに送信する
+                    batch = self._take_batch()
+                elif not self._collecting:
+                    # 最初に届いた質問の呼び出し元が、待ち時間の経過後にまとめて送信する
+                    self._collecting = True
+                    lead = True
+            else:
+                self._count("shared")
+
+        if lead:
+            if self.batch_wait_sec > 0:
+                time.sleep(self.batch_wait_sec)
+            with self._lock:
+                batch = self._take_batch()
+                self._collecting = False
+        if batch:
+            self._flush(batch)
+        return list(future.result())
+
+    def _count(self, result):
+        self.stats[{"hit": "hits", "miss": "misses", "shared": "shared"}[result]] += 1
+        metrics.get_registry().incr("query_embedding_total", result=result)
+
+    def _take_batch(self):
+        batch = self._queue[:self.max_batch_size]
+        self._queue = self._queue[self.max_batch_size:]
+        return batch
+
+    def _flush(self, batch):
+        """
+        送信待ちの質問をまとめて埋め込み、それぞれの呼び出し元へ結果を返す
+        ※失敗した場合は、まとめた全ての呼び出し元へ同じ例外を送出させる（キャッシュには登録しない）
+        """
+        try:
+            vectors = self.base.embed_documents(batch)
+        except Exception as e:
+            with self._lock:
+                futures = [self._pending.pop(key) for key in batch]
+            for future in futures:
+                future.set_exception(e)
+            return
+
+        with self._lock:
+            futures = [self._pending.pop(key) for key in batch]
+            if self.cache_size > 0:
+                for key, vector in zip(batch, vectors):
+                    self._cache[key] = vector
+                    self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self.stats["batches"] += 1
+            self.stats["batched_texts"] += len(batch)
+            self.stats["max_batch_size"] = max(self.stats["max_batch_size"], len(batch))
+
+        registry = metrics.get_registry()
+        registry.incr("query_embedding_batches_total")
+        registry.incr("query_embedding_batched_texts_total", len(batch))
+        for future, vector in zip(futures, vectors):
+            future.set_result(vector)
+
+
+class HashEmbeddings(Embeddings):
+    """
+    API呼び出しを行わない決定的な埋め込みクラス（オフラインでの性能計測用）
+    ※文字n-gramをハッシュで固定次元に割り当てるため、表層的に似た文章は近いベクトルになる
+    """
+
+    def __init__(self, size=None, ngram=2, latency_sec=0.0):
+        self.size = size or ct.FAKE_EMBEDDING_SIZE
+        self.ngram = ngram
+        # 1リクエストあたりの疑似的な通信遅延（並列化の効果測定用）
+        self.latency_sec = latency_sec
+
+    def _embed(self, text):
+        vector = np.zeros(self.size, dtype=np.float32)
+        text = text or ""
+        grams = [text[i:i + self.ngram] for i in range(max(1, len(text) - self.ngram + 1))]
+        for gram in grams:
+            vector[zlib.crc32(gram.encode("utf-8")) % self.size] += 1.0
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector.tolist()
+
+    def embed_documents(self, texts):
+        if self.latency_sec:
+            time.sleep(self.latency_sec)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts):
+        if self.latency_sec:
+            await asyncio.sleep(self.latency_sec)
+        return [self._embed(text) for text in texts]
+
+    async def aembed_query(self, text):
+        return (await self.aembed_documents([text]))[0]
+
+
+############################################################
+# 関数定義（埋め込みモデルの作成）
+############################################################
+
+def create_base_embeddings(backend=None):
+    """
+    バックエンド名に応じた埋め込みモデルを作成
+
+    Args:
+        backend: "openai" または "fake"（未指定時は定数EMBEDDING_BACKEND）
+    """
+    backend = backend or ct.EMBEDDING_BACKEND
+    if backend == "fake":
+        return HashEmbeddings()
+    if backend == "openai":
+        from langchain_openai import OpenAIEmbeddings
+        # 再試行はBatchedEmbeddings側で制御するため、クライアント側の再試行は無効化
+        return OpenAIEmbeddings(max_retries=0)
+    raise ValueError(f"未対応の埋め込みバックエンドです: {backend}")
+
+
+def create_embeddings(backend=None, **kwargs):
+    """
+    バッチ化・並列化・再試行を組み込んだ埋め込みモデルを作成
+    """
+    return BatchedEmbeddings(create_base_embeddings(backend), **kwargs)
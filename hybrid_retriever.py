@@ -0,0 +1,301 @@
+"""
+このファイルは、キーワード検索（BM25）とベクトル検索を組み合わせたハイブリッド検索のファイルです。
+社名・氏名・商品コードなどの完全一致に強いBM25と、意味の近さに強いベクトル検索の結果を
+RRF（Reciprocal Rank Fusion）で統合します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import math
+import hashlib
+import logging
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Any, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import constants as ct
+import metrics
+from query_router import QueryRouter, to_chroma_filter
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def tokenize(text):
+    """
+    日本語向けの簡易トークナイズ（辞書を使わない文字n-gram方式）
+    ※英数字の連続は1語として扱い、それ以外の文字列は文字bi-gramに分割する
+
+    Returns:
+        トークンのリスト
+    """
+    text = unicodedata.normalize("NFKC", text or "").lower()
+
+    tokens = []
+    ascii_word = []
+    segment = []
+
+    def flush_ascii():
+        if ascii_word:
+            tokens.append("".join(ascii_word))
+            ascii_word.clear()
+
+    def flush_segment():
+        if len(segment) == 1:
+            tokens.append(segment[0])
+        else:
+            tokens.extend(segment[i] + segment[i + 1] for i in range(len(segment) - 1))
+        segment.clear()
+
+    for ch in text:
+        if ch.isascii() and ch.isalnum():
+            flush_segment()
+            ascii_word.append(ch)
+        elif ch.isalnum():
+            flush_ascii()
+            segment.append(ch)
+        else:
+            flush_ascii()
+            flush_segment()
+    flush_ascii()
+    flush_segment()
+    return tokens
+
+
+def doc_key(doc):
+    """
+    検索結果の統合用に、チャンクを一意に識別するキーを作成
+    """
+    meta = doc.metadata or {}
+    payload = "\n".join([
+        str(meta.get("source", "")),
+        str(meta.get("page", "")),
+        str(meta.get("row", "")),
+        doc.page_content,
+    ])
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def reciprocal_rank_fusion(result_lists, rrf_k=None):
+    """
+    複数の検索結果をRRFで統合
+
+    Args:
+        result_lists: Documentのリスト（上位から順）のリスト
+        rrf_k: RRFの平滑化定数
+
+    Returns:
+        (Document, RRFスコア) のリスト（スコアの高い順）
+    """
+    rrf_k = rrf_k or ct.HYBRID_RRF_K
+    scores = defaultdict(float)
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = doc_key(doc)
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+            docs.setdefault(key, doc)
+    ranked = sorted(scores.items(), key=lambda x: x[1], reverse=True)
+    return [(docs[key], score) for key, score in ranked]
+
+
+############################################################
+# クラス定義
+############################################################
+
+class BM25Index:
+    """
+    チャンクに対するプロセス内の転置インデックス（BM25）
+    """
+
+    def __init__(self, documents, k1=None, b=None):
+        self.documents = list(documents)
+        self.k1 = ct.BM25_K1 if k1 is None else k1
+        self.b = ct.BM25_B if b is None else b
+
+        # {トークン: [(チャンク番号, 出現回数)]}
+        self.postings = defaultdict(list)
+        self.doc_lengths = []
+        for i, doc in enumerate(self.documents):
+            counts = Counter(tokenize(doc.page_content))
+            self.doc_lengths.append(sum(counts.values()))
+            for token, tf in counts.items():
+                self.postings[token].append((i, tf))
+
+        # {(メタデータのキー, 値): チャンク番号の集合}（絞り込み用）
+        self.metadata_index = defaultdict(set)
+        for i, doc in enumerate(self.documents):
+            for key in ct.FILTERABLE_METADATA_KEYS:
+                value = (doc.metadata or {}).get(key)
+                if value is not None:
+                    self.metadata_index[(key, value)].add(i)
+
+        n = len(self.documents)
+        self.avg_doc_length = (sum(self.doc_lengths) / n) if n else 0.0
+        self.idf = {
+            token: math.log(1 + (n - len(p) + 0.5) / (len(p) + 0.5))
+            for token, p in self.postings.items()
+        }
+
+    def candidates(self, filter_dict):
+        """
+        絞り込み条件を満たすチャンク番号の集合を取得（条件なしの場合はNone）
+        """
+        if not filter_dict:
+            return None
+
+        result = None
+        for key, value in filter_dict.items():
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            matched = set()
+            for v in values:
+                matched |= self.metadata_index.get((key, v), set())
+            result = matched if result is None else result & matched
+        return result
+
+    def search(self, query, k, filter_dict=None):
+        """
+        BM25スコアの上位k件を検索
+        ※絞り込み条件がある場合は、条件を満たすチャンクだけをスコア計算の対象にする
+
+        Returns:
+            (Document, スコア) のリスト（スコアの高い順）
+        """
+        allowed = self.candidates(filter_dict)
+        if allowed is not None and not allowed:
+            return []
+
+        scores = defaultdict(float)
+        for token in set(tokenize(query)):
+            idf = self.idf.get(token)
+            if idf is None:
+                continue
+            for i, tf in self.postings[token]:
+                if allowed is not None and i not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[i] / (self.avg_doc_length or 1))
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+        top = sorted(scores.items(), key=lambda x: x[1], reverse=True)[:k]
+        return [(self.documents[i], score) for i, score in top]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    BM25とベクトル検索の結果をRRFで統合するRetriever
+    ※VectorStoreRetrieverと同様にvectorstore属性を持ち、create_retrieval_chain等へそのまま渡せる
+    ※filterを指定すると、類似度計算の前に候補チャンクをメタデータで絞り込む
+    ※route_queriesを有効にすると、質問文から推定した範囲で絞り込む（不足分は全体検索で補う）
+    """
+
+    vectorstore: Any
+    bm25: Any
+    router: Any = None
+    filter: Optional[dict] = None
+    route_queries: bool = False
+    k: int = ct.TOP_K
+    fetch_k: int = ct.HYBRID_FETCH_K
+    rrf_k: int = ct.HYBRID_RRF_K
+
+    def with_filter(self, filter_dict):
+        """
+        絞り込み条件を固定したRetrieverを作成
+        例: retriever.with_filter({"category": "MTG議事録", "customer_status": "既存"})
+        """
+        return self.model_copy(update={"filter": filter_dict or None})
+
+    def with_routing(self, enabled=True):
+        """
+        質問文から検索範囲を推定するRetrieverを作成
+        """
+        return self.model_copy(update={"route_queries": enabled and self.router is not None})
+
+    def search(self, query, filter_dict=None, k=None):
+        """
+        絞り込み条件付きでハイブリッド検索
+
+        Returns:
+            (Document, RRFスコア) のリスト（スコアの高い順）
+        """
+        vector_docs = self.vectorstore.similarity_search(
+            query, k=self.fetch_k, filter=to_chroma_filter(filter_dict)
+        )
+        keyword_docs = [doc for doc, _ in self.bm25.search(query, self.fetch_k, filter_dict)]
+        fused = reciprocal_rank_fusion([vector_docs, keyword_docs], self.rrf_k)
+        return fused[:k or self.k]
+
+    def search_with_scores(self, query, k=None):
+        """
+        filter・検索範囲の推定を適用してハイブリッド検索（スコア付き）
+
+        Returns:
+            (Document, RRFスコア) のリスト（スコアの高い順）
+        """
+        k = k or self.k
+        if self.filter:
+            return self.search(query, self.filter, k)
+
+        scope = self.router.route(query) if self.route_queries else None
+        if not scope:
+            return self.search(query, k=k)
+
+        results = self.search(query, scope, k)
+        logger.info({"retrieval_scope": scope, "scoped_hits": len(results)})
+
+        # 推定した範囲で件数が足りない場合は、全体検索の結果で補う
+        if len(results) < k:
+            seen = {doc_key(doc) for doc, _ in results}
+            for doc, score in self.search(query, k=k):
+                if len(results) >= k:
+                    break
+                if doc_key(doc) not in seen:
+                    results.append((doc, score))
+        return results
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        with metrics.span("retrieve"):
+            return [doc for doc, _ in self.search_with_scores(query)]
+
+
+############################################################
+# 関数定義（Retrieverの作成）
+############################################################
+
+def load_all_chunks(db):
+    """
+    ベクターストアに登録済みの全チャンクを取得
+    """
+    data = db.get(include=["documents", "metadatas"])
+    return [
+        Document(page_content=text or "", metadata=meta or {})
+        for text, meta in zip(data["documents"], data["metadatas"])
+    ]
+
+
+def build_hybrid_retriever(db, k=None):
+    """
+    ベクターストアの全チャンクからBM25インデックスを作成し、ハイブリッド検索のRetrieverを返す
+    """
+    chunks = load_all_chunks(db)
+    bm25 = BM25Index(chunks)
+    logger.info(f"BM25インデックスを作成しました: {len(chunks)}チャンク, {len(bm25.postings)}トークン")
+    return HybridRetriever(
+        vectorstore=db,
+        bm25=bm25,
+        router=QueryRouter.from_documents(chunks),
+        k=k or ct.TOP_K,
+    )
@@ -0,0 +1,584 @@
+"""
+このファイルは、アプリ起動中にdataフォルダの変更（追加・更新・削除）を検知し、
+インデックスをバックグラウンドで差分更新して、検索に使うRetrieverを切り替えるファイルです。
+更新は現在のインデックスを複製した別フォルダに対して行い、構築が完了してから参照先を入れ替えるため、
+処理中の質問が待たされることも、構築途中のインデックスを検索することもありません。
+同じホストの複数のワーカープロセスのうち、ロックファイルを取得した1プロセスのみが更新した版を公開し、
+他のプロセスと再起動後のプロセスは、公開された最新の版を開きます。
+切り替え前の版は、処理中の質問が使い終わるまでの猶予（INDEX_RETIRE_GRACE_SEC）を置いてから削除します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import time
+import shutil
+import logging
+import threading
+
+import constants as ct
+import ingest
+import indexer
+import hybrid_retriever
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def build_retriever(db):
+    """
+    ベクターストアから検索用のRetrieverを作成
+    ※検索処理は読み取りのみのため、複数セッションから同時に呼び出しても安全
+    """
+    if ct.RETRIEVER_MODE == "hybrid":
+        return hybrid_retriever.build_hybrid_retriever(db, k=ct.TOP_K)
+    return db.as_retriever(search_kwargs={"k": ct.TOP_K})
+
+
+def open_retriever(index_dir=None, embeddings=None):
+    """
+    ディスク上のインデックスから検索用のRetrieverを作成
+    ※最新のスナップショットがあればメモリマップで開き、なければベクターストアを開く
+    """
+    if ct.CORPUS_SNAPSHOT_ENABLED:
+        import corpus_snapshot
+
+        snapshot = corpus_snapshot.open_snapshot(index_dir)
+        if snapshot is not None:
+            return corpus_snapshot.build_snapshot_retriever(snapshot, embeddings)
+    return build_retriever(indexer.open_vector_store(index_dir, embeddings))
+
+
+def published_path(versions_dir=None):
+    return os.path.join(versions_dir or ct.INDEX_VERSIONS_DIR_PATH, ct.INDEX_PUBLISHED_FILE)
+
+
+def read_published(versions_dir=None):
+    """
+    公開された最新の版の情報を読み込む
+
+    Returns:
+        {"version", "index_dir", "published_at"}（未公開・読み込めない場合は空の辞書）
+    """
+    try:
+        with open(published_path(versions_dir), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def load_published_version(index_dir=None, versions_dir=None):
+    """
+    起動時・他のワーカープロセスが開く、公開された最新の版を取得
+    ※indexer.py（コマンドライン）でindex_dirを更新した後の公開でなければ、index_dirを優先する
+
+    Returns:
+        (版番号, インデックスのフォルダ)（利用できる版がなければNone）
+    """
+    published = read_published(versions_dir)
+    version_dir = published.get("index_dir")
+    if not version_dir or not indexer.index_exists(version_dir):
+        return None
+    try:
+        if os.path.getmtime(indexer.manifest_path(index_dir)) > published.get("published_at", 0):
+            return None
+    except OSError:
+        pass
+    return published["version"], version_dir
+
+
+def open_or_build_index():
+    """
+    起動時のRetrieverを作成（インデックス未作成の環境に限り、その場で構築する）
+    ※埋め込みはindexer.py（コマンドライン）で事前に行い、通常はディスク上のインデックスを開くだけ
+    ※起動中の自動更新で公開された版があれば、再度の埋め込みをせずにその版を開く
+
+    Returns:
+        (版番号, Retriever, インデックスのフォルダ)
+    """
+    published = load_published_version()
+    if published is not None:
+        version, index_dir = published
+        logger.info(f"公開済みのインデックスの版を開きます: {index_dir}（版{version}）")
+        return version, open_retriever(index_dir), index_dir
+
+    if not indexer.index_exists():
+        if not ct.INDEX_BUILD_ON_BOOT_IF_MISSING:
+            raise RuntimeError(
+                "インデックスが未作成です。`python indexer.py` を実行してから起動してください。"
+            )
+        logger.warning("インデックスが未作成のため、起動時に構築します。")
+        stats = indexer.update_index(indexer.open_vector_store())
+        # ※起動時は回答キャッシュが空のため無効化は不要（以降の更新はstart_index_reloaderのon_reloadで無効化する）
+        stats.pop("changed_sources")
+        logger.info({"index_build": stats})
+
+    # ※スナップショットがあればメモリマップで開くため、同じホストのワーカー間で物理メモリを共有する
+    return 1, open_retriever(), ct.INDEX_DIR_PATH
+
+
+def start_index_reloader():
+    """
+    起動時のインデックスを開いて自動更新処理を作成し、dataフォルダの監視を開始
+    ※ファイルの変更を検知するたびに（他のワーカープロセスが更新した場合は公開を確認するたびに）新しい版へ切り替える
+    """
+    import metrics
+    from answer_cache import get_answer_cache
+
+    def on_reload(stats):
+        # 再登録・削除されたソースを根拠とするキャッシュ済みの回答は破棄する
+        get_answer_cache().invalidate_sources(stats.get("changed_sources", []))
+
+    version, retriever, index_dir = open_or_build_index()
+    reloader = IndexReloader(retriever, index_dir=index_dir, on_reload=on_reload, version=version)
+    if ct.INDEX_HOT_RELOAD_ENABLED:
+        reloader.start()
+
+    # インデックスの版番号・直近の更新所要時間をメトリクスのエンドポイントから参照できるようにする
+    registry = metrics.get_registry()
+    registry.register_gauge("index_version", lambda: reloader.version)
+    registry.register_gauge("index_last_reload_sec", lambda: reloader.status()["last_reload_sec"])
+    registry.register_gauge("index_reload_failures", lambda: reloader.status()["reload_failures"])
+    return reloader
+
+
+def clone_index(src_dir, dst_dir):
+    """
+    インデックスのフォルダを、更新用の別フォルダへ複製
+    ※一時ファイルへの書き込みと置き換え（os.replace）でのみ更新されるファイルは、コピーせずハードリンクする
+      （更新時は新しいファイルに置き換わるため、複製元の版の内容は変わらない）
+    ※Chromaのデータベースは同じファイルをその場で書き換えるため、コピーする
+    """
+    if ct.VECTOR_STORE_BACKEND == "chroma":
+        linkable = {ct.INDEX_MANIFEST_FILE, ct.CORPUS_SNAPSHOT_FILE, ct.WEB_CACHE_DIR_NAME}
+    else:
+        linkable = None
+
+    def copy_file(src, dst):
+        top = os.path.relpath(src, src_dir).split(os.sep)[0]
+        if linkable is None or top in linkable:
+            try:
+                os.link(src, dst)
+                return dst
+            except OSError:
+                # ハードリンクできないファイルシステムではコピーする
+                pass
+        return shutil.copy2(src, dst)
+
+    shutil.copytree(src_dir, dst_dir, copy_function=copy_file)
+
+
+def snapshot_sources(folder=None):
+    """
+    インデックス対象ファイルの更新日時・サイズを取得（変更検知用）
+
+    Returns:
+        {ファイルパス: (更新日時, サイズ)}
+    """
+    snapshot = {}
+    for path in ingest.list_source_files(folder or ct.RAG_TOP_FOLDER_PATH):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # 列挙後に削除されたファイルは、次回の確認で削除として扱う
+            continue
+        snapshot[path] = (stat.st_mtime, stat.st_size)
+    return snapshot
+
+
+def snapshot_from_manifest(index_dir=None):
+    """
+    インデックス構築時点のファイルの更新日時・サイズをマニフェストから取得
+    ※アプリ停止中に変更されたファイルも、起動後の最初の確認で検知できるようにする
+    """
+    sources = indexer.load_manifest(index_dir).get("sources", {})
+    return {
+        path: (entry.get("mtime"), entry.get("size"))
+        for path, entry in sources.items()
+        if "mtime" in entry
+    }
+
+
+############################################################
+# クラス定義
+############################################################
+
+class IndexReloader:
+    """
+    インデックスの自動更新と、検索に使うRetrieverの切り替え
+    ※ファイル監視（watchdog）で変更を即時に検知し、使えない環境では一定間隔の確認で代用する
+    ※更新はロックファイルを取得した1プロセスのみが行い、他のワーカープロセスは公開された版に切り替えるだけにする
+      （ワーカープロセスごとに同じ変更を埋め込み直さず、互いの版のフォルダを削除しないようにするため）
+    """
+
+    def __init__(self, retriever, index_dir=None, versions_dir=None, data_dir=None, on_reload=None, version=1):
+        """
+        Args:
+            retriever: 起動時に作成したRetriever
+            index_dir: 起動時のインデックスの保存先
+            versions_dir: 更新版のインデックスの保存先
+            data_dir: 監視するデータフォルダ
+            on_reload: 切り替え後に呼び出す関数（引数は更新内容の集計）
+            version: 起動時のインデックスの版番号
+        """
+        self.index_dir = index_dir or ct.INDEX_DIR_PATH
+        self.versions_dir = versions_dir or ct.INDEX_VERSIONS_DIR_PATH
+        self.data_dir = data_dir or ct.RAG_TOP_FOLDER_PATH
+        self.on_reload = on_reload
+        # indexer.py（コマンドライン）で更新するインデックス（起動時に公開済みの版を開いた場合はINDEX_DIR_PATH）
+        self.base_dir = ct.INDEX_DIR_PATH if self._is_version_dir(self.index_dir) else self.index_dir
+
+        vectorstore = getattr(retriever, "vectorstore", None)
+        self.embeddings = getattr(vectorstore, "embeddings", None)
+
+        self._lock = threading.Lock()
+        self._current = (version, retriever, self.index_dir)
+        # このプロセスで切り替え前となった版のフォルダと、切り替えた時刻（猶予が過ぎたら接続を解放する）
+        self._retired = {}
+        self._known = snapshot_from_manifest(self.index_dir)
+        # 更新を担当している間は、ロックファイルを開いたままにする
+        self._lock_file = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._observer = None
+
+        self.stats = {
+            "index_version": version,
+            "index_dir": self.index_dir,
+            "role": "follower",
+            "watcher": "stopped",
+            "reloads": 0,
+            "reload_failures": 0,
+            "last_reload_sec": None,
+            "last_reload_at": None,
+            "last_error": "",
+            "last_changes": {},
+        }
+
+    @property
+    def version(self):
+        return self._current[0]
+
+    @property
+    def current(self):
+        return self._current[1]
+
+    def snapshot(self):
+        """
+        現在の版番号とRetrieverの組を取得
+        ※1件の質問の処理中は同じ版を使い続けられるよう、まとめて取得する
+        """
+        version, retriever, _ = self._current
+        return version, retriever
+
+    def status(self):
+        """
+        監視用の状態（版番号・直近の更新所要時間など）を取得
+        """
+        with self._lock:
+            return dict(self.stats)
+
+    def start(self):
+        """
+        変更の監視と、バックグラウンドでの更新処理を開始
+        """
+        if self._thread is not None:
+            return
+        self._start_observer()
+        self._thread = threading.Thread(target=self._run, name="index-reloader", daemon=True)
+        self._thread.start()
+        # 停止中に変更されたファイルがあれば、起動直後に反映する
+        self._wake.set()
+
+    def stop(self):
+        """
+        監視と更新処理を停止（更新を担当していた場合は、他のワーカープロセスに引き継ぐ）
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+        self._set_stats(watcher="stopped", role="follower")
+
+    def notify(self):
+        """
+        変更の確認を要求（ファイル監視のイベントから呼び出される）
+        """
+        self._wake.set()
+
+    def check_and_reload(self):
+        """
+        前回の確認以降にファイルが変更されていれば、インデックスを更新して切り替える
+
+        Returns:
+            更新内容の集計（変更がない場合・更新に失敗した場合はNone）
+        """
+        snapshot = snapshot_sources(self.data_dir)
+        if snapshot == self._known:
+            return None
+
+        stats = self.reload()
+        # 更新に失敗した場合は、次回の確認で再試行する
+        # ※更新中に変更されたファイルは、更新前に取得した状態と異なるため次回の確認で反映する
+        if stats is not None:
+            self._known = snapshot
+        return stats
+
+    def follow(self):
+        """
+        他のプロセスが公開した新しい版があれば、その版に切り替える（埋め込み・更新は行わない）
+
+        Returns:
+            切り替えた場合はTrue
+        """
+        published = load_published_version(self.base_dir, self.versions_dir)
+        if published is None or published[0] <= self.version:
+            return False
+
+        version, version_dir = published
+        try:
+            retriever = open_retriever(version_dir, self.embeddings)
+        except Exception as e:
+            logger.warning(f"公開されたインデックスの版を開けなかったため、現在の版を使い続けます: {version_dir}\n{e}")
+            return False
+
+        self._swap(version, retriever, version_dir)
+        self._known = snapshot_from_manifest(version_dir)
+        self._set_stats(index_version=version, index_dir=version_dir)
+        logger.info({"index_follow": {"version": version, "index_dir": version_dir}})
+        return True
+
+    def reload(self):
+        """
+        現在のインデックスを複製したフォルダで差分更新し、完成後にRetrieverを切り替えて公開する
+
+        Returns:
+            更新内容の集計（失敗時はNone）
+        """
+        started = time.perf_counter()
+        version, _, live_dir = self._current
+        # 版番号は、公開済みの版（前回以前の起動・他のプロセスで公開された版を含む）より大きくする
+        new_version = max(version, read_published(self.versions_dir).get("version", 0)) + 1
+        # フォルダ名はプロセスごとに異なるものにする（同じ秒に複数のプロセスが更新しても衝突しないようにする）
+        new_dir = os.path.join(self.versions_dir, f"v{new_version}-{os.getpid()}-{int(time.time())}")
+
+        try:
+            os.makedirs(self.versions_dir, exist_ok=True)
+            clone_index(live_dir, new_dir)
+            db = indexer.open_vector_store(new_dir, self.embeddings)
+            # Webページの再取得はコマンドライン（indexer.py）で行い、ここではファイルの変更のみ反映する
+            stats = indexer.update_index(db, index_dir=new_dir, include_web=False, data_dir=self.data_dir)
+            retriever = open_retriever(new_dir, self.embeddings)
+        except Exception as e:
+            indexer.close_vector_store(new_dir)
+            shutil.rmtree(new_dir, ignore_errors=True)
+            self._set_stats(
+                reload_failures=self.stats["reload_failures"] + 1,
+                last_error=f"{type(e).__name__}: {e}",
+            )
+            logger.warning(f"インデックスの自動更新に失敗したため、現在の版を使い続けます。\n{e}")
+            self._write_status()
+            return None
+
+        self._swap(new_version, retriever, new_dir)
+        self._publish(new_version, new_dir)
+        # 切り替え前の版のフォルダの更新日時を、切り替えた時刻とする（他のプロセスが削除までの猶予の判定に使う）
+        if self._is_version_dir(live_dir):
+            os.utime(live_dir)
+
+        elapsed = round(time.perf_counter() - started, 3)
+        stats.pop("load_timings", None)
+        changes = {k: v for k, v in stats.items() if k.startswith("sources_") and v}
+        self._set_stats(
+            index_version=new_version,
+            index_dir=new_dir,
+            reloads=self.stats["reloads"] + 1,
+            last_reload_sec=elapsed,
+            last_reload_at=time.strftime("%Y-%m-%dT%H:%M:%S"),
+            last_error="",
+            last_changes=changes,
+        )
+        logger.info({"index_reload": {"version": new_version, "elapsed_sec": elapsed, **changes}})
+
+        if self.on_reload is not None:
+            try:
+                self.on_reload(stats)
+            except Exception as e:
+                logger.warning(f"インデックス切り替え後の処理に失敗しました。\n{e}")
+
+        self._remove_old_versions()
+        self._write_status()
+        return stats
+
+    def _is_version_dir(self, path):
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.versions_dir)
+
+    def _swap(self, version, retriever, index_dir):
+        """
+        検索に使うRetrieverを切り替え、切り替え前の版を猶予の対象として記録
+        """
+        # 参照先の入れ替えは組の代入1回で行うため、検索中の質問は切り替え前の版をそのまま使える
+        with self._lock:
+            _, _, old_dir = self._current
+            self._current = (version, retriever, index_dir)
+        self._retired[old_dir] = time.time()
+
+    def _publish(self, version, index_dir):
+        """
+        更新した版を、他のワーカープロセス・再起動後のプロセスが開く版として公開
+        """
+        path = published_path(self.versions_dir)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        published = {"version": version, "index_dir": index_dir, "published_at": time.time()}
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(published, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"インデックスの版を公開できませんでした。\n{e}")
+
+    def _try_lead(self):
+        """
+        ロックファイルを取得し、このプロセスがインデックスの更新を担当するかを判定
+        ※ロックはプロセスの終了時に解放されるため、担当のプロセスが停止すると他のワーカープロセスが引き継ぐ
+
+        Returns:
+            更新を担当する場合はTrue
+        """
+        if self._lock_file is not None:
+            return True
+        os.makedirs(self.versions_dir, exist_ok=True)
+        lock_file = open(os.path.join(self.versions_dir, ct.INDEX_RELOAD_LOCK_FILE), "a+")
+        try:
+            try:
+                import fcntl
+
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except ImportError:
+                # Windowsではmsvcrtでロックする
+                import msvcrt
+
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+
+        self._lock_file = lock_file
+        self._set_stats(role="leader")
+        logger.info(f"このプロセス（{os.getpid()}）がインデックスの自動更新を担当します。")
+        return True
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(ct.INDEX_RELOAD_POLL_INTERVAL_SEC)
+            # ファイルのコピー途中に更新しないよう、変更の通知が止むまで待つ
+            while self._wake.is_set() and not self._stop.is_set():
+                self._wake.clear()
+                self._stop.wait(ct.INDEX_RELOAD_DEBOUNCE_SEC)
+            if self._stop.is_set():
+                break
+            try:
+                # 担当を引き継いだ直後も、先に公開済みの最新の版へ切り替えてから変更を確認する
+                self.follow()
+                if self._try_lead():
+                    self.check_and_reload()
+                    # 変更がなくても、猶予が過ぎた切り替え前の版は削除する
+                    self._remove_old_versions()
+            except Exception as e:
+                logger.warning(f"データフォルダの変更確認に失敗しました。\n{e}")
+            self._release_retired()
+
+    def _start_observer(self):
+        """
+        ファイル監視（watchdog：Linuxではinotify）を開始（使えない環境では一定間隔の確認のみ）
+        """
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+
+            reloader = self
+
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    if event.event_type not in ("opened", "closed_no_write"):
+                        reloader.notify()
+
+            observer = Observer()
+            observer.schedule(Handler(), self.data_dir, recursive=True)
+            observer.daemon = True
+            observer.start()
+        except Exception as e:
+            logger.info(f"ファイル監視を使わず、{ct.INDEX_RELOAD_POLL_INTERVAL_SEC}秒ごとに変更を確認します: {e}")
+            self._set_stats(watcher="polling")
+            return
+        self._observer = observer
+        self._set_stats(watcher="watchdog")
+
+    def _release_retired(self):
+        """
+        このプロセスで切り替え前となった版のうち、猶予が過ぎた版のベクターストアの接続を解放
+        """
+        now = time.time()
+        for path, retired_at in list(self._retired.items()):
+            if path != self._current[2] and now - retired_at >= ct.INDEX_RETIRE_GRACE_SEC:
+                indexer.close_vector_store(path)
+                del self._retired[path]
+
+    def _remove_old_versions(self):
+        """
+        保持数を超えた古い版のフォルダを削除（更新を担当するプロセスのみ。前回以前の起動・他のプロセスで作られた版も含む）
+        ※公開中の版と、新しい順にINDEX_KEEP_VERSIONS件の版は削除しない
+        ※他のワーカープロセスが切り替え前の版で検索している可能性があるため、切り替えから（フォルダの更新日時から）
+          INDEX_RETIRE_GRACE_SECが経過するまでは削除せず、削除前にベクターストアの接続を解放する
+        """
+        now = time.time()
+        versions = []
+        for name in os.listdir(self.versions_dir):
+            path = os.path.join(self.versions_dir, name)
+            if os.path.isdir(path):
+                versions.append((os.path.getmtime(path), path))
+        versions.sort(reverse=True)
+
+        keep = {path for _, path in versions[:ct.INDEX_KEEP_VERSIONS]}
+        keep |= {self._current[2], read_published(self.versions_dir).get("index_dir")}
+        for mtime, path in versions:
+            if path in keep or now - mtime < ct.INDEX_RETIRE_GRACE_SEC:
+                continue
+            indexer.close_vector_store(path)
+            shutil.rmtree(path, ignore_errors=True)
+            self._retired.pop(path, None)
+
+    def _set_stats(self, **values):
+        with self._lock:
+            self.stats.update(values)
+
+    def _write_status(self):
+        """
+        監視用の状態をファイルへ出力（外部の監視ツールから参照する用）
+        """
+        path = os.path.join(self.versions_dir, ct.INDEX_STATUS_FILE)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.status(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"インデックスの状態を出力できませんでした。\n{e}")
@@ -0,0 +1,561 @@
+"""
+このファイルは、RAGの参照先データをベクターストアへ登録するインデックス構築処理のファイルです。
+ディスク上のインデックスを差分更新するため、Streamlitアプリとは別にコマンドラインから実行できます。
+
+    python indexer.py            # 変更があったファイルのみ再登録
+    python indexer.py --rebuild  # インデックスを作り直す
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import logging
+import unicodedata
+from collections import defaultdict
+
+from dotenv import load_dotenv
+
+import constants as ct
+import ingest
+import chunker
+import web_loader
+import embedding_client
+
+
+############################################################
+# 設定関連
+############################################################
+load_dotenv()
+
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義（文字コード調整・チャンク分割）
+############################################################
+
+def adjust_string(s):
+    """
+    Windows環境でRAGが正常動作するよう調整
+    """
+    if type(s) is not str:
+        return s
+
+    if sys.platform.startswith("win"):
+        s = unicodedata.normalize("NFC", s)
+        s = s.encode("cp932", "ignore").decode("cp932")
+        return s
+
+    return s
+
+
+def adjust_documents(docs):
+    """
+    Documentの本文・メタデータに文字コード調整を適用（Windows対策）
+    """
+    for doc in docs:
+        doc.page_content = adjust_string(doc.page_content)
+        if getattr(doc, "metadata", None):
+            for key in list(doc.metadata.keys()):
+                doc.metadata[key] = adjust_string(doc.metadata[key])
+    return docs
+
+
+def split_documents(docs):
+    """
+    Documentをチャンク分割
+
+    Returns:
+        チャンク分割後のDocumentのリスト
+    """
+    return chunker.split_documents(docs)
+
+
+############################################################
+# 関数定義（ハッシュ・マニフェスト）
+############################################################
+
+def file_content_hash(path):
+    """
+    ファイル内容のハッシュ値を計算
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_hash(doc):
+    """
+    チャンクの本文とメタデータから埋め込み判定用のハッシュ値を計算
+    ※本文かメタデータが変わったチャンクだけを再埋め込みの対象にする
+    """
+    payload = json.dumps(
+        {"text": doc.page_content, "metadata": doc.metadata},
+        ensure_ascii=False,
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def chunk_id(source, hash_value):
+    """
+    ベクターストア上のチャンクIDを作成（ソース単位で削除できるよう、ソースのハッシュを接頭辞にする）
+    """
+    source_key = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    return f"{source_key}-{hash_value[:32]}"
+
+
+def index_settings():
+    """
+    インデックスの互換性を判定するための設定値
+    ※チャンク分割の設定が変わった場合はインデックスを作り直す
+    """
+    settings = {
+        "schema_version": ct.INDEX_SCHEMA_VERSION,
+        "chunk_size": ct.CHUNK_SIZE,
+        "chunk_overlap": ct.CHUNK_OVERLAP,
+        "chunking_strategy": ct.CHUNKING_STRATEGY,
+        "chunk_min_size": ct.CHUNK_MIN_SIZE,
+        "csv_chunk_size": [ct.CSV_CHUNK_SIZE, ct.CSV_CHUNK_MAX_ROWS],
+        "chunk_dedup": [ct.CHUNK_DEDUP_THRESHOLD, ct.CHUNK_DEDUP_SHINGLE_SIZE, ct.CHUNK_DEDUP_MIN_PARAGRAPH_CHARS],
+        "collection_name": ct.VECTOR_STORE_COLLECTION_NAME,
+    }
+    # ベクターストアの種類・保持形式を変えた場合も作り直す（既存のChromaのインデックスは作り直さない）
+    if ct.VECTOR_STORE_BACKEND != "chroma":
+        settings["vector_store"] = [ct.VECTOR_STORE_BACKEND, ct.NUMPY_STORE_DTYPE]
+    return settings
+
+
+def manifest_path(index_dir=None):
+    """
+    マニフェストファイルのパスを取得
+    """
+    return os.path.join(index_dir or ct.INDEX_DIR_PATH, ct.INDEX_MANIFEST_FILE)
+
+
+def index_exists(index_dir=None):
+    """
+    ディスク上に利用可能なインデックスが存在するかを判定
+    """
+    manifest = load_manifest(index_dir)
+    return bool(manifest.get("sources")) and manifest.get("settings") == index_settings()
+
+
+def load_manifest(index_dir=None):
+    """
+    マニフェストの読み込み（存在しない・壊れている場合は空のマニフェスト）
+    """
+    path = manifest_path(index_dir)
+    if not os.path.exists(path):
+        return {"settings": index_settings(), "sources": {}}
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"インデックスのマニフェストを読み込めませんでした。\n{e}")
+        return {"settings": index_settings(), "sources": {}}
+
+
+def manifest_digest(manifest):
+    """
+    マニフェストに記録されたチャンク構成のハッシュ値（スナップショットとインデックスの対応確認用）
+    ※更新日時のみが変わった場合は同じ値になる
+    """
+    payload = {
+        "settings": manifest.get("settings"),
+        "sources": {
+            source: [c["id"] for c in entry.get("chunks", [])]
+            for source, entry in manifest.get("sources", {}).items()
+        },
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def save_manifest(manifest, index_dir=None):
+    """
+    マニフェストの書き込み（途中状態のファイルが残らないよう一時ファイル経由で置き換え）
+    """
+    path = manifest_path(index_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+############################################################
+# 関数定義（インデックス構築）
+############################################################
+
+def open_vector_store(index_dir=None, embeddings=None):
+    """
+    ディスク上のベクターストアを開く（存在しなければ空のストアが作成される）
+    """
+    if ct.VECTOR_STORE_BACKEND == "numpy":
+        from numpy_vector_store import NumpyVectorStore
+
+        return NumpyVectorStore(
+            collection_name=ct.VECTOR_STORE_COLLECTION_NAME,
+            embedding_function=embeddings or embedding_client.create_embeddings(),
+            persist_directory=index_dir or ct.INDEX_DIR_PATH,
+        )
+    if ct.VECTOR_STORE_BACKEND != "chroma":
+        raise ValueError(f"未対応のベクターストアです: {ct.VECTOR_STORE_BACKEND}")
+
+    # chromadbのimportは重いため、ベクターストアを開くときに読み込む
+    from langchain_community.vectorstores import Chroma
+
+    return Chroma(
+        collection_name=ct.VECTOR_STORE_COLLECTION_NAME,
+        embedding_function=embeddings or embedding_client.create_embeddings(),
+        persist_directory=index_dir or ct.INDEX_DIR_PATH,
+    )
+
+
+def close_vector_store(index_dir):
+    """
+    フォルダのベクターストアを開いているChromaの接続を解放（フォルダを削除・置き換える前に呼び出す）
+    ※Chromaは同じフォルダを開くクライアント間でプロセス内の接続を共有し、閉じるAPIがないため、フォルダ単位で解放する
+    """
+    # Chromaを一度も開いていなければ何もしない（chromadbのimportは重いため）
+    if ct.VECTOR_STORE_BACKEND != "chroma" or "chromadb" not in sys.modules:
+        return
+    from chromadb.api.client import SharedSystemClient
+
+    target = os.path.abspath(index_dir)
+    for identifier, system in list(SharedSystemClient._identifer_to_system.items()):
+        if identifier and os.path.abspath(identifier) == target:
+            SharedSystemClient._identifer_to_system.pop(identifier, None)
+            system.stop()
+
+
+def _prepare_chunks(source, docs, dedup=None, stats=None):
+    """
+    ソース1件分のDocumentをチャンク分割し、IDとハッシュ値を付与
+
+    Args:
+        dedup: 定型文の段落を除くフィルタ（BoilerplateFilter）
+
+    Returns:
+        (チャンクIDのリスト, チャンクのリスト, マニフェスト用のチャンク情報)
+    """
+    chunks = split_documents(adjust_documents(docs))
+
+    ids = []
+    unique_chunks = []
+    entries = []
+    for chunk in chunks:
+        # 定型文の段落を除き、すべて定型文だったチャンクは登録しない
+        if dedup is not None:
+            removed_before = dedup.paragraphs_removed
+            content = dedup.deduplicate(chunk.page_content, source)
+            if stats is not None:
+                stats["paragraphs_near_duplicate"] += dedup.paragraphs_removed - removed_before
+            if content is None:
+                if stats is not None:
+                    stats["chunks_near_duplicate"] += 1
+                continue
+            chunk.page_content = content
+        hash_value = chunk_hash(chunk)
+        doc_id = chunk_id(source, hash_value)
+        # 同一ソース内で本文・メタデータが完全一致するチャンクは1件だけ登録
+        if doc_id in ids:
+            continue
+        ids.append(doc_id)
+        unique_chunks.append(chunk)
+        entries.append({"id": doc_id, "hash": hash_value})
+
+    return ids, unique_chunks, entries
+
+
+def _learn_boilerplate(results):
+    """
+    グループ内のファイルをチャンク分割し、ファイル間で共通する段落（定型文）を学習
+    ※登録時と同じ分割結果から学習するため、読み込み結果を複製して分割する
+    """
+    files = {
+        result.path: split_documents(adjust_documents([d.model_copy(deep=True) for d in result.docs]))
+        for result in results
+        if not result.error
+    }
+    return chunker.learn_boilerplate(files)
+
+
+def _apply_source(db, source, docs, old_entry, stats, pending_adds, dedup=None):
+    """
+    ソース1件分のチャンクをベクターストアへ差分反映
+    ※変更のないチャンクは再埋め込みせず、追加分のみ埋め込み・不要分のみ削除する
+    ※追加分は複数ソースをまとめて埋め込むため、pending_addsに溜めて_flush_addsで登録する
+    """
+    ids, chunks, entries = _prepare_chunks(source, docs, dedup, stats)
+
+    old_ids = {c["id"] for c in (old_entry or {}).get("chunks", [])}
+    new_ids = set(ids)
+
+    add_pairs = [(i, c) for i, c in zip(ids, chunks) if i not in old_ids]
+    delete_ids = sorted(old_ids - new_ids)
+
+    if delete_ids:
+        db.delete(ids=delete_ids)
+    pending_adds.extend(add_pairs)
+    if len(pending_adds) >= ct.EMBEDDING_FLUSH_SIZE:
+        _flush_adds(db, pending_adds)
+
+    stats["chunks_embedded"] += len(add_pairs)
+    stats["chunks_deleted"] += len(delete_ids)
+    stats["chunks_reused"] += len(new_ids & old_ids)
+    return entries
+
+
+def _flush_adds(db, pending_adds):
+    """
+    溜めておいた追加チャンクをまとめて埋め込み、ベクターストアへ登録
+    """
+    if not pending_adds:
+        return
+    db.add_documents([c for _, c in pending_adds], ids=[i for i, _ in pending_adds])
+    pending_adds.clear()
+
+
+def update_index(db, index_dir=None, rebuild=False, include_web=True, max_workers=None, data_dir=None):
+    """
+    データソースの変更を検知し、ベクターストアとマニフェストを差分更新
+
+    Args:
+        db: 更新対象のベクターストア
+        index_dir: インデックスの保存先
+        rebuild: Trueの場合、既存のインデックスを破棄して作り直す
+        include_web: Webページも再取得するかどうか
+        max_workers: ファイル読み込みのワーカープロセス数（未指定時はINGEST_MAX_WORKERS）
+        data_dir: 参照先ファイルのフォルダ（未指定時はRAG_TOP_FOLDER_PATH）
+
+    Returns:
+        更新内容の集計
+    """
+    started = time.perf_counter()
+    data_dir = data_dir or ct.RAG_TOP_FOLDER_PATH
+    manifest = load_manifest(index_dir)
+
+    # 設定が変わったインデックスは再利用できないため作り直す
+    if rebuild or manifest.get("settings") != index_settings():
+        old_ids = [c["id"] for entry in manifest.get("sources", {}).values() for c in entry.get("chunks", [])]
+        if old_ids:
+            db.delete(ids=old_ids)
+        manifest = {"settings": index_settings(), "sources": {}}
+
+    old_sources = manifest.get("sources", {})
+    new_sources = {}
+    pending_adds = []
+    stats = {
+        "sources_added": 0,
+        "sources_updated": 0,
+        "sources_unchanged": 0,
+        "sources_deleted": 0,
+        "sources_failed": 0,
+        "chunks_embedded": 0,
+        "chunks_reused": 0,
+        "chunks_deleted": 0,
+        "chunks_near_duplicate": 0,
+        "paragraphs_near_duplicate": 0,
+        "load_timings": {},
+        # 追加・更新・削除されたソース（回答キャッシュの無効化に使う）
+        "changed_sources": [],
+    }
+
+    # ファイル：更新日時・サイズが同じなら読み込まず、内容ハッシュが同じなら再分割もしない
+    # ※議事録の定型文は、全体構築時にグループ全体から学習した一覧（マニフェストに保存）をもとに各ファイルから取り除く
+    #   （1件のファイルの追加・更新・削除で、他のファイルのチャンクが変わらないようにするため）
+    groups = defaultdict(list)
+    for path in ingest.list_source_files(data_dir):
+        groups[chunker.dedup_group_key(path, data_dir)].append(path)
+    boilerplate = {key: entries for key, entries in manifest.get("boilerplate", {}).items() if key in groups}
+    # 定型文が未学習のグループ（全体構築時など）は、グループ内のファイルをすべて読み込んでから学習する
+    learning = {key for key, paths in groups.items() if key not in paths and key not in boilerplate}
+
+    pending = {}
+    for group_key, group_paths in groups.items():
+        for path in group_paths:
+            stat = os.stat(path)
+            old_entry = old_sources.get(path)
+            relearn = group_key in learning
+            if old_entry and old_entry.get("mtime") == stat.st_mtime and old_entry.get("size") == stat.st_size and not relearn:
+                new_sources[path] = {**old_entry, "mtime": stat.st_mtime, "size": stat.st_size}
+                stats["sources_unchanged"] += 1
+                continue
+            content_hash = file_content_hash(path)
+            unchanged = bool(old_entry) and old_entry.get("content_hash") == content_hash
+            if unchanged and not relearn:
+                new_sources[path] = {**old_entry, "mtime": stat.st_mtime, "size": stat.st_size}
+                stats["sources_unchanged"] += 1
+                continue
+            pending[path] = (stat, content_hash, old_entry, unchanged)
+
+    # 変更のあったファイルを並列に読み込み、読み込めた順にチャンク分割・登録
+    filters = {key: chunker.BoilerplateFilter(entries) for key, entries in boilerplate.items()}
+    learning_loaded = defaultdict(dict)
+    for result in ingest.iter_loaded_files(pending.keys(), max_workers=max_workers, data_dir=data_dir):
+        stats["load_timings"][result.path] = round(result.elapsed_sec, 3)
+        group_key = chunker.dedup_group_key(result.path, data_dir)
+        results = [result]
+        if group_key in learning:
+            learning_loaded[group_key][result.path] = result
+            if len(learning_loaded[group_key]) < len(groups[group_key]):
+                continue
+            results = list(learning_loaded.pop(group_key).values())
+            boilerplate[group_key] = _learn_boilerplate(results)
+            filters[group_key] = chunker.BoilerplateFilter(boilerplate[group_key])
+            logger.info(f"定型文を学習しました: {group_key}（{len(boilerplate[group_key])}段落）")
+
+        for result in results:
+            path = result.path
+            stat, content_hash, old_entry, unchanged = pending[path]
+
+            # 読み込みに失敗したファイルは既存のチャンクを残し、次回の更新で再試行する
+            if result.error:
+                if old_entry:
+                    new_sources[path] = old_entry
+                stats["sources_failed"] += 1
+                continue
+
+            entries = _apply_source(db, path, result.docs, old_entry, stats, pending_adds, filters.get(group_key))
+            new_sources[path] = {
+                "mtime": stat.st_mtime,
+                "size": stat.st_size,
+                "content_hash": content_hash,
+                "chunks": entries,
+            }
+            # 定型文の学習のために読み込んだ、内容が同じでチャンクも変わらないファイルは変更扱いにしない
+            old_ids = [c["id"] for c in (old_entry or {}).get("chunks", [])]
+            if unchanged and [e["id"] for e in entries] == old_ids:
+                stats["sources_unchanged"] += 1
+                continue
+            stats["sources_updated" if old_entry else "sources_added"] += 1
+            stats["changed_sources"].append(path)
+            logger.info(f"インデックスを更新しました: {path}（{len(entries)}チャンク）")
+
+    # Webページ：並列に取得し、サーバーが更新なし（304）と応答したページや本文のハッシュが同じページは再登録しない
+    # ※取得に失敗したページは前回取得時の内容で代用し、それもなければ既存のチャンクを残す
+    web_results = {}
+    if include_web and ct.WEB_URL_LOAD_TARGETS:
+        web_results = web_loader.load_web_pages(
+            ct.WEB_URL_LOAD_TARGETS,
+            cache_dir=os.path.join(index_dir or ct.INDEX_DIR_PATH, ct.WEB_CACHE_DIR_NAME),
+        )
+
+    for web_url in ct.WEB_URL_LOAD_TARGETS:
+        old_entry = old_sources.get(web_url)
+        result = web_results.get(web_url)
+        if result is not None:
+            stats["load_timings"][web_url] = round(result.elapsed_sec, 3)
+
+        if result is None or result.status == "failed":
+            if old_entry:
+                new_sources[web_url] = old_entry
+            if result is not None:
+                stats["sources_failed"] += 1
+            continue
+
+        if old_entry and old_entry.get("content_hash") == result.content_hash:
+            new_sources[web_url] = old_entry
+            stats["sources_unchanged"] += 1
+            continue
+
+        docs = result.docs
+        for doc in docs:
+            doc.metadata.update({"category": ct.WEB_CATEGORY_NAME, "doc_type": "web"})
+        entries = _apply_source(db, web_url, docs, old_entry, stats, pending_adds)
+        new_sources[web_url] = {"content_hash": result.content_hash, "chunks": entries}
+        stats["sources_updated" if old_entry else "sources_added"] += 1
+        stats["changed_sources"].append(web_url)
+
+    _flush_adds(db, pending_adds)
+
+    # 削除されたソースのチャンクを除去
+    for source, old_entry in old_sources.items():
+        if source in new_sources:
+            continue
+        delete_ids = [c["id"] for c in old_entry.get("chunks", [])]
+        if delete_ids:
+            db.delete(ids=delete_ids)
+        stats["chunks_deleted"] += len(delete_ids)
+        stats["sources_deleted"] += 1
+        stats["changed_sources"].append(source)
+        logger.info(f"インデックスから削除しました: {source}")
+
+    manifest["sources"] = new_sources
+    manifest["boilerplate"] = boilerplate
+    save_manifest(manifest, index_dir)
+
+    # 複数のワーカープロセスで共有する読み取り専用のスナップショットを書き出す（変更がなく最新の場合は省略）
+    if ct.CORPUS_SNAPSHOT_ENABLED:
+        import corpus_snapshot
+
+        if stats["changed_sources"] or corpus_snapshot.open_snapshot(index_dir) is None:
+            stats["snapshot"] = corpus_snapshot.write_snapshot(db, index_dir, manifest)
+
+    stats["elapsed_sec"] = round(time.perf_counter() - started, 3)
+    return stats
+
+
+############################################################
+# コマンドライン実行
+############################################################
+
+def main(argv=None):
+    """
+    インデックスの構築・差分更新をコマンドラインから実行
+    """
+    parser = argparse.ArgumentParser(description="RAG用インデックスの構築・差分更新")
+    parser.add_argument("--index-dir", default=ct.INDEX_DIR_PATH, help="インデックスの保存先")
+    parser.add_argument("--rebuild", action="store_true", help="既存のインデックスを破棄して作り直す")
+    parser.add_argument("--skip-web", action="store_true", help="Webページの再取得を行わない")
+    parser.add_argument("--workers", type=int, default=None, help="ファイル読み込みのワーカープロセス数")
+    parser.add_argument(
+        "--embedding-backend",
+        choices=["openai", "fake"],
+        default=None,
+        help="埋め込みモデル（fakeはAPIを呼ばないオフライン計測用）",
+    )
+    parser.add_argument(
+        "--vector-store",
+        choices=["chroma", "numpy"],
+        default=None,
+        help="ベクターストアの種類（未指定時は定数VECTOR_STORE_BACKEND）",
+    )
+    args = parser.parse_args(argv)
+    if args.vector_store:
+        ct.VECTOR_STORE_BACKEND = args.vector_store
+
+    logging.basicConfig(level=logging.INFO, format="[%(levelname)s] %(asctime)s %(message)s")
+
+    embeddings = embedding_client.create_embeddings(args.embedding_backend)
+    db = open_vector_store(args.index_dir, embeddings)
+    stats = update_index(
+        db,
+        index_dir=args.index_dir,
+        rebuild=args.rebuild,
+        include_web=not args.skip_web,
+        max_workers=args.workers,
+    )
+
+    # ファイルごとの読み込み時間（時間のかかった順）
+    stats.pop("changed_sources")
+    timings = stats.pop("load_timings")
+    if timings:
+        print(ingest.format_timing_report(timings))
+    stats["embedding"] = embeddings.stats
+    print(json.dumps(stats, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
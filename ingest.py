@@ -0,0 +1,279 @@
+"""
+このファイルは、RAGの参照先ファイルを読み込むデータ取り込み処理のファイルです。
+PDF・Wordの解析はCPU負荷が高く、ファイル同士は独立しているため、プロセスプールで並列に読み込みます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import time
+import logging
+import importlib
+import multiprocessing
+from collections import deque
+from functools import partial
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import constants as ct
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# {拡張子: ローダーの作成関数}（初めて使う拡張子のみimportする）
+_loader_factories = {}
+
+
+############################################################
+# データ定義
+############################################################
+
+@dataclass
+class LoadResult:
+    """
+    ファイル1件分の読み込み結果
+    """
+    path: str
+    docs: list = field(default_factory=list)
+    elapsed_sec: float = 0.0
+    error: str = ""
+
+
+############################################################
+# 関数定義
+############################################################
+
+def list_source_files(path):
+    """
+    インデックス対象となるファイルパスを再帰的に列挙
+
+    Returns:
+        対応拡張子のファイルパスのリスト
+    """
+    if not os.path.isdir(path):
+        if os.path.splitext(path)[1].lower() in ct.SUPPORTED_EXTENSIONS:
+            return [path]
+        return []
+
+    paths = []
+    for file_name in sorted(os.listdir(path)):
+        paths.extend(list_source_files(os.path.join(path, file_name)))
+    return paths
+
+
+def resolve_loader(file_extension):
+    """
+    拡張子に対応するローダーの作成関数を取得（ローダーのモジュールは初回のみimport）
+    """
+    if file_extension not in _loader_factories:
+        loader_path, kwargs = ct.SUPPORTED_EXTENSIONS[file_extension]
+        module_name, class_name = loader_path.rsplit(".", 1)
+        loader_class = getattr(importlib.import_module(module_name), class_name)
+        _loader_factories[file_extension] = partial(loader_class, **kwargs)
+    return _loader_factories[file_extension]
+
+
+def file_load(path, docs_all):
+    """
+    ファイル内のデータ読み込み
+    """
+    file_extension = os.path.splitext(path)[1].lower()
+
+    # 想定していたファイル形式の場合のみ読み込む（課題⑤：txtはconstants側で追加）
+    if file_extension in ct.SUPPORTED_EXTENSIONS:
+        loader_factory = resolve_loader(file_extension)
+        loader = loader_factory(path)
+        docs = loader.load()
+        docs_all.extend(docs)
+
+
+def derive_path_metadata(path, data_dir=None):
+    """
+    フォルダ構成からチャンクの絞り込み用メタデータを作成
+    例: ./data/MTG議事録/顧客/既存/<会社名>/<ファイル>
+        → {"category": "MTG議事録", "topic": "顧客", "customer_status": "既存", "company": <会社名>, "doc_type": "pdf"}
+
+    Returns:
+        メタデータの辞書（該当しない項目は含めない）
+    """
+    parts = os.path.normpath(os.path.relpath(path, data_dir or ct.RAG_TOP_FOLDER_PATH)).split(os.sep)
+    dirs = parts[:-1]
+
+    meta = {"doc_type": os.path.splitext(path)[1].lower().lstrip(".")}
+    if len(dirs) >= 1:
+        meta["category"] = dirs[0]
+    if len(dirs) >= 2:
+        meta["topic"] = dirs[1]
+    if len(dirs) >= 3 and dirs[1] == ct.CUSTOMER_FOLDER_NAME:
+        meta["customer_status"] = dirs[2]
+    if len(dirs) >= 4 and dirs[1] == ct.CUSTOMER_FOLDER_NAME:
+        meta["company"] = dirs[3]
+    return meta
+
+
+def load_file(path, data_dir=None):
+    """
+    ファイル1件を読み込み、所要時間とともに返す
+    ※壊れたファイルで全体の読み込みが止まらないよう、例外は結果に格納して返す
+    ※プロセスプールから呼び出すため、モジュール直下の関数として定義する
+    ※ワーカープロセスには呼び出し元で変更した定数が引き継がれないため、参照先フォルダは引数で受け取る
+
+    Returns:
+        読み込み結果（LoadResult）
+    """
+    started = time.perf_counter()
+    docs = []
+    error = ""
+    try:
+        file_load(path, docs)
+        path_metadata = derive_path_metadata(path, data_dir)
+        for doc in docs:
+            doc.metadata.update(path_metadata)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+        docs = []
+    return LoadResult(path=path, docs=docs, elapsed_sec=time.perf_counter() - started, error=error)
+
+
+def resolve_worker_count(max_workers=None):
+    """
+    読み込みに使うワーカー数を決定（未指定時は定数、定数も未指定ならCPU数）
+    """
+    if max_workers is None:
+        max_workers = ct.INGEST_MAX_WORKERS
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+    return max(1, int(max_workers))
+
+
+def mp_context():
+    """
+    ワーカープロセスの起動方式
+    ※アプリ（Streamlit・インデックスの自動更新）はスレッドを使うため、fork（スレッドの状態ごと複製）は使わない
+    """
+    method = ct.INGEST_MP_START_METHOD
+    if method not in multiprocessing.get_all_start_methods():
+        method = "spawn"
+    return multiprocessing.get_context(method)
+
+
+def iter_loaded_files(paths, max_workers=None, data_dir=None):
+    """
+    ファイルを並列に読み込み、読み終わった順に結果を返す
+    ※投入済みで未回収の件数を上限で抑え（有界キュー）、読み込み結果を順次後段のチャンク分割へ流す
+    ※ワーカープロセスが異常終了した場合（壊れたPDFの解析中のクラッシュなど）も全体の読み込みは止めず、
+      その時点で読み込み中だったファイルを1件ずつ別のプロセスで読み込み直し、残りは新しいプールで読み込む
+
+    Args:
+        paths: 読み込むファイルパスのリスト
+        max_workers: ワーカープロセス数（1の場合はプロセスを使わず逐次読み込み）
+        data_dir: 参照先フォルダ（未指定時はRAG_TOP_FOLDER_PATH。パスからのメタデータ作成に使う）
+
+    Yields:
+        読み込み結果（LoadResult）
+    """
+    paths = list(paths)
+    data_dir = data_dir or ct.RAG_TOP_FOLDER_PATH
+    max_workers = min(resolve_worker_count(max_workers), max(1, len(paths)))
+
+    if max_workers == 1:
+        for path in paths:
+            yield _log_result(load_file(path, data_dir))
+        return
+
+    remaining = deque(paths)
+    while remaining:
+        suspects = []
+        yield from _iter_pool_results(remaining, max_workers, data_dir, suspects)
+        for path in suspects:
+            yield _log_result(_load_isolated(path, data_dir))
+
+
+def _iter_pool_results(remaining, max_workers, data_dir, suspects):
+    """
+    プロセスプールでファイルを読み込む（ワーカープロセスが異常終了した場合は、読み込み中のファイルをsuspectsに移して終了）
+    """
+    queue_size = max_workers * ct.INGEST_QUEUE_SIZE_PER_WORKER
+
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context()) as executor:
+        # {Future: ファイルパス}
+        in_flight = {}
+
+        def fill():
+            while remaining and len(in_flight) < queue_size:
+                path = remaining.popleft()
+                in_flight[executor.submit(load_file, path, data_dir)] = path
+
+        try:
+            fill()
+        except BrokenProcessPool:
+            suspects.extend(in_flight.values())
+            return
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    logger.warning("ファイル読み込みのワーカープロセスが異常終了したため、読み込み中のファイルを個別に読み込み直します。")
+                    suspects.extend(in_flight.values())
+                    return
+                del in_flight[future]
+                yield _log_result(result)
+            try:
+                fill()
+            except BrokenProcessPool:
+                suspects.extend(in_flight.values())
+                return
+
+
+def _load_isolated(path, data_dir):
+    """
+    ファイル1件を専用のワーカープロセスで読み込む（プロセスごと異常終了した場合は失敗として返す）
+    """
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=1, mp_context=mp_context()) as executor:
+        try:
+            return executor.submit(load_file, path, data_dir).result()
+        except BrokenProcessPool as e:
+            return LoadResult(
+                path=path,
+                elapsed_sec=time.perf_counter() - started,
+                error=f"{type(e).__name__}: ファイルの読み込み中にワーカープロセスが異常終了しました",
+            )
+
+
+def _log_result(result):
+    """
+    ファイル1件分の読み込み結果をログ出力
+    """
+    if result.error:
+        logger.warning(f"ファイルの読み込みに失敗したためスキップします: {result.path}\n{result.error}")
+    else:
+        logger.info(f"ファイルを読み込みました: {result.path}（{result.elapsed_sec:.3f}秒, {len(result.docs)}件）")
+    return result
+
+
+def format_timing_report(timings, limit=None):
+    """
+    ファイルごとの読み込み時間を、時間のかかった順に整形
+
+    Args:
+        timings: {ファイルパス: 秒数}
+        limit: 表示件数の上限
+
+    Returns:
+        表示用の文字列
+    """
+    rows = sorted(timings.items(), key=lambda x: x[1], reverse=True)
+    if limit:
+        rows = rows[:limit]
+    total = sum(timings.values())
+    lines = [f"{sec:8.3f}s  {path}" for path, sec in rows]
+    lines.append(f"{total:8.3f}s  合計（{len(timings)}ファイル）")
+    return "\n".join(lines)
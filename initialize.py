@@ -6,21 +6,20 @@
 # ライブラリの読み込み
 ############################################################
 import os
-import sys
-import unicodedata
 import logging
+import importlib
+import threading
 from logging.handlers import TimedRotatingFileHandler
 from uuid import uuid4
 
 from dotenv import load_dotenv
 import streamlit as st
 
-from langchain_community.document_loaders import WebBaseLoader
-from langchain.text_splitter import CharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from langchain_community.vectorstores import Chroma
-
 import constants as ct
+import metrics
+import rag_client
+# ※インデックス・検索関連のモジュール（Chroma・LangChain等）は読み込みが重いため、
+#   画面の初期表示を妨げないよう使用する関数内で読み込む
 
 
 ############################################################
@@ -29,13 +28,6 @@ import constants as ct
 # 「.env」ファイルで定義した環境変数の読み込み（ローカル用）
 load_dotenv()
 
-# Streamlit Cloud対策：Secretsがあれば環境変数へ反映
-try:
-    if "OPENAI_API_KEY" in st.secrets:
-        os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
-except Exception:
-    pass
-
 
 ############################################################
 # 関数定義
@@ -44,11 +36,25 @@ except Exception:
 def initialize():
     """
     画面読み込み時に実行する初期化処理
+    ※Retrieverの準備は時間がかかるため含めず、画面の初期表示後にinitialize_retrieverで行う
     """
+    initialize_secrets()
     initialize_session_state()
     initialize_session_id()
     initialize_logger()
-    initialize_retriever()
+    initialize_metrics_server()
+
+
+def initialize_secrets():
+    """
+    Streamlit Cloud対策：Secretsがあれば環境変数へ反映
+    ※Secretsの参照は画面への出力を伴う場合があるため、import時ではなくset_page_config後に行う
+    """
+    try:
+        if "OPENAI_API_KEY" in st.secrets:
+            os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
+    except Exception:
+        pass
 
 
 def initialize_logger():
@@ -84,6 +90,22 @@ def initialize_logger():
         return
 
 
+def initialize_metrics_server():
+    """
+    処理段階別の所要時間の集計を返すエンドポイントを起動（プロセス内で1度のみ）
+    """
+    if ct.METRICS_ENABLED and ct.METRICS_SERVER_ENABLED:
+        get_metrics_server()
+
+
+@st.cache_resource(show_spinner=False)
+def get_metrics_server():
+    """
+    プロセス内で共有するメトリクスのエンドポイント（起動できなかった場合はNone）
+    """
+    return metrics.start_metrics_server()
+
+
 def initialize_session_id():
     """
     セッションIDの作成
@@ -94,112 +116,91 @@ def initialize_session_id():
 
 def initialize_retriever():
     """
-    画面読み込み時にRAGのRetriever（ベクターストアから検索するオブジェクト）を作成
+    画面読み込み時にRAGのRetriever（ベクターストアから検索するオブジェクト）を取得
     """
-    # すでにRetrieverが作成済みの場合、後続の処理を中断
-    if "retriever" in st.session_state:
+    # すでにRetrieverが取得済みの場合、後続の処理を中断
+    if st.session_state.get("retriever_ready"):
         return
 
-    # RAGの参照先となるデータソースの読み込み
-    docs_all = load_data_sources()
-
-    # Windows対策（文字コード調整）
-    for doc in docs_all:
-        doc.page_content = adjust_string(doc.page_content)
-        if getattr(doc, "metadata", None):
-            for key in list(doc.metadata.keys()):
-                doc.metadata[key] = adjust_string(doc.metadata[key])
-
-    # 埋め込みモデル
-    embeddings = OpenAIEmbeddings()
-
-    # チャンク分割（課題②：定数化）
-    text_splitter = CharacterTextSplitter(
-        chunk_size=ct.CHUNK_SIZE,
-        chunk_overlap=ct.CHUNK_OVERLAP,
-        separator="\n"
-    )
-
-    splitted_docs = text_splitter.split_documents(docs_all)
-
-    # ベクターストア作成
-    db = Chroma.from_documents(splitted_docs, embedding=embeddings)
+    # 検索・回答APIのサービスを使う場合は、インデックスを開かずにサービスの起動状態のみ確認する
+    if rag_client.service_url():
+        rag_client.get_client().health()
+        st.session_state.retriever_ready = True
+        return
 
-    # Retriever作成（課題①：3→5、課題②：定数化）
-    st.session_state.retriever = db.as_retriever(
-        search_kwargs={"k": ct.TOP_K}
-    )
+    # プロセス共有のRetrieverを準備するだけ（セッションごとのコピーは作らない）
+    # ※インデックスの自動更新で切り替わるため、質問ごとにget_current_retrieverで取得する
+    get_index_reloader()
+    st.session_state.retriever_ready = True
+    prewarm_modules()
 
 
-def initialize_session_state():
-    """
-    初期化データの用意
-    """
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+_prewarm_started = False
+_prewarm_lock = threading.Lock()
 
 
-def load_data_sources():
+def prewarm_modules():
     """
-    RAGの参照先となるデータソースの読み込み
-
-    Returns:
-        読み込んだデータソース（Documentのリスト）
+    回答生成で使う重いモジュールを、バックグラウンドで事前に読み込む
+    ※チャット入力の受付を待たせず、最初のメッセージ送信時の読み込み待ちをなくす
     """
-    docs_all = []
-
-    # フォルダ内ファイルを再帰的に読み込み（pdf/docx/csv/txtなど）
-    recursive_file_check(ct.RAG_TOP_FOLDER_PATH, docs_all)
+    global _prewarm_started
+    with _prewarm_lock:
+        if _prewarm_started:
+            return
+        _prewarm_started = True
 
-    # Webページ読み込み
-    web_docs_all = []
-    for web_url in ct.WEB_URL_LOAD_TARGETS:
-        loader = WebBaseLoader(web_url)
-        web_docs = loader.load()
-        web_docs_all.extend(web_docs)
+    def run():
+        for module_name in ct.PREWARM_MODULES:
+            try:
+                importlib.import_module(module_name)
+            except Exception as e:
+                logging.getLogger(ct.LOGGER_NAME).warning(f"モジュールの事前読み込みに失敗しました: {module_name}\n{e}")
 
-    docs_all.extend(web_docs_all)
-    return docs_all
+    threading.Thread(target=run, name="prewarm-modules", daemon=True).start()
 
 
-def recursive_file_check(path, docs_all):
+@st.cache_resource(show_spinner=False)
+def get_index_reloader():
     """
-    データソースを再帰的に読み込み
+    プロセス内で共有するインデックスを開き、自動更新処理を作成してdataフォルダの監視を開始
+    ※初回呼び出し時に1度だけ作成され、以降は全セッションが同じオブジェクトを参照する
+    ※st.cache_resourceが作成処理を排他制御するため、同時アクセスでも二重に開かれない
     """
-    if os.path.isdir(path):
-        for file_name in os.listdir(path):
-            full_path = os.path.join(path, file_name)
-            recursive_file_check(full_path, docs_all)
-    else:
-        file_load(path, docs_all)
+    from index_reloader import start_index_reloader
+
+    # Retriever作成（課題①：3→5、課題②：定数化）
+    return start_index_reloader()
 
 
-def file_load(path, docs_all):
+@st.cache_resource(show_spinner=False)
+def get_rag_pipeline():
     """
-    ファイル内のデータ読み込み
+    プロセス内で共有する検索・回答生成の処理（質問ごとに現在の版のインデックスを使う）
     """
-    file_extension = os.path.splitext(path)[1].lower()
+    from rag_pipeline import RagPipeline
 
-    # 想定していたファイル形式の場合のみ読み込む（課題⑤：txtはconstants側で追加）
-    if file_extension in ct.SUPPORTED_EXTENSIONS:
-        loader_factory = ct.SUPPORTED_EXTENSIONS[file_extension]
-        loader = loader_factory(path)
-        docs = loader.load()
-        docs_all.extend(docs)
+    return RagPipeline(get_current_retriever)
 
 
-def adjust_string(s):
+def get_current_retriever():
     """
-    Windows環境でRAGが正常動作するよう調整
+    現在の版のインデックスを検索するRetrieverを取得
+
+    Returns:
+        (版番号, Retriever)
     """
-    if type(s) is not str:
-        return s
+    return get_index_reloader().snapshot()
 
-    if sys.platform.startswith("win"):
-        s = unicodedata.normalize("NFC", s)
-        s = s.encode("cp932", "ignore").decode("cp932")
-        return s
 
-    return s
\ No newline at end of file
+def initialize_session_state():
+    """
+    初期化データの用意
+    """
+    if "messages" not in st.session_state:
+        st.session_state.messages = []
+    # 会話履歴（ChatHistory）は最初のメッセージ送信時にutils側で作成する
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = None
+    if "retriever_ready" not in st.session_state:
+        st.session_state.retriever_ready = False
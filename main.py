@@ -9,7 +9,9 @@ from dotenv import load_dotenv
 import logging
 import streamlit as st
 import utils
-from initialize import initialize
+import metrics
+from admission import AdmissionRejected
+from initialize import initialize, initialize_retriever
 import components as cn
 import constants as ct
 
@@ -23,7 +25,7 @@ logger = logging.getLogger(ct.LOGGER_NAME)
 
 
 ############################################################
-# 3. 初期化処理
+# 3. 初期化処理（セッション・ログ設定のみ。検索インデックスの準備は6で行う）
 ############################################################
 try:
     initialize()
@@ -38,7 +40,7 @@ if not "initialized" in st.session_state:
 
 
 ############################################################
-# 4. 初期表示
+# 4. 初期表示（検索インデックスの準備完了を待たずに表示する）
 ############################################################
 cn.display_app_title()
 cn.display_select_mode()
@@ -57,31 +59,57 @@ except Exception as e:
 
 
 ############################################################
-# 6. チャット入力の受け付け
+# 6. 検索インデックスの準備（初回のみ時間がかかるため、画面の初期表示後に行う）
+############################################################
+if not st.session_state.retriever_ready:
+    try:
+        with st.spinner(ct.INDEX_LOADING_TEXT):
+            initialize_retriever()
+    except Exception as e:
+        logger.error(f"{ct.INITIALIZE_ERROR_MESSAGE}\n{e}")
+        st.error(utils.build_error_message(ct.INITIALIZE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
+        st.stop()
+
+
+############################################################
+# 7. チャット入力の受け付け
 ############################################################
 chat_message = st.chat_input(ct.CHAT_INPUT_HELPER_TEXT)
 
 
 ############################################################
-# 7. チャット送信時の処理
+# 8. チャット送信時の処理
 ############################################################
 if chat_message:
-    # 7-1. ユーザーメッセージ表示
+    # 8-1. ユーザーメッセージ表示
     logger.info({"message": chat_message, "application_mode": st.session_state.mode})
+    # 回答の表示完了までの処理段階別の所要時間を計測
+    trace = metrics.start_trace(st.session_state.session_id, st.session_state.mode)
     with st.chat_message("user"):
         st.markdown(chat_message)
 
-    # 7-2. LLM応答取得
+    # 8-2. LLM応答取得
     res_box = st.empty()
     with st.spinner(ct.SPINNER_TEXT):
         try:
-            llm_response = utils.get_llm_response(chat_message)
+            if st.session_state.mode == ct.ANSWER_MODE_2 and ct.STREAMING_ENABLED:
+                # 検索完了までをスピナー表示し、回答本文は8-3で逐次表示する
+                llm_response = utils.stream_llm_response(chat_message)
+            else:
+                llm_response = utils.get_llm_response(chat_message)
+        except AdmissionRejected as e:
+            # アクセスの集中時は、エラーではなく時間をおいての再送信を促す
+            logger.warning(f"{ct.OVERLOADED_MESSAGE}\n{e.reason}")
+            metrics.finish_trace(trace, status="rejected")
+            st.warning(ct.OVERLOADED_MESSAGE, icon=ct.WARNING_ICON)
+            st.stop()
         except Exception as e:
             logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
+            metrics.finish_trace(trace, status="error")
             st.error(utils.build_error_message(ct.GET_LLM_RESPONSE_ERROR_MESSAGE), icon=ct.ERROR_ICON)
             st.stop()
 
-    # 7-3. LLM応答表示
+    # 8-3. LLM応答表示
     with st.chat_message("assistant"):
         try:
             if st.session_state.mode == ct.ANSWER_MODE_1:
@@ -95,9 +123,11 @@ if chat_message:
 
         except Exception as e:
             logger.error(f"{ct.DISP_ANSWER_ERROR_MESSAGE}\n{e}")
+            metrics.finish_trace(trace, status="error")
             st.error(utils.build_error_message(ct.DISP_ANSWER_ERROR_MESSAGE), icon=ct.ERROR_ICON)
             st.stop()
 
-    # 7-4. 会話ログへ追加
+    # 8-4. 会話ログへ追加
     st.session_state.messages.append({"role": "user", "content": chat_message})
-    st.session_state.messages.append({"role": "assistant", "content": content})
\ No newline at end of file
+    st.session_state.messages.append({"role": "assistant", "content": content})
+    metrics.finish_trace(trace)
\ No newline at end of file
@@ -0,0 +1,450 @@
+"""
+このファイルは、質問1件ごとの処理段階別の所要時間（読み込み・質問文の書き換え・検索・再ランキング・回答生成・画面表示）と、
+トークン数・キャッシュのヒット状況を計測するファイルです。
+計測結果は1件ごとにJSON形式でログ出力し、プロセス内で段階別のパーセンタイル（p50/p95/p99）に集計します。
+集計結果はHTTPエンドポイント（Prometheus形式）で参照するか、ログファイルから集計コマンドで確認できます。
+
+    python metrics.py                       # ログファイルから段階別の所要時間を集計
+    python metrics.py --format prometheus   # Prometheus形式で出力
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import math
+import time
+import uuid
+import logging
+import argparse
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import defaultdict, deque
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import constants as ct
+# ※画面表示の処理（components.py）からも読み込むため、標準ライブラリのみに依存させる
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+# ログ出力時のキー（集計コマンドはこのキーを含む行を読み込む）
+TRACE_LOG_KEY = "request_trace"
+METRIC_PREFIX = "rag"
+
+# 処理段階が重なった時間の割り当て先（先頭ほど優先）
+# ※回答生成（Chain全体）の中で行われる書き換え・検索などの時間は、それぞれの段階に割り当てる
+STAGE_PRIORITY = ["rerank", "retrieve", "rewrite", "cache_lookup", "queue", "load", "generate", "render"]
+
+# 処理中の質問の計測（LangChainのワーカースレッドにもコンテキストごと引き継がれる）
+_current_trace = contextvars.ContextVar("request_trace", default=None)
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+############################################################
+# 関数定義（計測）
+############################################################
+
+def start_trace(session_id=None, mode=None):
+    """
+    質問1件分の計測を開始（以降、同じコンテキストで実行される処理の段階別の所要時間を記録する）
+    """
+    if not ct.METRICS_ENABLED:
+        return None
+    trace = RequestTrace(session_id=session_id, mode=mode)
+    _current_trace.set(trace)
+    return trace
+
+
+def finish_trace(trace, status="ok"):
+    """
+    計測を終了し、JSON形式でログ出力してプロセス内の集計に加える
+    """
+    _current_trace.set(None)
+    if trace is None:
+        return None
+    record = trace.finish(status)
+    logger.info(json.dumps({TRACE_LOG_KEY: record}, ensure_ascii=False, default=str))
+    get_registry().observe_trace(record)
+    return record
+
+
+@contextmanager
+def span(stage):
+    """
+    処理段階の所要時間を計測
+    ※他の段階と重なった時間は、集計時にSTAGE_PRIORITYの優先順で一方の段階にのみ割り当てる
+    ※ジェネレータ内で使う場合、withブロック内でyieldしないこと
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_interval(stage, started, time.perf_counter())
+
+
+def timed(stage):
+    """
+    関数全体の所要時間を処理段階として計測するデコレータ
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def annotate(**fields):
+    """
+    処理中の質問の計測に項目（経路・キャッシュのヒット状況など）を追加
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace.lock:
+            trace.fields.update(fields)
+
+
+def add_tokens(**counts):
+    """
+    処理中の質問の計測にトークン数を加算（例：add_tokens(context=120)）
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        with trace.lock:
+            for kind, value in counts.items():
+                trace.tokens[kind] += value
+
+
+def get_registry():
+    """
+    プロセス共有の集計を取得
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = MetricsRegistry()
+        return _registry
+
+
+def quantile(sorted_values, q):
+    """
+    昇順に並んだ値のパーセンタイル（最近傍順位法）
+    """
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+############################################################
+# 関数定義（エンドポイント・集計コマンド）
+############################################################
+
+def start_metrics_server(host=None, port=None, registry=None):
+    """
+    集計結果を返すHTTPサーバーをバックグラウンドで起動
+    /metrics: Prometheus形式、/metrics.json: JSON形式
+
+    Returns:
+        起動したサーバー（ポートが使用中などで起動できなかった場合はNone）
+    """
+    registry = registry or get_registry()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                body = registry.to_prometheus().encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif self.path == "/metrics.json":
+                body = json.dumps(registry.snapshot(), ensure_ascii=False).encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            else:
+                self.send_response(404)
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    host = host or ct.METRICS_HOST
+    port = ct.METRICS_PORT if port is None else port
+    try:
+        server = ThreadingHTTPServer((host, port), Handler)
+    except OSError as e:
+        logger.warning(f"メトリクスのエンドポイントを起動できませんでした（{host}:{port}）。\n{e}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"メトリクスのエンドポイントを起動しました: http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def load_traces(log_path):
+    """
+    ログファイルから質問ごとの計測結果を読み込む
+    """
+    marker = '{"' + TRACE_LOG_KEY + '"'
+    with open(log_path, encoding="utf8", errors="replace") as f:
+        for line in f:
+            start = line.find(marker)
+            if start < 0:
+                continue
+            try:
+                yield json.loads(line[start:])[TRACE_LOG_KEY]
+            except ValueError:
+                continue
+
+
+def format_table(snapshot):
+    """
+    段階別の所要時間の集計を表形式の文字列にする
+    """
+    labels = [f"p{int(q * 100)}" for q in ct.METRICS_QUANTILES]
+    lines = [f"{'stage':<14}{'count':>8}{'mean_ms':>12}" + "".join(f"{label + '_ms':>12}" for label in labels)]
+    for stage, values in snapshot["stages"].items():
+        mean = values["sum_ms"] / values["count"] if values["count"] else 0.0
+        row = f"{stage:<14}{values['count']:>8}{mean:>12.1f}"
+        row += "".join(f"{values[label]:>12.1f}" for label in labels)
+        lines.append(row)
+    return "\n".join(lines)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class RequestTrace:
+    """
+    質問1件分の計測結果
+    """
+
+    def __init__(self, session_id=None, mode=None):
+        self.request_id = uuid.uuid4().hex[:12]
+        self.session_id = session_id
+        self.mode = mode
+        # [(段階, 開始時刻, 終了時刻)]
+        self.intervals = []
+        self.tokens = defaultdict(int)
+        self.fields = {}
+        self.lock = threading.Lock()
+        self._started = time.perf_counter()
+
+    def add_interval(self, stage, started, finished):
+        with self.lock:
+            self.intervals.append((stage, started, finished))
+
+    def stage_durations(self):
+        """
+        段階別の所要時間（ms）を算出
+        ※同時に複数の段階が計測中の時間は、優先順の最も高い段階にのみ割り当てる
+        ※別スレッドで並行して動いた同じ段階の時間は、重複して数えない
+        """
+        with self.lock:
+            intervals = list(self.intervals)
+
+        def priority(stage):
+            return STAGE_PRIORITY.index(stage) if stage in STAGE_PRIORITY else len(STAGE_PRIORITY)
+
+        # 各時点で計測中の段階を数えながら、区間ごとに最優先の段階へ時間を割り当てる
+        points = sorted(
+            [(started, 1, stage) for stage, started, _ in intervals]
+            + [(finished, -1, stage) for stage, _, finished in intervals]
+        )
+        active = defaultdict(int)
+        durations = defaultdict(float)
+        previous = None
+        for point, delta, stage in points:
+            if previous is not None and point > previous:
+                running = [s for s, n in active.items() if n > 0]
+                if running:
+                    durations[min(running, key=priority)] += (point - previous) * 1000
+            active[stage] += delta
+            previous = point
+        return durations
+
+    def finish(self, status):
+        """
+        ログ出力・集計用の辞書に変換
+        """
+        total_ms = (time.perf_counter() - self._started) * 1000
+        durations = self.stage_durations()
+        with self.lock:
+            return {
+                "request_id": self.request_id,
+                "session_id": self.session_id,
+                "mode": self.mode,
+                "status": status,
+                "total_ms": round(total_ms, 3),
+                "stages": {stage: round(ms, 3) for stage, ms in durations.items()},
+                "tokens": dict(self.tokens),
+                **self.fields,
+            }
+
+
+class MetricsRegistry:
+    """
+    計測結果のプロセス内集計（段階別の所要時間のパーセンタイル・件数・トークン数など）
+    """
+
+    def __init__(self, window_size=None):
+        self.window_size = window_size or ct.METRICS_WINDOW_SIZE
+        self._lock = threading.Lock()
+        # {段階: 直近の所要時間（ms）}
+        self._samples = defaultdict(lambda: deque(maxlen=self.window_size))
+        self._counts = defaultdict(int)
+        self._sums = defaultdict(float)
+        # {(指標名, ((ラベル, 値), ...)): 値}
+        self._counters = defaultdict(float)
+        # {指標名: 値を返す関数}
+        self._gauges = {}
+
+    def observe(self, stage, elapsed_ms):
+        with self._lock:
+            self._samples[stage].append(elapsed_ms)
+            self._counts[stage] += 1
+            self._sums[stage] += elapsed_ms
+
+    def incr(self, name, value=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += value
+
+    def register_gauge(self, name, func):
+        """
+        参照時に値を取得する指標を登録（インデックスの版番号など）
+        """
+        with self._lock:
+            self._gauges[name] = func
+
+    def observe_trace(self, record):
+        """
+        質問1件分の計測結果を集計に加える
+        """
+        for stage, elapsed_ms in record.get("stages", {}).items():
+            self.observe(stage, elapsed_ms)
+        self.observe("total", record.get("total_ms", 0.0))
+
+        self.incr("requests_total", route=record.get("route", "rag"), status=record.get("status", "ok"))
+        for kind, value in record.get("tokens", {}).items():
+            self.incr("tokens_total", value, kind=kind)
+        if record.get("answer_cache"):
+            self.incr("answer_cache_total", result=record["answer_cache"])
+        if record.get("rewrite"):
+            self.incr("query_rewrite_total", outcome=record["rewrite"])
+        if record.get("admission"):
+            self.incr("admission_total", result=record["admission"])
+
+    def snapshot(self):
+        """
+        集計結果を辞書で取得
+        """
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            counts = dict(self._counts)
+            sums = dict(self._sums)
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        # 段階は処理順、その後に合計
+        order = [s for s in ct.METRICS_STAGES if s in samples]
+        order += sorted(s for s in samples if s not in ct.METRICS_STAGES and s != "total")
+        order += ["total"] if "total" in samples else []
+
+        stages = {}
+        for stage in order:
+            values = {"count": counts[stage], "sum_ms": round(sums[stage], 3)}
+            for q in ct.METRICS_QUANTILES:
+                values[f"p{int(q * 100)}"] = round(quantile(samples[stage], q), 3)
+            stages[stage] = values
+
+        gauge_values = {}
+        for name, func in gauges.items():
+            try:
+                gauge_values[name] = func()
+            except Exception:
+                gauge_values[name] = None
+
+        return {
+            "stages": stages,
+            "counters": [
+                {"name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in sorted(counters.items())
+            ],
+            "gauges": gauge_values,
+        }
+
+    def to_prometheus(self):
+        """
+        集計結果をPrometheusのテキスト形式で取得
+        """
+        snapshot = self.snapshot()
+        name = f"{METRIC_PREFIX}_stage_latency_ms"
+        lines = [f"# TYPE {name} summary"]
+        for stage, values in snapshot["stages"].items():
+            for q in ct.METRICS_QUANTILES:
+                lines.append(f'{name}{{stage="{stage}",quantile="{q}"}} {values[f"p{int(q * 100)}"]}')
+            lines.append(f'{name}_sum{{stage="{stage}"}} {values["sum_ms"]}')
+            lines.append(f'{name}_count{{stage="{stage}"}} {values["count"]}')
+
+        declared = set()
+        for counter in snapshot["counters"]:
+            counter_name = f"{METRIC_PREFIX}_{counter['name']}"
+            if counter_name not in declared:
+                lines.append(f"# TYPE {counter_name} counter")
+                declared.add(counter_name)
+            labels = ",".join(f'{k}="{v}"' for k, v in counter["labels"].items())
+            lines.append(f"{counter_name}{{{labels}}} {counter['value']}")
+
+        for gauge, value in snapshot["gauges"].items():
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE {METRIC_PREFIX}_{gauge} gauge")
+                lines.append(f"{METRIC_PREFIX}_{gauge} {value}")
+        return "\n".join(lines) + "\n"
+
+
+############################################################
+# コマンドライン実行
+############################################################
+
+def main(argv=None):
+    """
+    ログファイルの計測結果を集計して出力
+    """
+    parser = argparse.ArgumentParser(description="質問ごとの処理段階別の所要時間を集計")
+    parser.add_argument("--log", default=os.path.join(ct.LOG_DIR_PATH, ct.LOG_FILE), help="集計するログファイル")
+    parser.add_argument("--format", choices=["table", "json", "prometheus"], default="table", help="出力形式")
+    args = parser.parse_args(argv)
+
+    registry = MetricsRegistry(window_size=10 ** 9)
+    for record in load_traces(args.log):
+        registry.observe_trace(record)
+
+    if args.format == "prometheus":
+        print(registry.to_prometheus(), end="")
+    elif args.format == "json":
+        print(json.dumps(registry.snapshot(), ensure_ascii=False, indent=2))
+    else:
+        print(format_table(registry.snapshot()))
+
+
+if __name__ == "__main__":
+    main()
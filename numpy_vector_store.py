@@ -0,0 +1,416 @@
+"""
+このファイルは、埋め込みを1つのNumPy行列で保持するインプロセスのベクターストアのファイルです。
+Chromaの代わりに使え（VECTOR_STORE_BACKEND = "numpy"）、行列積とargpartitionでまとめて上位k件を求めます。
+埋め込みはfloat16・int8へ量子化でき、ディスク上の行列はメモリマップで開けます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+import constants as ct
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+SUPPORTED_DTYPES = ("float32", "float16", "int8")
+# 絞り込み条件ごとの対象行（真偽値の配列）を保持する件数
+FILTER_MASK_CACHE_SIZE = 64
+
+
+############################################################
+# データ定義
+############################################################
+
+@dataclass
+class StoreState:
+    """
+    ベクターストアの中身（更新時は新しいStoreStateへ丸ごと差し替え、検索中の参照は変わらない）
+    """
+    ids: list = field(default_factory=list)
+    texts: list = field(default_factory=list)
+    metadatas: list = field(default_factory=list)
+    # 正規化済みの埋め込み（行数 × 次元数）。int8の場合はscalesを掛けると元のベクトルに戻る
+    vectors: np.ndarray = None
+    scales: np.ndarray = None
+    rows: dict = field(default_factory=dict)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_rows(vectors):
+    """
+    行ごとにL2正規化（内積がコサイン類似度になるようにする）
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def quantize(vectors, dtype):
+    """
+    正規化済みのfloat32行列を保持形式へ変換
+
+    Returns:
+        (変換後の行列, int8の場合は行ごとの倍率・それ以外はNone)
+    """
+    if dtype == "float32":
+        return vectors, None
+    if dtype == "float16":
+        return vectors.astype(np.float16), None
+    # int8：行ごとの最大絶対値が127になるよう倍率を決める（対称量子化）
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.round(vectors / scales[:, None]).astype(np.int8)
+    return quantized, scales.astype(np.float32)
+
+
+def where_matches(metadata, where):
+    """
+    メタデータがChroma形式の絞り込み条件（where句）を満たすかを判定
+    例: {"$and": [{"category": "MTG議事録"}, {"customer_status": {"$in": ["既存"]}}]}
+    """
+    if not where:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(where_matches(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(where_matches(metadata, c) for c in condition):
+                return False
+            continue
+
+        actual = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, value in condition.items():
+            if op == "$eq" and actual != value:
+                return False
+            if op == "$ne" and actual == value:
+                return False
+            if op == "$in" and actual not in value:
+                return False
+            if op == "$nin" and actual in value:
+                return False
+            if op not in ("$eq", "$ne", "$in", "$nin"):
+                raise ValueError(f"未対応の絞り込み条件です: {op}")
+    return True
+
+
+def _store_paths(persist_directory, collection_name):
+    """
+    ディスク上の保存先（行列・int8の倍率・本文とメタデータ）
+    """
+    base = os.path.join(persist_directory, collection_name)
+    return f"{base}.vectors.npy", f"{base}.scales.npy", f"{base}.docs.json"
+
+
+############################################################
+# クラス定義
+############################################################
+
+class NumpyVectorStore(VectorStore):
+    """
+    埋め込みを1つの連続したNumPy行列で保持するベクターストア
+    ※距離はChromaの既定と同じ正規化ベクトル間のL2距離の2乗（= 2 - 2 × コサイン類似度）を返す
+    """
+
+    def __init__(
+        self,
+        collection_name=None,
+        embedding_function=None,
+        persist_directory=None,
+        dtype=None,
+        mmap=None,
+    ):
+        self.collection_name = collection_name or ct.VECTOR_STORE_COLLECTION_NAME
+        self._embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.dtype = dtype or ct.NUMPY_STORE_DTYPE
+        if self.dtype not in SUPPORTED_DTYPES:
+            raise ValueError(f"未対応の保持形式です: {self.dtype}")
+        self.mmap = ct.NUMPY_STORE_MMAP if mmap is None else mmap
+
+        self._lock = threading.Lock()
+        self._masks = OrderedDict()
+        self._state = self._load() if persist_directory else StoreState()
+
+    @property
+    def embeddings(self):
+        return self._embedding_function
+
+    def __len__(self):
+        return len(self._state)
+
+    @property
+    def nbytes(self):
+        """
+        埋め込み行列（int8の倍率を含む）のバイト数
+        """
+        state = self._state
+        if state.vectors is None:
+            return 0
+        return state.vectors.nbytes + (state.scales.nbytes if state.scales is not None else 0)
+
+    def _load(self):
+        """
+        ディスク上の行列・本文を読み込む（存在しない・壊れている場合は空のストア）
+        """
+        vectors_path, scales_path, docs_path = _store_paths(self.persist_directory, self.collection_name)
+        if not os.path.exists(docs_path):
+            return StoreState()
+
+        try:
+            with open(docs_path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data["dtype"] != self.dtype:
+                raise ValueError(f"保持形式が異なります: {data['dtype']} → {self.dtype}")
+            mmap_mode = "r" if self.mmap else None
+            vectors = np.load(vectors_path, mmap_mode=mmap_mode) if data["ids"] else None
+            scales = np.load(scales_path) if data["ids"] and self.dtype == "int8" else None
+            if vectors is not None and len(vectors) != len(data["ids"]):
+                raise ValueError(f"行列の行数が一致しません: {len(vectors)} / {len(data['ids'])}")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"ベクターストアを読み込めませんでした。空のストアとして開きます。\n{e}")
+            return StoreState()
+
+        return StoreState(
+            ids=data["ids"],
+            texts=data["documents"],
+            metadatas=data["metadatas"],
+            vectors=vectors,
+            scales=scales,
+            rows={doc_id: i for i, doc_id in enumerate(data["ids"])},
+        )
+
+    def _save(self, state):
+        """
+        行列・本文をディスクへ書き込む（途中状態のファイルが残らないよう一時ファイル経由で置き換え）
+        ※メモリマップで開いている旧版の行列は置き換え後も読める（POSIX）
+        """
+        if not self.persist_directory:
+            return
+        os.makedirs(self.persist_directory, exist_ok=True)
+        vectors_path, scales_path, docs_path = _store_paths(self.persist_directory, self.collection_name)
+
+        replaced = []
+        if state.vectors is not None:
+            with open(f"{vectors_path}.tmp", "wb") as f:
+                np.save(f, state.vectors)
+            replaced.append(vectors_path)
+        if state.scales is not None:
+            with open(f"{scales_path}.tmp", "wb") as f:
+                np.save(f, state.scales)
+            replaced.append(scales_path)
+        with open(f"{docs_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(
+                {"dtype": self.dtype, "ids": state.ids, "documents": state.texts, "metadatas": state.metadatas},
+                f,
+                ensure_ascii=False,
+            )
+        # 本文を最後に置き換える（読み込み時は本文の件数と行列の行数で整合性を確認する）
+        for path in replaced + [docs_path]:
+            os.replace(f"{path}.tmp", path)
+
+    def _commit(self, state):
+        """
+        新しい中身を保存してから差し替える
+        """
+        self._save(state)
+        self._state = state
+        self._masks.clear()
+
+    def add_texts(self, texts, metadatas=None, *, ids=None, **kwargs):
+        """
+        本文を埋め込んで登録（同じIDのチャンクは置き換える）
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(len(self), len(self) + len(texts))]
+
+        embedded = normalize_rows(self._embedding_function.embed_documents(texts))
+        new_vectors, new_scales = quantize(embedded, self.dtype)
+
+        with self._lock:
+            state = self._without(self._state, set(ids))
+            if state.vectors is None:
+                vectors, scales = new_vectors, new_scales
+            else:
+                vectors = np.concatenate([state.vectors, new_vectors])
+                scales = np.concatenate([state.scales, new_scales]) if new_scales is not None else None
+            all_ids = state.ids + list(ids)
+            self._commit(StoreState(
+                ids=all_ids,
+                texts=state.texts + texts,
+                metadatas=state.metadatas + [dict(m or {}) for m in metadatas],
+                vectors=vectors,
+                scales=scales,
+                rows={doc_id: i for i, doc_id in enumerate(all_ids)},
+            ))
+        return list(ids)
+
+    def delete(self, ids=None, **kwargs):
+        """
+        指定したIDのチャンクを削除
+        """
+        if not ids:
+            return None
+        with self._lock:
+            state = self._without(self._state, set(ids))
+            if state is not self._state:
+                self._commit(state)
+        return True
+
+    @staticmethod
+    def _without(state, ids):
+        """
+        指定したIDの行を除いた中身を作成（該当する行がなければ元の中身をそのまま返す）
+        """
+        drop = [state.rows[i] for i in ids if i in state.rows]
+        if not drop:
+            return state
+
+        keep = np.setdiff1d(np.arange(len(state)), drop)
+        kept_ids = [state.ids[i] for i in keep]
+        return StoreState(
+            ids=kept_ids,
+            texts=[state.texts[i] for i in keep],
+            metadatas=[state.metadatas[i] for i in keep],
+            vectors=np.ascontiguousarray(state.vectors[keep]) if len(keep) else None,
+            scales=state.scales[keep] if state.scales is not None and len(keep) else None,
+            rows={doc_id: i for i, doc_id in enumerate(kept_ids)},
+        )
+
+    def get(self, ids=None, where=None, include=None, limit=None, offset=None):
+        """
+        登録済みのチャンクを取得（Chroma.getと同じ形式の辞書を返す）
+        """
+        state = self._state
+        rows = range(len(state)) if ids is None else [state.rows[i] for i in ids if i in state.rows]
+        if where:
+            rows = [i for i in rows if where_matches(state.metadatas[i], where)]
+        rows = list(rows)[offset or 0:]
+        if limit is not None:
+            rows = rows[:limit]
+
+        include = include or ["documents", "metadatas"]
+        return {
+            "ids": [state.ids[i] for i in rows],
+            "documents": [state.texts[i] for i in rows] if "documents" in include else None,
+            "metadatas": [state.metadatas[i] for i in rows] if "metadatas" in include else None,
+        }
+
+    def _filter_mask(self, state, where):
+        """
+        絞り込み条件を満たす行の真偽値配列（同じ条件はキャッシュから返す）
+        """
+        key = json.dumps(where, sort_keys=True, ensure_ascii=False)
+        with self._lock:
+            if self._state is state and key in self._masks:
+                self._masks.move_to_end(key)
+                return self._masks[key]
+
+        mask = np.fromiter((where_matches(m, where) for m in state.metadatas), dtype=bool, count=len(state))
+        with self._lock:
+            if self._state is state:
+                self._masks[key] = mask
+                if len(self._masks) > FILTER_MASK_CACHE_SIZE:
+                    self._masks.popitem(last=False)
+        return mask
+
+    def _similarities(self, state, queries):
+        """
+        質問ベクトル（件数 × 次元数）と全行のコサイン類似度（件数 × 行数）
+        ※float16・int8はブロックごとにfloat32へ戻して計算し、一時メモリを抑える
+        """
+        if self.dtype == "float32":
+            return queries @ state.vectors.T
+
+        block = ct.NUMPY_STORE_BLOCK_ROWS
+        similarities = np.empty((len(queries), len(state)), dtype=np.float32)
+        for start in range(0, len(state), block):
+            rows = state.vectors[start:start + block].astype(np.float32)
+            similarities[:, start:start + block] = queries @ rows.T
+        if state.scales is not None:
+            similarities *= state.scales
+        return similarities
+
+    def search_by_vectors(self, embeddings, k=4, filter=None):
+        """
+        複数の質問ベクトルをまとめて検索（1回の行列積で全質問の類似度を求める）
+
+        Returns:
+            質問ごとの (Document, 距離) のリスト（距離の小さい順）
+        """
+        state = self._state
+        queries = normalize_rows(embeddings)
+        if not len(state) or k <= 0:
+            return [[] for _ in queries]
+
+        similarities = self._similarities(state, queries)
+        if filter:
+            similarities[:, ~self._filter_mask(state, filter)] = -np.inf
+
+        k = min(k, len(state))
+        # 上位k件のみを部分ソートで取り出してから並べ替える
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        results = []
+        for row_scores, candidates in zip(similarities, top):
+            order = candidates[np.argsort(-row_scores[candidates], kind="stable")]
+            results.append([
+                (
+                    Document(id=state.ids[i], page_content=state.texts[i], metadata=dict(state.metadatas[i])),
+                    max(0.0, float(2.0 - 2.0 * row_scores[i])),
+                )
+                for i in order
+                if np.isfinite(row_scores[i])
+            ])
+        return results
+
+    def similarity_search_by_vector_with_score(self, embedding, k=4, filter=None, **kwargs):
+        return self.search_by_vectors([embedding], k=k, filter=filter)[0]
+
+    def similarity_search_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query, k=4, filter=None, **kwargs):
+        embedding = self._embedding_function.embed_query(query)
+        return self.similarity_search_by_vector_with_score(embedding, k, filter)
+
+    def similarity_search(self, query, k=4, filter=None, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return self._euclidean_relevance_score_fn
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, *, ids=None, **kwargs):
+        store = cls(embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas, ids=ids)
+        return store
@@ -0,0 +1,139 @@
+"""
+このファイルは、会話履歴を踏まえた質問文の独立化（書き換え）を担うファイルです。
+書き換えが不要な質問ではLLM呼び出しを省略し、書き換え結果はキャッシュして再利用します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import json
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.runnables import RunnableLambda
+
+import constants as ct
+import metrics
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def history_digest(chat_history):
+    """
+    会話履歴のダイジェスト（キャッシュキー用のハッシュ値）を作成
+    """
+    payload = json.dumps(
+        [(getattr(m, "type", ""), getattr(m, "content", str(m))) for m in chat_history],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_self_contained(question):
+    """
+    質問文が会話履歴なしで意味が通るかを簡易判定
+    ※指示語・省略表現を含まず、一定以上の長さがあれば単体で検索できるとみなす
+    """
+    text = (question or "").strip()
+    if len(text) < ct.REWRITE_MIN_SELF_CONTAINED_CHARS:
+        return False
+    return not any(marker in text for marker in ct.REWRITE_REFERENCE_MARKERS)
+
+
+############################################################
+# クラス定義
+############################################################
+
+class QueryRewriter:
+    """
+    会話履歴をもとに検索用の質問文を作成するクラス
+    ※「履歴なし」「単体で意味が通る質問」はLLMを呼ばずにそのまま返す
+    ※書き換え結果は（履歴ダイジェスト, 入力）をキーにLRUでキャッシュする
+    """
+
+    def __init__(self, llm, prompt, cache_size=None):
+        self.rewrite_chain = prompt | llm | StrOutputParser()
+        self.cache_size = cache_size or ct.REWRITE_CACHE_SIZE
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {
+            "requests": 0,
+            "skipped_no_history": 0,
+            "skipped_self_contained": 0,
+            "cache_hits": 0,
+            "llm_calls": 0,
+        }
+
+    def rewrite(self, inputs, config=None):
+        """
+        検索に使う質問文を返す
+
+        Args:
+            inputs: {"input": 質問文, "chat_history": 会話履歴}
+        """
+        with metrics.span("rewrite"):
+            return self._rewrite(inputs, config)
+
+    def _rewrite(self, inputs, config=None):
+        question = inputs["input"]
+        chat_history = inputs.get("chat_history") or []
+
+        if not chat_history:
+            return self._finish(question, "skipped_no_history")
+        if is_self_contained(question):
+            return self._finish(question, "skipped_self_contained")
+
+        key = (history_digest(chat_history), question)
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+        if cached is not None:
+            return self._finish(cached, "cache_hits")
+
+        rewritten = self.rewrite_chain.invoke(inputs, config=config)
+        with self._lock:
+            self._cache[key] = rewritten
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return self._finish(rewritten, "llm_calls")
+
+    def _finish(self, query, outcome):
+        """
+        集計を更新し、書き換えの省略率・キャッシュヒット率をログ出力
+        """
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats[outcome] += 1
+            stats = dict(self.stats)
+
+        metrics.annotate(rewrite=outcome)
+        requests = stats["requests"]
+        skipped = stats["skipped_no_history"] + stats["skipped_self_contained"]
+        logger.info({
+            "query_rewrite": {
+                "outcome": outcome,
+                "skip_rate": round(skipped / requests, 3),
+                "cache_hit_rate": round(stats["cache_hits"] / requests, 3),
+                **stats,
+            }
+        })
+        return query
+
+    def as_retriever_chain(self, retriever):
+        """
+        書き換え → 検索を行うRunnableを作成（create_history_aware_retrieverの代替）
+        """
+        return (RunnableLambda(self.rewrite) | retriever).with_config(run_name="chat_retriever_chain")
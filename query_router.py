@@ -0,0 +1,117 @@
+"""
+このファイルは、質問文から検索対象の範囲（フォルダ・顧客・会社など）を推定するクエリルーターのファイルです。
+推定した範囲はメタデータの絞り込み条件として、類似度計算の前に候補チャンクを限定するために使います。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import unicodedata
+
+import constants as ct
+
+
+############################################################
+# 関数定義
+############################################################
+
+def _normalize(text):
+    return unicodedata.normalize("NFKC", text or "").lower()
+
+
+def to_chroma_filter(filter_dict):
+    """
+    絞り込み条件（{キー: 値 or 値のリスト}）をChromaのwhere句へ変換
+    """
+    if not filter_dict:
+        return None
+
+    clauses = []
+    for key, value in filter_dict.items():
+        if isinstance(value, (list, tuple, set)):
+            clauses.append({key: {"$in": list(value)}})
+        else:
+            clauses.append({key: value})
+
+    if len(clauses) == 1:
+        return clauses[0]
+    return {"$and": clauses}
+
+
+def matches_filter(metadata, filter_dict):
+    """
+    メタデータが絞り込み条件を満たすかを判定
+    """
+    for key, value in (filter_dict or {}).items():
+        actual = (metadata or {}).get(key)
+        if isinstance(value, (list, tuple, set)):
+            if actual not in value:
+                return False
+        elif actual != value:
+            return False
+    return True
+
+
+############################################################
+# クラス定義
+############################################################
+
+class QueryRouter:
+    """
+    質問文に含まれる社名・キーワードから検索範囲を推定するクラス
+    """
+
+    def __init__(self, companies=(), topics=()):
+        # 長い名前から照合し、部分一致による誤判定を避ける
+        self.companies = sorted({c for c in companies if c}, key=len, reverse=True)
+        self.topics = sorted({t for t in topics if t}, key=len, reverse=True)
+
+    @classmethod
+    def from_documents(cls, documents):
+        """
+        登録済みチャンクのメタデータから、照合に使う社名・トピック名を収集して作成
+        """
+        companies = set()
+        topics = set()
+        for doc in documents:
+            meta = doc.metadata or {}
+            if meta.get("company"):
+                companies.add(meta["company"])
+            if meta.get("category") == ct.MEETING_CATEGORY_NAME and meta.get("topic"):
+                topics.add(meta["topic"])
+        return cls(companies, topics)
+
+    def route(self, query):
+        """
+        質問文から絞り込み条件を推定
+
+        Returns:
+            絞り込み条件の辞書（推定できない場合はNone）
+        """
+        text = _normalize(query)
+
+        # 社名の指定が最も強い手がかり
+        for company in self.companies:
+            if _normalize(company) in text:
+                return {"company": company}
+
+        for status, keywords in ct.QUERY_ROUTER_CUSTOMER_STATUS_KEYWORDS.items():
+            if any(_normalize(k) in text for k in keywords):
+                return {"customer_status": status}
+
+        # カテゴリは1つに特定できた場合のみ絞り込む
+        categories = [
+            category
+            for category, keywords in ct.QUERY_ROUTER_CATEGORY_KEYWORDS.items()
+            if any(_normalize(k) in text for k in keywords)
+        ]
+        if len(categories) != 1:
+            return None
+
+        scope = {"category": categories[0]}
+        if categories[0] == ct.MEETING_CATEGORY_NAME:
+            for topic in self.topics:
+                if _normalize(topic) in text:
+                    scope["topic"] = topic
+                    break
+        return scope
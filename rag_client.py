@@ -0,0 +1,183 @@
+"""
+このファイルは、画面（Streamlit）から検索・回答APIのサービス（rag_service.py）へ問い合わせるクライアントのファイルです。
+RagPipelineと同じ呼び出し方で使えるため、サービスのURLを設定するだけで画面側の処理を切り替えられます。
+会話履歴は画面のセッションで保持し、問い合わせのたびにプロンプトに渡す分だけを送ります。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import threading
+
+import constants as ct
+import metrics
+from admission import AdmissionRejected
+from rag_pipeline import response_from_dict
+# ※HTTPクライアント（httpx）は使用する関数内で読み込む
+
+
+############################################################
+# 設定関連
+############################################################
+_lock = threading.Lock()
+_client = None
+
+
+############################################################
+# 関数定義
+############################################################
+
+def service_url():
+    """
+    検索・回答APIのサービスのURL（未設定の場合は空文字で、アプリ内で回答する）
+    """
+    return os.environ.get("RAG_SERVICE_URL") or ct.RAG_SERVICE_URL
+
+
+def get_client():
+    """
+    プロセス共有のクライアントを取得（接続をセッション間で再利用する）
+    """
+    global _client
+    with _lock:
+        if _client is None or _client.base_url != service_url().rstrip("/"):
+            _client = RagServiceClient(service_url())
+        return _client
+
+
+############################################################
+# クラス定義
+############################################################
+
+class RagServiceClient:
+    """
+    検索・回答APIのサービスへ問い合わせるクライアント
+    ※回答の完了時に、サービス側で記録された1往復分を画面側の会話履歴に追加する
+    """
+
+    def __init__(self, base_url, timeout=None):
+        import httpx
+
+        self.base_url = base_url.rstrip("/")
+        self._http = httpx.Client(
+            base_url=self.base_url,
+            limits=httpx.Limits(max_connections=ct.RAG_SERVICE_MAX_CONNECTIONS),
+            timeout=timeout or ct.RAG_SERVICE_TIMEOUT_SEC,
+        )
+
+    def _payload(self, mode, chat_message, history, session_id):
+        return {
+            "message": chat_message,
+            "mode": mode,
+            "history": history.to_dicts(),
+            "session_id": session_id,
+        }
+
+    def _finish(self, chat_message, history, data):
+        """
+        サービス側の処理結果を会話履歴・計測に反映
+        """
+        history.append(chat_message, data.get("history_answer") or "")
+        metrics.annotate(
+            route="service",
+            index_version=data.get("index_version"),
+            service_request_id=data.get("request_id"),
+        )
+
+    def _raise_for_status(self, response):
+        """
+        サービスが混雑している場合は、アプリ内で回答する場合と同じ例外を送出
+        """
+        if response.status_code == 503:
+            raise AdmissionRejected("service_unavailable")
+        response.raise_for_status()
+
+    def _post(self, path, payload):
+        response = self._http.post(path, json=payload)
+        self._raise_for_status(response)
+        return response.json()
+
+    def health(self):
+        """
+        サービスの起動状態（インデックスの版番号など）を取得
+        """
+        response = self._http.get("/healthz")
+        response.raise_for_status()
+        return response.json()
+
+    def search(self, chat_message, history, session_id=None):
+        """
+        関連ファイルの一覧を検索（回答文は生成しない）
+        """
+        with metrics.span("retrieve"):
+            data = self._post("/v1/search", self._payload(ct.ANSWER_MODE_1, chat_message, history, session_id))
+        self._finish(chat_message, history, data)
+        return response_from_dict(data)
+
+    def answer(self, mode, chat_message, history, session_id=None):
+        """
+        LLMからの回答取得（RAG + 会話履歴）
+        """
+        # サービス内の検索・回答生成をまとめて回答生成の段階として計測する
+        with metrics.span("generate"):
+            data = self._post("/v1/answer", self._payload(mode, chat_message, history, session_id))
+        self._finish(chat_message, history, data)
+        return response_from_dict(data)
+
+    def stream(self, mode, chat_message, history, session_id=None):
+        """
+        LLMからの回答をトークン単位で逐次取得（RAG + 会話履歴）
+        ※検索結果（context）が届くまでは呼び出し元で待機し、サービス側の検索エラーはここで送出させる
+
+        Returns:
+            {"context": list} / {"answer": str（トークン）} を順に返すイテレータ
+        """
+        request = self._http.build_request(
+            "POST", "/v1/stream", json=self._payload(mode, chat_message, history, session_id)
+        )
+        with metrics.span("retrieve"):
+            response = self._http.send(request, stream=True)
+            try:
+                self._raise_for_status(response)
+                lines = response.iter_lines()
+                buffered = []
+                for line in lines:
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    buffered.append(event)
+                    if "context" in event or "done" in event or "error" in event:
+                        break
+            except Exception:
+                response.close()
+                raise
+
+        return self._iter_events(response, lines, buffered, chat_message, history)
+
+    def _iter_events(self, response, lines, buffered, chat_message, history):
+        """
+        サービスから届いたイベント（1行1件のJSON）を、画面表示用のイベントに変換
+        """
+        def events():
+            yield from buffered
+            for line in lines:
+                if line:
+                    yield json.loads(line)
+
+        try:
+            stream = events()
+            while True:
+                with metrics.span("generate"):
+                    event = next(stream, None)
+                if event is None:
+                    raise RuntimeError("回答の途中でサービスとの接続が切断されました。")
+                if "error" in event:
+                    raise RuntimeError(f"サービスでの回答生成に失敗しました: {event['error']}")
+                if "done" in event:
+                    self._finish(chat_message, history, event)
+                    return
+                yield response_from_dict(event)
+        finally:
+            response.close()
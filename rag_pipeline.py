@@ -0,0 +1,458 @@
+"""
+このファイルは、検索・回答生成の処理（RAG）を画面から切り離して実行するためのファイルです。
+回答モード・会話履歴・使用するインデックスを引数で受け取るため、Streamlitのセッションに依存せず、
+アプリ内（utils.py）からも検索・回答APIのサービス（rag_service.py）からも同じ処理を呼び出せます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import time
+import logging
+from itertools import chain as iter_chain
+
+import constants as ct
+import metrics
+from admission import get_admission, get_single_flight
+# ※Chain・検索・キャッシュ関連のモジュール（LangChain等）は読み込みが重いため、使用する関数内で読み込む
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def normalize_llm_response(resp):
+    """
+    返り値の型ブレを吸収し、必ず
+    {"answer": str, "context": list} を返す
+    """
+    if isinstance(resp, dict):
+        answer = resp.get("answer")
+        if answer is None:
+            # 念のため別キーもフォールバック
+            answer = resp.get("result") or resp.get("output_text") or ""
+        context = resp.get("context") or []
+        return {"answer": answer, "context": context, **resp}
+
+    # AIMessage等
+    if hasattr(resp, "content"):
+        return {"answer": getattr(resp, "content") or "", "context": []}
+
+    # str等
+    return {"answer": str(resp), "context": []}
+
+
+def record_tokens(chat_message, llm_response):
+    """
+    質問文・検索結果・回答のトークン数を計測に加える
+    """
+    from embedding_client import count_tokens
+
+    context_docs = llm_response.get("context") or []
+    metrics.add_tokens(
+        question=count_tokens(chat_message),
+        context=sum(count_tokens(getattr(doc, "page_content", "") or "") for doc in context_docs),
+        answer=count_tokens(llm_response.get("answer") or ""),
+    )
+
+
+def document_to_dict(doc):
+    """
+    DocumentをAPIのレスポンス形式（JSON）に変換
+    """
+    return {"page_content": doc.page_content, "metadata": dict(doc.metadata or {})}
+
+
+def response_to_dict(llm_response):
+    """
+    回答をAPIのレスポンス形式（JSON）に変換
+    ※Chainの入力（質問文・会話履歴）など、画面表示に使わない項目は含めない
+    """
+    data = {
+        "answer": llm_response.get("answer") or "",
+        "context": [document_to_dict(doc) for doc in llm_response.get("context") or []],
+    }
+    if "files" in llm_response:
+        data["files"] = llm_response["files"]
+    return data
+
+
+def event_to_dict(event):
+    """
+    ストリーミングのイベントをAPIのレスポンス形式（JSON）に変換
+    """
+    if "context" in event:
+        return {"context": [document_to_dict(doc) for doc in event["context"] or []]}
+    return dict(event)
+
+
+def response_from_dict(data):
+    """
+    APIのレスポンス（回答・イベント）の検索結果をDocumentに戻す
+    ※画面表示の処理をアプリ内で回答した場合と共通にする
+    """
+    from langchain_core.documents import Document
+
+    if "context" not in data:
+        return data
+    context = [Document(page_content=d["page_content"], metadata=d.get("metadata") or {}) for d in data["context"] or []]
+    return {**data, "context": context}
+
+
+############################################################
+# クラス定義
+############################################################
+
+class RagPipeline:
+    """
+    1件の質問に対する検索・回答生成を行うクラス（プロセス内で1つを共有する）
+    ※会話履歴（ChatHistory）は呼び出し元が保持し、回答の完了時に1往復分を追加する
+    """
+
+    def __init__(self, get_retriever):
+        """
+        Args:
+            get_retriever: 現在の版のインデックスを返す関数（戻り値は (版番号, Retriever)）
+        """
+        self.get_retriever = get_retriever
+
+    def _history_for_prompt(self, history, session_id):
+        """
+        プロンプトに渡す会話履歴（トークン数の上限内）を取得し、トークン数をログ出力
+        ※質問文の書き換え・回答生成の両方のプロンプトで同じ履歴を使う
+        """
+        messages, stats = history.for_prompt()
+        logger.info({"chat_history": stats, "session_id": session_id})
+        metrics.add_tokens(history=stats["history_tokens_sent"])
+        return messages
+
+    def _lookup_answer_cache(self, mode, chat_message, chat_history, retriever):
+        """
+        回答キャッシュから類似質問の回答を検索
+
+        Returns:
+            (ヒットした回答 or None, 登録用の質問ベクトル or None)
+            ※キャッシュ対象外の場合は (None, None)
+        """
+        from query_rewriter import is_self_contained
+        from answer_cache import get_answer_cache
+
+        if not ct.ANSWER_CACHE_ENABLED or mode not in ct.ANSWER_CACHE_MODES:
+            return None, None
+
+        # 会話履歴に依存する質問は、同じ文面でも回答が変わり得るためキャッシュしない
+        if chat_history and not is_self_contained(chat_message):
+            return None, None
+
+        vectorstore = getattr(retriever, "vectorstore", None)
+        embeddings = getattr(vectorstore, "embeddings", None)
+        if embeddings is None:
+            return None, None
+
+        cache = get_answer_cache()
+        with metrics.span("cache_lookup"):
+            cached, vector = cache.lookup(mode, chat_message, embeddings.embed_query)
+        logger.info({"answer_cache": "hit" if cached else "miss", **cache.stats})
+        metrics.annotate(answer_cache="hit" if cached else "miss")
+        return cached, vector
+
+    def _store_answer_cache(self, mode, chat_message, vector, llm_response, index_version):
+        """
+        回答キャッシュへ登録（キャッシュ対象外の質問では何もしない）
+        ※回答の生成中にインデックスが切り替わった場合、古い版に基づく回答となるため登録しない
+        """
+        from answer_cache import get_answer_cache
+
+        if vector is None or self.get_retriever()[0] != index_version:
+            return
+        get_answer_cache().put(mode, chat_message, vector, llm_response)
+
+    def _answer_structured_query(self, mode, chat_message, chat_history, history):
+        """
+        表形式データへの絞り込み・一覧・件数の質問に、テーブルから直接回答する
+
+        Returns:
+            {"answer": str, "context": list}（構造化クエリの対象外の質問はNone）
+        """
+        from query_rewriter import is_self_contained
+        from structured_query import get_structured_engine
+
+        if not ct.STRUCTURED_QUERY_ENABLED or mode not in ct.STRUCTURED_QUERY_MODES:
+            return None
+
+        # 会話履歴に依存する質問は条件を正しく読み取れないため、通常のRAGで回答する
+        if chat_history and not is_self_contained(chat_message):
+            return None
+
+        # テーブルからの絞り込みが検索の代わりとなるため、検索の段階として計測する
+        with metrics.span("retrieve"):
+            llm_response = get_structured_engine().answer(chat_message)
+        if llm_response:
+            metrics.annotate(route="structured")
+            history.append(chat_message, llm_response["answer"])
+        return llm_response
+
+    def _search_documents(self, chat_message, chat_history, history, retriever):
+        """
+        「社内文書検索」モードの検索（LLMによる回答生成を行わず、関連ファイルの一覧を返す）
+        """
+        import chain_factory
+        import doc_search
+
+        metrics.annotate(route="doc_search")
+        if ct.ANSWER_MODE_1 in ct.QUERY_ROUTER_MODES and hasattr(retriever, "with_routing"):
+            retriever = retriever.with_routing()
+
+        # 会話履歴に依存する質問のみ、検索用の質問文に書き換える
+        query = chain_factory.get_rewriter().rewrite({"input": chat_message, "chat_history": chat_history})
+
+        llm_response = doc_search.search_documents(retriever, query)
+
+        # 会話履歴には提示したファイルの一覧を残す
+        sources = [f["source"] for f in llm_response["files"]]
+        history.append(chat_message, "\n".join(sources) or ct.NO_DOC_MATCH_ANSWER)
+
+        return llm_response
+
+    def _prepare(self, history, session_id):
+        """
+        会話履歴と、この質問の処理中に使うインデックスの版を取得
+        ※インデックスの自動更新で切り替わっても、1件の質問の処理中は同じ版を使う
+        """
+        with metrics.span("load"):
+            chat_history = self._history_for_prompt(history, session_id)
+            index_version, retriever = self.get_retriever()
+        metrics.annotate(index_version=index_version)
+        return chat_history, index_version, retriever
+
+    def _join_flight(self, mode, chat_message, chat_history, index_version):
+        """
+        会話履歴のない質問は、処理中の同じ質問に相乗りする
+
+        Returns:
+            (Flight or None, 先頭の問い合わせか)
+        """
+        from answer_cache import normalize_query
+
+        if not ct.REQUEST_COALESCING_ENABLED or chat_history:
+            return None, True
+        flight, leader = get_single_flight().join((mode, normalize_query(chat_message), index_version))
+        if not leader:
+            metrics.annotate(route="coalesced")
+        return flight, leader
+
+    def _generate(self, chain, mode, chat_message, chat_history, index_version, query_vector):
+        """
+        Chainで検索・回答生成を行い、回答キャッシュへ登録
+        ※回答生成の同時実行数の上限に達している場合は順番を待つ
+        """
+        with get_admission().slot():
+            # Chain内の書き換え・検索・再ランキングはそれぞれの段階として計測され、残りが回答生成の時間となる
+            with metrics.span("generate"):
+                raw = chain.invoke({"input": chat_message, "chat_history": chat_history})
+        llm_response = normalize_llm_response(raw)
+        record_tokens(chat_message, llm_response)
+        self._store_answer_cache(mode, chat_message, query_vector, llm_response, index_version)
+        return llm_response
+
+    def search(self, chat_message, history, session_id=None):
+        """
+        関連ファイルの一覧を検索（回答文は生成しない）
+        """
+        chat_history, _, retriever = self._prepare(history, session_id)
+        # 質問文の書き換え・質問の埋め込みでAPIを呼ぶため、回答生成と同じ同時実行数の上限に含める
+        with get_admission().slot():
+            llm_response = self._search_documents(chat_message, chat_history, history, retriever)
+        record_tokens(chat_message, llm_response)
+        return llm_response
+
+    def answer(self, mode, chat_message, history, session_id=None):
+        """
+        LLMからの回答取得（RAG + 会話履歴）
+        """
+        import chain_factory
+
+        # 「社内文書検索」モードは検索結果のファイル一覧のみを表示するため、回答文は生成しない
+        if mode == ct.ANSWER_MODE_1 and ct.DOC_SEARCH_RETRIEVAL_ONLY:
+            return self.search(chat_message, history, session_id)
+
+        chat_history, index_version, retriever = self._prepare(history, session_id)
+
+        # 一覧・件数などの質問は、CSVのテーブルから完全な結果を直接返す
+        structured = self._answer_structured_query(mode, chat_message, chat_history, history)
+        if structured:
+            record_tokens(chat_message, structured)
+            return structured
+
+        # 回答モードごとにプロセス内で1度だけ作成したChainを使い回す
+        with metrics.span("load"):
+            chain = chain_factory.get_chain(mode, retriever)
+
+        # 類似質問の回答がキャッシュにあれば、検索・回答生成を行わずに返す
+        cached, query_vector = self._lookup_answer_cache(mode, chat_message, chat_history, retriever)
+        if cached:
+            metrics.annotate(route="answer_cache")
+            record_tokens(chat_message, cached)
+            history.append(chat_message, cached["answer"])
+            return cached
+
+        metrics.annotate(route="rag")
+
+        # 同じ質問が処理中であれば、その回答の完了を待って共有する
+        flight, leader = self._join_flight(mode, chat_message, chat_history, index_version)
+        if not leader:
+            with metrics.span("generate"):
+                llm_response = flight.wait()
+            history.append(chat_message, llm_response["answer"])
+            return llm_response
+
+        try:
+            llm_response = self._generate(chain, mode, chat_message, chat_history, index_version, query_vector)
+        except Exception as e:
+            if flight is not None:
+                get_single_flight().finish(flight, error=e)
+            raise
+        if flight is not None:
+            get_single_flight().finish(flight, result=llm_response)
+
+        answer_text = llm_response.get("answer", "") or ""
+        history.append(chat_message, answer_text)
+
+        return llm_response
+
+    def stream(self, mode, chat_message, history, session_id=None):
+        """
+        LLMからの回答をトークン単位で逐次取得（RAG + 会話履歴）
+        ※検索が終わるまでは呼び出し元で待機し、検索結果の取得後にイテレータを返す
+
+        Returns:
+            {"context": list} / {"answer": str（トークン）} を順に返すイテレータ
+        """
+        import chain_factory
+
+        chat_history, index_version, retriever = self._prepare(history, session_id)
+
+        # 一覧・件数などの質問は、CSVのテーブルから完全な結果をストリーミングと同じ形式でまとめて返す
+        structured = self._answer_structured_query(mode, chat_message, chat_history, history)
+        if structured:
+            record_tokens(chat_message, structured)
+            return iter([{"context": structured["context"]}, {"answer": structured["answer"]}])
+
+        with metrics.span("load"):
+            chain = chain_factory.get_chain(mode, retriever)
+
+        # 類似質問の回答がキャッシュにあれば、ストリーミングと同じ形式でまとめて返す
+        cached, query_vector = self._lookup_answer_cache(mode, chat_message, chat_history, retriever)
+        if cached:
+            metrics.annotate(route="answer_cache")
+            record_tokens(chat_message, cached)
+            history.append(chat_message, cached["answer"])
+            return iter([{"context": cached["context"]}, {"answer": cached["answer"]}])
+
+        metrics.annotate(route="rag")
+
+        # 同じ質問が処理中であれば、その回答のイベントを先頭から受け取る
+        flight, leader = self._join_flight(mode, chat_message, chat_history, index_version)
+        if leader:
+            events = self._iter_answer_events(
+                chain, mode, chat_message, chat_history, history, index_version, query_vector
+            )
+            if flight is not None:
+                events = self._iter_published(flight, events)
+        else:
+            events = self._iter_following_events(flight, chat_message, history)
+
+        # 検索結果（context）が届くまで先読みし、検索時のエラーはここで送出させる
+        buffered = []
+        for event in events:
+            buffered.append(event)
+            if "context" in event:
+                break
+
+        return iter_chain(buffered, events)
+
+    def _iter_answer_events(self, chain, mode, chat_message, chat_history, history, index_version, query_vector=None):
+        """
+        Chainのストリーミング出力を、画面表示用のイベントに変換
+        ※回答が最後まで生成された時点で会話履歴・回答キャッシュに追加し、初回トークンまでの時間と全体の時間をログ出力する
+        ※Chainの処理時間は回答生成の段階として計測する（表示側で待っていた時間は含めない）
+        """
+        started = time.perf_counter()
+        first_token_sec = None
+        answer_parts = []
+        context_docs = []
+
+        # 回答の生成が終わるまで、回答生成の同時実行数の枠を保持する
+        with get_admission().slot():
+            stream = iter(chain.stream({"input": chat_message, "chat_history": chat_history}))
+            while True:
+                with metrics.span("generate"):
+                    chunk = next(stream, None)
+                if chunk is None:
+                    break
+
+                if "context" in chunk:
+                    context_docs = chunk["context"] or []
+                    yield {"context": context_docs}
+
+                token = chunk.get("answer")
+                if token:
+                    if first_token_sec is None:
+                        first_token_sec = time.perf_counter() - started
+                    answer_parts.append(token)
+                    yield {"answer": token}
+
+        total_sec = time.perf_counter() - started
+        answer_text = "".join(answer_parts)
+        llm_response = {"answer": answer_text, "context": context_docs}
+        record_tokens(chat_message, llm_response)
+        history.append(chat_message, answer_text)
+        self._store_answer_cache(mode, chat_message, query_vector, llm_response, index_version)
+
+        time_to_first_token_sec = round(first_token_sec, 3) if first_token_sec is not None else None
+        metrics.annotate(time_to_first_token_sec=time_to_first_token_sec)
+        logger.info({
+            "stream_latency": {
+                "time_to_first_token_sec": time_to_first_token_sec,
+                "total_sec": round(total_sec, 3),
+            },
+            "application_mode": mode,
+        })
+
+    def _iter_published(self, flight, events):
+        """
+        回答のイベントを、相乗りした問い合わせにも配信
+        ※途中で失敗・中断した場合は、相乗りした問い合わせにも同じ例外を送出させる
+        """
+        try:
+            for event in events:
+                flight.publish(event)
+                yield event
+        except BaseException as e:
+            error = e if isinstance(e, Exception) else RuntimeError("相乗り元の回答生成が中断されました。")
+            get_single_flight().finish(flight, error=error)
+            raise
+        get_single_flight().finish(flight)
+
+    def _iter_following_events(self, flight, chat_message, history):
+        """
+        相乗りした問い合わせとして、処理中の回答のイベントを受け取る
+        ※回答が最後まで届いた時点で会話履歴に追加する
+        """
+        answer_parts = []
+        events = flight.replay()
+        while True:
+            with metrics.span("generate"):
+                event = next(events, None)
+            if event is None:
+                break
+            if "answer" in event:
+                answer_parts.append(event["answer"])
+            yield event
+        history.append(chat_message, "".join(answer_parts))
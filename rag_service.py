@@ -0,0 +1,327 @@
+"""
+このファイルは、検索・回答生成をHTTPのAPIとして提供するサービスのファイルです。
+インデックスとChainはサービスのプロセス内で1度だけ読み込み、会話履歴は問い合わせごとにリクエストで受け取るため、
+画面（Streamlit）は履歴の保持と表示のみを行う軽いクライアントとして動かせます（rag_client.py）。
+検索・回答生成は同期処理のため、スレッドプールで実行してイベントループを塞がないようにしています。
+
+    python rag_service.py
+    python rag_service.py --port 8000 --fake --index-dir /tmp/rag_index    # API呼び出しを行わない構成
+
+    POST /v1/answer   回答（JSON）
+    POST /v1/search   関連ファイルの一覧（JSON）
+    POST /v1/stream   回答をトークン単位で返す（1行1件のJSON）
+    GET  /healthz     インデックスの版番号・自動更新の状態
+    GET  /metrics     処理段階別の所要時間（Prometheus形式）
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import asyncio
+import logging
+import argparse
+import importlib
+import threading
+from typing import Literal, Optional
+from contextlib import asynccontextmanager
+from logging.handlers import TimedRotatingFileHandler
+
+import anyio
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field
+
+import constants as ct
+import metrics
+from chat_history import ChatHistory
+from admission import AdmissionRejected
+from rag_pipeline import RagPipeline, response_to_dict, event_to_dict
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# データ定義
+############################################################
+
+class HistoryMessage(BaseModel):
+    role: Literal["system", "user", "assistant"]
+    content: str
+
+
+class QueryRequest(BaseModel):
+    message: str = Field(min_length=1)
+    mode: Literal[ct.ANSWER_MODE_1, ct.ANSWER_MODE_2] = ct.ANSWER_MODE_2
+    # プロンプトに渡す会話履歴（画面側のChatHistory.to_dictsの形式）
+    history: list[HistoryMessage] = []
+    session_id: Optional[str] = None
+
+
+############################################################
+# クラス定義
+############################################################
+
+class ServiceHistory(ChatHistory):
+    """
+    問い合わせ1件の間だけ使う会話履歴
+    ※回答の完了時に追加された回答（社内文書検索ではファイルの一覧）を、画面側の履歴に残すためレスポンスで返す
+    """
+
+    recorded = None
+
+    def append(self, user_text, assistant_text):
+        super().append(user_text, assistant_text)
+        self.recorded = assistant_text
+
+
+############################################################
+# 関数定義
+############################################################
+
+def initialize_logger():
+    """
+    ログ出力の設定（アプリと同じログ名で、サービス用のファイルへ出力）
+    """
+    if logger.hasHandlers():
+        return
+    try:
+        os.makedirs(ct.LOG_DIR_PATH, exist_ok=True)
+        handler = TimedRotatingFileHandler(
+            os.path.join(ct.LOG_DIR_PATH, ct.RAG_SERVICE_LOG_FILE), when="D", encoding="utf8"
+        )
+    except Exception:
+        handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("[%(levelname)s] %(asctime)s line %(lineno)s, in %(funcName)s: %(message)s"))
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+
+
+def start_index():
+    """
+    （起動時）インデックスを開いて自動更新を開始し、回答生成で使うモジュールを読み込んでおく
+    """
+    from index_reloader import start_index_reloader
+
+    reloader = start_index_reloader()
+    for module_name in ct.PREWARM_MODULES:
+        importlib.import_module(module_name)
+    return reloader
+
+
+@asynccontextmanager
+async def lifespan(app):
+    """
+    インデックス・Chainの準備（プロセス内で1度のみ）と、終了時の監視の停止
+    """
+    initialize_logger()
+    anyio.to_thread.current_default_thread_limiter().total_tokens = ct.RAG_SERVICE_WORKER_THREADS
+    reloader = await run_in_threadpool(start_index)
+    app.state.reloader = reloader
+    app.state.pipeline = RagPipeline(reloader.snapshot)
+    logger.info(f"検索・回答APIのサービスを起動しました（インデックスの版: {reloader.version}）")
+    try:
+        yield
+    finally:
+        await run_in_threadpool(reloader.stop)
+
+
+def service_fields(history, record):
+    """
+    レスポンスに含める、会話履歴に残す回答と計測結果の識別子
+    """
+    record = record or {}
+    return {
+        "history_answer": history.recorded,
+        "request_id": record.get("request_id"),
+        "index_version": record.get("index_version"),
+    }
+
+
+def run_query(query, call):
+    """
+    （ワーカースレッド）問い合わせ1件を計測付きで実行
+
+    Args:
+        query: リクエスト
+        call: 会話履歴を引数に、検索・回答生成を行う関数
+    """
+    history = ServiceHistory.from_dicts([m.model_dump() for m in query.history])
+    trace = metrics.start_trace(query.session_id, query.mode)
+    try:
+        llm_response = call(history)
+    except AdmissionRejected:
+        metrics.finish_trace(trace, status="rejected")
+        raise
+    except Exception:
+        metrics.finish_trace(trace, status="error")
+        raise
+    record = metrics.finish_trace(trace)
+    return {**response_to_dict(llm_response), **service_fields(history, record)}
+
+
+async def run_query_or_error(query, call):
+    """
+    問い合わせをスレッドプールで実行し、失敗した場合はHTTPのエラーを返す
+    """
+    try:
+        return await run_in_threadpool(run_query, query, call)
+    except AdmissionRejected:
+        raise overloaded_error()
+    except Exception as e:
+        logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
+        raise HTTPException(status_code=500, detail=ct.GET_LLM_RESPONSE_ERROR_MESSAGE)
+
+
+def overloaded_error():
+    """
+    混雑のため受け付けられなかった場合のHTTPのエラー（時間をおいての再試行を促す）
+    """
+    return HTTPException(
+        status_code=503,
+        detail=ct.OVERLOADED_MESSAGE,
+        headers={"Retry-After": str(ct.ADMISSION_RETRY_AFTER_SEC)},
+    )
+
+
+def produce_stream(pipeline, query, put, cancelled):
+    """
+    （ワーカースレッド）回答をトークン単位で生成し、イベントをキューへ送る
+    ※検索が終わった時点で ("ready", None) を送り、検索時のエラーはHTTPのエラーとして返せるようにする
+    """
+    history = ServiceHistory.from_dicts([m.model_dump() for m in query.history])
+    trace = metrics.start_trace(query.session_id, query.mode)
+    status = "ok"
+    try:
+        events = pipeline.stream(query.mode, query.message, history, query.session_id)
+        put(("ready", None))
+        for event in events:
+            # 画面側が切断した場合は生成を打ち切る
+            if cancelled.is_set():
+                status = "cancelled"
+                break
+            put(("event", event_to_dict(event)))
+    except AdmissionRejected as e:
+        status = "rejected"
+        put(("error", e))
+    except Exception as e:
+        status = "error"
+        logger.error(f"{ct.GET_LLM_RESPONSE_ERROR_MESSAGE}\n{e}")
+        put(("error", e))
+    finally:
+        record = metrics.finish_trace(trace, status=status)
+        put(("done", service_fields(history, record)))
+
+
+############################################################
+# 関数定義（エンドポイント）
+############################################################
+app = FastAPI(title=ct.APP_NAME, lifespan=lifespan)
+
+
+@app.post("/v1/answer")
+async def answer(query: QueryRequest, request: Request):
+    pipeline = request.app.state.pipeline
+    return await run_query_or_error(
+        query, lambda history: pipeline.answer(query.mode, query.message, history, query.session_id)
+    )
+
+
+@app.post("/v1/search")
+async def search(query: QueryRequest, request: Request):
+    pipeline = request.app.state.pipeline
+    return await run_query_or_error(
+        query, lambda history: pipeline.search(query.message, history, query.session_id)
+    )
+
+
+@app.post("/v1/stream")
+async def stream(query: QueryRequest, request: Request):
+    if query.mode != ct.ANSWER_MODE_2:
+        raise HTTPException(status_code=422, detail=f"ストリーミングは「{ct.ANSWER_MODE_2}」モードのみ対応しています。")
+
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    cancelled = threading.Event()
+
+    def put(item):
+        loop.call_soon_threadsafe(queue.put_nowait, item)
+
+    producer = asyncio.ensure_future(
+        run_in_threadpool(produce_stream, request.app.state.pipeline, query, put, cancelled)
+    )
+
+    # 検索が終わるまで待ち、検索時のエラーはHTTPのエラーとして返す
+    kind, value = await queue.get()
+    if kind == "error":
+        await producer
+        if isinstance(value, AdmissionRejected):
+            raise overloaded_error()
+        raise HTTPException(status_code=500, detail=ct.GET_LLM_RESPONSE_ERROR_MESSAGE)
+
+    async def body():
+        try:
+            while True:
+                kind, value = await queue.get()
+                if kind == "event":
+                    yield json.dumps(value, ensure_ascii=False) + "\n"
+                elif kind == "error":
+                    yield json.dumps({"error": str(value)}, ensure_ascii=False) + "\n"
+                elif kind == "done":
+                    yield json.dumps({"done": True, **value}, ensure_ascii=False) + "\n"
+                    return
+        finally:
+            cancelled.set()
+            await producer
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@app.get("/healthz")
+async def healthz(request: Request):
+    return {"status": "ok", **request.app.state.reloader.status()}
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.get_registry().to_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/metrics.json")
+async def json_metrics():
+    return metrics.get_registry().snapshot()
+
+
+############################################################
+# コマンドライン実行
+############################################################
+
+def main(argv=None):
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="検索・回答APIのサービス")
+    parser.add_argument("--host", default=ct.RAG_SERVICE_HOST, help="待ち受けるアドレス")
+    parser.add_argument("--port", type=int, default=ct.RAG_SERVICE_PORT, help="待ち受けるポート")
+    parser.add_argument("--index-dir", default=ct.INDEX_DIR_PATH, help="インデックスの保存先")
+    parser.add_argument("--versions-dir", default=ct.INDEX_VERSIONS_DIR_PATH, help="更新版のインデックスの保存先")
+    parser.add_argument("--fake", action="store_true", help="API呼び出しを行わない計測用のLLM・埋め込みを使う")
+    args = parser.parse_args(argv)
+
+    ct.INDEX_DIR_PATH = args.index_dir
+    ct.INDEX_VERSIONS_DIR_PATH = args.versions_dir
+    if args.fake:
+        ct.LLM_BACKEND = "fake"
+        ct.EMBEDDING_BACKEND = "fake"
+        ct.WEB_URL_LOAD_TARGETS = []
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
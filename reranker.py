@@ -0,0 +1,202 @@
+"""
+このファイルは、検索結果の再ランキング（リランキング）と、回答生成に渡すチャンク数の適応的な決定を行うファイルです。
+多めに取得した候補をローカルのスコアラー（語彙の一致度、または小型のCross-Encoder）で並べ替え、
+スコアの落ち込みとコンテキストのトークン予算で件数を打ち切ります。
+簡単な質問では少ないチャンクで済むため、プロンプトのトークン数とLLMの応答時間を抑えられます。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import math
+import time
+import logging
+from collections import Counter
+from typing import Any
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import constants as ct
+import metrics
+from hybrid_retriever import tokenize
+from embedding_client import count_tokens
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# 関数定義
+############################################################
+
+def widen_retriever(retriever, fetch_k):
+    """
+    再ランキングの候補を多めに取得できるよう、検索件数を増やしたRetrieverを作成
+    """
+    if hasattr(retriever, "fetch_k") and hasattr(retriever, "k"):
+        # ハイブリッド検索：統合前の各検索方式からも十分な件数を取得する
+        return retriever.model_copy(update={"k": fetch_k, "fetch_k": max(retriever.fetch_k, fetch_k)})
+    search_kwargs = {**getattr(retriever, "search_kwargs", {}), "k": fetch_k}
+    return retriever.model_copy(update={"search_kwargs": search_kwargs})
+
+
+def adaptive_cutoff(scored_docs, min_k=None, max_k=None, relative_threshold=None, gap_ratio=None, token_budget=None):
+    """
+    再ランキング後の候補から、回答生成に渡すチャンクを適応的に選ぶ
+    ※最上位との差が大きい候補・直前から急に落ち込んだ候補以降は打ち切り、トークン予算も超えないようにする
+
+    Args:
+        scored_docs: (Document, スコア) のリスト（スコアの高い順）
+
+    Returns:
+        (選んだDocumentのリスト, 合計トークン数)
+    """
+    min_k = ct.RERANK_MIN_K if min_k is None else min_k
+    max_k = max_k or ct.RERANK_MAX_K
+    relative_threshold = ct.RERANK_RELATIVE_THRESHOLD if relative_threshold is None else relative_threshold
+    gap_ratio = ct.RERANK_SCORE_GAP_RATIO if gap_ratio is None else gap_ratio
+    token_budget = token_budget or ct.RERANK_CONTEXT_TOKEN_BUDGET
+
+    selected = []
+    total_tokens = 0
+    top_score = scored_docs[0][1] if scored_docs else 0.0
+    previous_score = top_score
+
+    for doc, score in scored_docs[:max_k]:
+        if len(selected) >= min_k:
+            if score < top_score * relative_threshold:
+                break
+            if previous_score > 0 and (previous_score - score) / previous_score > gap_ratio:
+                break
+        tokens = count_tokens(doc.page_content)
+        # トークン予算は最低1件を超えても守る（1件目だけは必ず渡す）
+        if selected and total_tokens + tokens > token_budget:
+            break
+        selected.append(doc)
+        total_tokens += tokens
+        previous_score = score
+
+    return selected, total_tokens
+
+
+def create_scorer(name=None):
+    """
+    再ランキングのスコアラーを作成
+    ※Cross-Encoderが使えない環境（sentence-transformers未導入など）では語彙一致のスコアラーで代用する
+    """
+    name = name or ct.RERANK_SCORER
+    if name == "cross_encoder":
+        try:
+            return CrossEncoderScorer(ct.RERANK_CROSS_ENCODER_MODEL)
+        except Exception as e:
+            logger.warning(f"Cross-Encoderを読み込めないため、語彙一致で再ランキングします: {e}")
+    return LexicalScorer()
+
+
+############################################################
+# クラス定義
+############################################################
+
+class LexicalScorer:
+    """
+    質問文と候補の語彙の一致度で採点するスコアラー（モデル不要・CPUで高速）
+    ※候補集合内でのIDFで重み付けした質問語の被覆率に、検索時の順位を加味する
+    """
+
+    def __init__(self, rank_weight=None):
+        self.rank_weight = ct.RERANK_RANK_WEIGHT if rank_weight is None else rank_weight
+
+    def score(self, query, docs):
+        query_tokens = set(tokenize(query))
+        doc_tokens = [set(tokenize(doc.page_content)) for doc in docs]
+        if not docs:
+            return []
+
+        n = len(docs)
+        df = Counter(t for tokens in doc_tokens for t in tokens & query_tokens)
+        idf = {t: math.log(1 + (n + 1) / (df.get(t, 0) + 0.5)) for t in query_tokens}
+        total_idf = sum(idf.values()) or 1.0
+
+        scores = []
+        for rank, tokens in enumerate(doc_tokens):
+            coverage = sum(idf[t] for t in tokens & query_tokens) / total_idf
+            prior = 1.0 - rank / n
+            scores.append((1 - self.rank_weight) * coverage + self.rank_weight * prior)
+        return scores
+
+
+class CrossEncoderScorer:
+    """
+    小型のCross-Encoder（CPU推論）で質問文と候補の関連度を採点するスコアラー
+    """
+
+    def __init__(self, model_name):
+        from sentence_transformers import CrossEncoder
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query, docs):
+        if not docs:
+            return []
+        logits = self.model.predict([(query, doc.page_content) for doc in docs])
+        return [1.0 / (1.0 + math.exp(-float(x))) for x in logits]
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    多めに取得した候補を再ランキングし、適応的な件数に絞り込むRetriever
+    ※vectorstore属性は元のRetrieverのものを引き継ぐ
+    """
+
+    base: Any
+    scorer: Any
+    vectorstore: Any = None
+
+    @classmethod
+    def wrap(cls, retriever, scorer=None, fetch_k=None):
+        """
+        既存のRetrieverを再ランキング付きのRetrieverで包む
+        """
+        return cls(
+            base=widen_retriever(retriever, fetch_k or ct.RERANK_FETCH_K),
+            scorer=scorer or create_scorer(),
+            vectorstore=getattr(retriever, "vectorstore", None),
+        )
+
+    def rerank(self, query, docs):
+        """
+        候補を再ランキングし、回答生成に渡すチャンクを選ぶ
+
+        Returns:
+            (選んだDocumentのリスト, 計測値)
+        """
+        started = time.perf_counter()
+        scores = self.scorer.score(query, docs)
+        ranked = sorted(zip(docs, scores), key=lambda x: x[1], reverse=True)
+        selected, tokens = adaptive_cutoff(ranked)
+        rerank_metrics = {
+            "candidates": len(docs),
+            "selected": len(selected),
+            "context_tokens": tokens,
+            "rerank_ms": round((time.perf_counter() - started) * 1000, 3),
+            "scorer": type(self.scorer).__name__,
+        }
+        return selected, rerank_metrics
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> list[Document]:
+        started = time.perf_counter()
+        with metrics.span("retrieve"):
+            candidates = self.base.invoke(query)
+        retrieve_ms = (time.perf_counter() - started) * 1000
+
+        with metrics.span("rerank"):
+            selected, rerank_metrics = self.rerank(query, candidates)
+        metrics.annotate(rerank_candidates=rerank_metrics["candidates"], rerank_selected=rerank_metrics["selected"])
+        logger.info({"rerank": {**rerank_metrics, "retrieve_ms": round(retrieve_ms, 3)}})
+        return selected
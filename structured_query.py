@@ -0,0 +1,423 @@
+"""
+このファイルは、表形式のデータ（社員名簿.csvなど）に対する集計・一覧の質問に答える構造化クエリエンジンのファイルです。
+CSVをメモリ上の列指向テーブルに読み込み、絞り込みに使う列には索引を作成します。
+「人事部の従業員を一覧化して」「営業部は何人？」のような質問は、ベクトル検索を使わずに
+テーブルから完全な結果を直接求めます（該当しない質問はNoneを返し、通常のRAGで回答します）。
+テーブルを対象とするのは、テーブル名・列名・対象を表す語（「社員」など）でテーブルが対象と明示され、
+かつ、絞り込み・数値条件・質問の種類で説明できない語が残らない質問のみです。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import re
+import csv
+import time
+import logging
+import threading
+import unicodedata
+from collections import defaultdict
+
+from langchain_core.documents import Document
+
+import constants as ct
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+_engine = None
+_engine_lock = threading.Lock()
+
+# 数値条件（例: 「40歳以上」「30代」）
+NUMBER_CONDITION_PATTERN = re.compile(
+    r"(\d+)\s*(?P<unit>" + "|".join(map(re.escape, ct.STRUCTURED_QUERY_NUMBER_UNITS)) + r")?"
+    r"(?P<op>以上|以下|未満|超|より上|より下|代)"
+)
+# 質問の内容を表す文字（漢字・カタカナ・英数字）※ひらがな・記号は助詞などとして扱う
+CONTENT_CHAR_PATTERN = re.compile(r"[一-龥々〆ヵヶァ-ヴーa-z0-9]")
+
+
+############################################################
+# 関数定義
+############################################################
+
+def _normalize(text):
+    return unicodedata.normalize("NFKC", str(text or "")).lower()
+
+
+def _to_number(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+
+def _escape_cell(value):
+    return str(value).replace("|", "\\|").replace("\n", " ")
+
+
+def get_structured_engine():
+    """
+    プロセス共有の構造化クエリエンジンを取得
+    ※参照先のCSVが更新されていれば読み込み直す
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None or _engine.is_stale():
+            _engine = StructuredQueryEngine.from_folder(ct.RAG_TOP_FOLDER_PATH)
+        return _engine
+
+
+############################################################
+# クラス定義
+############################################################
+
+class ColumnarTable:
+    """
+    CSV1件分の列指向テーブル
+    ※値の種類が少ない列（部署・役職など）と、複数の値を区切り文字で持つ列（スキルセットなど）に索引を作成する
+    """
+
+    def __init__(self, source, columns, rows):
+        self.source = source
+        self.name = os.path.splitext(os.path.basename(source))[0]
+        self.columns = list(columns)
+        self.row_count = len(rows)
+        # {列名: 値のリスト}
+        self.data = {c: [row.get(c, "") for row in rows] for c in self.columns}
+
+        # 全行が数値の列
+        self.numeric_columns = {
+            c for c in self.columns
+            if self.row_count and all(_to_number(v) is not None for v in self.data[c])
+        }
+        # 区切り文字で複数の値を持つ列
+        self.multi_value_columns = {
+            c for c in self.columns
+            if c not in self.numeric_columns
+            and sum(ct.STRUCTURED_QUERY_MULTI_VALUE_SEPARATOR in v for v in self.data[c])
+            >= self.row_count * ct.STRUCTURED_QUERY_MULTI_VALUE_MIN_RATIO
+        }
+
+        # {列名: {値: 行番号の集合}}
+        self.indexes = {}
+        for column in self.columns:
+            if column in self.numeric_columns:
+                continue
+            index = defaultdict(set)
+            for i, value in enumerate(self.data[column]):
+                for v in self._split_values(column, value):
+                    index[v].add(i)
+            # 値がほぼ行ごとに異なる列（氏名・メールアドレスなど）は絞り込みに使わない
+            if column in self.multi_value_columns or len(index) <= self.row_count * ct.STRUCTURED_QUERY_INDEX_MAX_DISTINCT_RATIO:
+                self.indexes[column] = dict(index)
+
+        # 質問文との照合用に、索引の値を長い順に並べておく（「マネージャー」より「シニアマネージャー」を優先）
+        self.value_lookup = sorted(
+            ((_normalize(v), column, v) for column, index in self.indexes.items() for v in index if v),
+            key=lambda x: len(x[0]),
+            reverse=True,
+        )
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            rows = [{k: (v or "").strip() for k, v in row.items() if k} for row in reader]
+            columns = [c for c in (reader.fieldnames or []) if c]
+        return cls(path, columns, rows)
+
+    def _split_values(self, column, value):
+        if column in self.multi_value_columns:
+            return [v.strip() for v in value.split(ct.STRUCTURED_QUERY_MULTI_VALUE_SEPARATOR) if v.strip()]
+        return [value]
+
+    def row(self, i):
+        return {c: self.data[c][i] for c in self.columns}
+
+    def mentioned_columns(self, text):
+        """
+        質問文に含まれる列名を取得（長い列名を優先）
+        """
+        return [c for c in sorted(self.columns, key=len, reverse=True) if _normalize(c) in text]
+
+    def match_filters(self, text):
+        """
+        質問文に含まれる索引の値から絞り込み条件を作成
+        ※同じ列の複数の値はOR、異なる列の値はANDとして扱う
+
+        Returns:
+            {列名: 値のリスト}
+        """
+        filters = defaultdict(list)
+        for normalized, column, value in self.value_lookup:
+            if normalized in text:
+                filters[column].append(value)
+                # 照合済みの部分は、短い値の部分一致（「人事部長」の「部長」など）に使わない
+                text = text.replace(normalized, " ")
+        return dict(filters)
+
+    def number_conditions(self, text):
+        """
+        質問文の数値条件（「40歳以上」「30代」など）を (列名, 下限, 上限) のリストに変換
+        """
+        conditions = []
+        for match in NUMBER_CONDITION_PATTERN.finditer(text):
+            # 単位のない「30代」は、「代」に対応付けた列を対象にする
+            column = ct.STRUCTURED_QUERY_NUMBER_UNITS.get(match.group("unit") or match.group("op"))
+            if column not in self.numeric_columns:
+                continue
+            number = int(match.group(1))
+            op = match.group("op")
+            if op == "代":
+                conditions.append((column, number, number + 9))
+            elif op == "以上":
+                conditions.append((column, number, None))
+            elif op in ("超", "より上"):
+                conditions.append((column, number + 1, None))
+            elif op == "以下":
+                conditions.append((column, None, number))
+            else:
+                conditions.append((column, None, number - 1))
+        return conditions
+
+    def select(self, filters, conditions=()):
+        """
+        絞り込み条件に一致する行番号のリストを取得（索引の集合演算で求める）
+        """
+        selected = set(range(self.row_count))
+        for column, values in filters.items():
+            matched = set()
+            for value in values:
+                matched |= self.indexes[column].get(value, set())
+            selected &= matched
+        for column, low, high in conditions:
+            selected = {
+                i for i in selected
+                if (low is None or _to_number(self.data[column][i]) >= low)
+                and (high is None or _to_number(self.data[column][i]) <= high)
+            }
+        return sorted(selected)
+
+    def to_markdown(self, row_ids, columns=None):
+        """
+        行をMarkdownの表に変換
+        """
+        columns = columns or self.columns
+        lines = [
+            "| " + " | ".join(columns) + " |",
+            "| " + " | ".join("---" for _ in columns) + " |",
+        ]
+        for i in row_ids:
+            lines.append("| " + " | ".join(_escape_cell(self.data[c][i]) for c in columns) + " |")
+        return "\n".join(lines)
+
+
+class StructuredQueryEngine:
+    """
+    表形式のデータに対する絞り込み・一覧・件数・集計の質問に答えるエンジン
+    """
+
+    def __init__(self, tables, mtimes=None):
+        self.tables = tables
+        # {ファイルパス: 読み込み時の更新日時}（更新検知用）
+        self.mtimes = mtimes or {}
+
+    @classmethod
+    def from_folder(cls, path):
+        """
+        フォルダ配下の表形式ファイル（CSV）をすべて読み込んで作成
+        """
+        tables = []
+        mtimes = {}
+        for root, _, files in os.walk(path):
+            for file_name in sorted(files):
+                if os.path.splitext(file_name)[1].lower() not in ct.STRUCTURED_QUERY_EXTENSIONS:
+                    continue
+                file_path = os.path.join(root, file_name)
+                try:
+                    tables.append(ColumnarTable.from_csv(file_path))
+                    mtimes[file_path] = os.stat(file_path).st_mtime
+                except Exception as e:
+                    logger.warning(f"表形式データの読み込みに失敗したためスキップします: {file_path}\n{e}")
+        logger.info(f"構造化クエリ用のテーブルを読み込みました: {[(t.name, t.row_count) for t in tables]}")
+        return cls(tables, mtimes)
+
+    def is_stale(self):
+        """
+        読み込み後に参照先のCSVが変更・削除されたかを判定
+        """
+        for path, mtime in self.mtimes.items():
+            try:
+                if os.stat(path).st_mtime != mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def _detect_intent(self, text, table):
+        """
+        質問の種類を判定
+
+        Returns:
+            "group_count" / "average" / "count" / "list"（該当しない場合はNone）
+        """
+        if any(k in text for k in ct.STRUCTURED_QUERY_GROUP_KEYWORDS) and self._group_column(text, table):
+            return "group_count"
+        if any(k in text for k in ct.STRUCTURED_QUERY_AVERAGE_KEYWORDS) and self._numeric_column(text, table):
+            return "average"
+        if any(k in text for k in ct.STRUCTURED_QUERY_COUNT_KEYWORDS):
+            return "count"
+        if any(k in text for k in ct.STRUCTURED_QUERY_LIST_KEYWORDS):
+            return "list"
+        return None
+
+    def _group_column(self, text, table):
+        for column in table.mentioned_columns(text):
+            if column in table.indexes:
+                return column
+        return None
+
+    def _numeric_column(self, text, table):
+        for column in table.mentioned_columns(text):
+            if column in table.numeric_columns:
+                return column
+        return None
+
+    def _is_about(self, text, table):
+        """
+        質問がこのテーブルを対象としているかを判定
+        ※テーブル名・列名・対象を表す語（「社員」など）・人数を尋ねる語のいずれかを含む場合のみ
+        ※索引の値（部署名など）と一覧・件数の語だけでは判定しない（「営業部の売上目標」などをテーブルに回さない）
+        """
+        if _normalize(table.name) in text or table.mentioned_columns(text):
+            return True
+        keywords = ct.STRUCTURED_QUERY_SUBJECT_KEYWORDS + ct.STRUCTURED_QUERY_HEADCOUNT_KEYWORDS
+        return any(_normalize(k) in text for k in keywords)
+
+    def _unexplained_words(self, text, table, filters):
+        """
+        絞り込み・数値条件・列名・質問の種類などで説明できない語（質問の内容）が残っているかを判定
+        ※「人事部の採用計画」「人事部長」のように、テーブルにない内容を尋ねる質問を通常のRAGに回す
+        """
+        text = NUMBER_CONDITION_PATTERN.sub(" ", text)
+        terms = [v for values in filters.values() for v in values]
+        terms += table.mentioned_columns(text) + [table.name]
+        terms += (
+            ct.STRUCTURED_QUERY_SUBJECT_KEYWORDS
+            + ct.STRUCTURED_QUERY_LIST_KEYWORDS
+            + ct.STRUCTURED_QUERY_COUNT_KEYWORDS
+            + ct.STRUCTURED_QUERY_AVERAGE_KEYWORDS
+            + ct.STRUCTURED_QUERY_GROUP_KEYWORDS
+            + ct.STRUCTURED_QUERY_GENERIC_WORDS
+        )
+        # 長い語から取り除く（「一覧化」を「一覧」より先に取り除く）
+        for term in sorted({_normalize(t) for t in terms if t}, key=len, reverse=True):
+            text = text.replace(term, " ")
+        return bool(CONTENT_CHAR_PATTERN.search(text))
+
+    def _drop_subject_filters(self, text, table, filters):
+        """
+        対象を表す語と同じ索引の値（役職の「スタッフ」など）による絞り込みを除く
+        ※「スタッフ向けの研修制度」のように対象を表す語として使われることが多いため、列名が含まれる場合のみ残す
+        """
+        subjects = {_normalize(k) for k in ct.STRUCTURED_QUERY_SUBJECT_KEYWORDS}
+        mentioned = set(table.mentioned_columns(text))
+        result = {}
+        for column, values in filters.items():
+            if column not in mentioned:
+                values = [v for v in values if _normalize(v) not in subjects]
+            if values:
+                result[column] = values
+        return result
+
+    def answer(self, query):
+        """
+        質問にテーブルから回答
+
+        Returns:
+            {"answer": str, "context": list[Document]}（このエンジンで回答できない質問はNone）
+        """
+        started = time.perf_counter()
+        text = _normalize(query)
+
+        for table in self.tables:
+            if not self._is_about(text, table):
+                continue
+            filters = self._drop_subject_filters(text, table, table.match_filters(text))
+            conditions = table.number_conditions(text)
+            if self._unexplained_words(text, table, filters):
+                continue
+            intent = self._detect_intent(text, table)
+            if intent is None:
+                continue
+
+            row_ids = table.select(filters, conditions)
+            answer = self._render(intent, text, table, filters, conditions, row_ids)
+            logger.info({
+                "structured_query": {
+                    "table": table.name,
+                    "intent": intent,
+                    "filters": filters,
+                    "conditions": conditions,
+                    "rows": len(row_ids),
+                    "elapsed_ms": round((time.perf_counter() - started) * 1000, 3),
+                }
+            })
+            context = [Document(
+                page_content=answer,
+                metadata={"source": table.source, "structured_query": intent},
+            )]
+            return {"answer": answer, "context": context}
+        return None
+
+    def _describe(self, filters, conditions):
+        parts = [f"{column}: {' / '.join(values)}" for column, values in filters.items()]
+        for column, low, high in conditions:
+            if low is not None and high is not None:
+                parts.append(f"{column}: {low}〜{high}")
+            elif low is not None:
+                parts.append(f"{column}: {low}以上")
+            else:
+                parts.append(f"{column}: {high}以下")
+        return "、".join(parts) or "条件なし（全件）"
+
+    def _render(self, intent, text, table, filters, conditions, row_ids):
+        """
+        質問の種類に応じた回答文を作成
+        """
+        condition_text = self._describe(filters, conditions)
+        header = f"{table.name}（{condition_text}）"
+
+        if intent == "count":
+            return f"{header}に該当するのは **{len(row_ids)}件** です。"
+
+        if intent == "average":
+            column = self._numeric_column(text, table)
+            values = [_to_number(table.data[column][i]) for i in row_ids]
+            if not values:
+                return f"{header}に該当するデータはありません。"
+            average = sum(values) / len(values)
+            return f"{header}の{column}の平均は **{average:.1f}** です（{len(values)}件）。"
+
+        if intent == "group_count":
+            column = self._group_column(text, table)
+            counts = defaultdict(int)
+            for i in row_ids:
+                for value in table._split_values(column, table.data[column][i]):
+                    counts[value] += 1
+            lines = [f"{header}の{column}別の件数です。", "", f"| {column} | 件数 |", "| --- | --- |"]
+            for value, count in sorted(counts.items(), key=lambda x: (-x[1], x[0])):
+                lines.append(f"| {_escape_cell(value)} | {count} |")
+            return "\n".join(lines)
+
+        if not row_ids:
+            return f"{header}に該当するデータはありません。"
+        return f"{header}に該当する{len(row_ids)}件の一覧です。\n\n{table.to_markdown(row_ids)}"
@@ -6,16 +6,15 @@
 # ライブラリの読み込み
 ############################################################
 import os
+import logging
 from dotenv import load_dotenv
 import streamlit as st
 
-from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
-from langchain.schema import HumanMessage, AIMessage  # ✅ Cloud互換で統一
-from langchain_openai import ChatOpenAI
-from langchain.chains import create_history_aware_retriever, create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-
 import constants as ct
+import metrics
+import rag_client
+# ※Chain・検索・キャッシュ関連のモジュール（LangChain等）は読み込みが重いため、
+#   画面の初期表示を妨げないよう使用する関数内で読み込む（initialize.prewarm_modulesで事前読み込み）
 
 
 ############################################################
@@ -23,6 +22,8 @@ import constants as ct
 ############################################################
 load_dotenv()
 
+logger = logging.getLogger(ct.LOGGER_NAME)
+
 
 ############################################################
 # 関数定義
@@ -51,6 +52,10 @@ def _ensure_openai_key():
     if os.environ.get("OPENAI_API_KEY"):
         return
 
+    # LLM・埋め込みの両方がAPIを呼ばない計測用の構成であれば不要
+    if ct.LLM_BACKEND == "fake" and ct.EMBEDDING_BACKEND == "fake":
+        return
+
     try:
         if "OPENAI_API_KEY" in st.secrets:
             os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
@@ -65,89 +70,54 @@ def _ensure_openai_key():
 
 def _ensure_chat_history():
     """
-    chat_history が無ければ初期化する
+    chat_history が無ければ初期化する（旧形式のメッセージリストはChatHistoryへ変換）
     """
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
-    if st.session_state.chat_history is None:
-        st.session_state.chat_history = []
+    from chat_history import ChatHistory
 
+    chat_history = st.session_state.get("chat_history")
+    if not isinstance(chat_history, ChatHistory):
+        st.session_state.chat_history = ChatHistory.from_messages(chat_history)
 
-def _append_history(user_text: str, assistant_text: str):
-    """
-    chat_history に BaseMessage を追加（HumanMessage / AIMessage）
-    """
-    _ensure_chat_history()
-    st.session_state.chat_history.append(HumanMessage(content=user_text))
-    st.session_state.chat_history.append(AIMessage(content=assistant_text))
 
-
-def _normalize_llm_response(resp):
+def _get_pipeline():
     """
-    返り値の型ブレを吸収し、必ず
-    {"answer": str, "context": list} を返す
+    検索・回答生成の処理を取得
+    ※サービスのURLが設定されていればサービスへ問い合わせるクライアント、なければプロセス内で共有する処理
     """
-    if isinstance(resp, dict):
-        answer = resp.get("answer")
-        if answer is None:
-            # 念のため別キーもフォールバック
-            answer = resp.get("result") or resp.get("output_text") or ""
-        context = resp.get("context") or []
-        return {"answer": answer, "context": context, **resp}
+    if rag_client.service_url():
+        return rag_client.get_client()
 
-    # AIMessage等
-    if hasattr(resp, "content"):
-        return {"answer": getattr(resp, "content") or "", "context": []}
+    from initialize import get_rag_pipeline
 
-    # str等
-    return {"answer": str(resp), "context": []}
+    _ensure_openai_key()
+    return get_rag_pipeline()
 
 
 def get_llm_response(chat_message: str):
     """
     LLMからの回答取得（RAG + 会話履歴）
     """
-    _ensure_openai_key()
-    _ensure_chat_history()
-
-    llm = ChatOpenAI(model=ct.MODEL, temperature=ct.TEMPERATURE)
-
-    # 会話履歴があっても「単体で意味が通る質問文」に変換するプロンプト
-    question_generator_template = ct.SYSTEM_PROMPT_CREATE_INDEPENDENT_TEXT
-    question_generator_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", question_generator_template),
-            MessagesPlaceholder("chat_history"),
-            ("human", "{input}"),
-        ]
-    )
-
-    # モードでプロンプト切替
-    if st.session_state.mode == ct.ANSWER_MODE_1:
-        question_answer_template = ct.SYSTEM_PROMPT_DOC_SEARCH
-    else:
-        question_answer_template = ct.SYSTEM_PROMPT_INQUIRY
-
-    question_answer_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", question_answer_template),
-            MessagesPlaceholder("chat_history"),
-            ("human", "{input}"),
-        ]
-    )
+    with metrics.span("load"):
+        _ensure_chat_history()
+        pipeline = _get_pipeline()
 
-    history_aware_retriever = create_history_aware_retriever(
-        llm, st.session_state.retriever, question_generator_prompt
+    return pipeline.answer(
+        st.session_state.mode, chat_message, st.session_state.chat_history, st.session_state.get("session_id")
     )
 
-    question_answer_chain = create_stuff_documents_chain(llm, question_answer_prompt)
 
-    chain = create_retrieval_chain(history_aware_retriever, question_answer_chain)
-
-    raw = chain.invoke({"input": chat_message, "chat_history": st.session_state.chat_history})
-    llm_response = _normalize_llm_response(raw)
+def stream_llm_response(chat_message: str):
+    """
+    LLMからの回答をトークン単位で逐次取得（RAG + 会話履歴）
+    ※検索が終わるまでは呼び出し元で待機し（スピナー表示中）、検索結果の取得後にイテレータを返す
 
-    answer_text = llm_response.get("answer", "") or ""
-    _append_history(chat_message, answer_text)
+    Returns:
+        {"context": list} / {"answer": str（トークン）} を順に返すイテレータ
+    """
+    with metrics.span("load"):
+        _ensure_chat_history()
+        pipeline = _get_pipeline()
 
-    return llm_response
\ No newline at end of file
+    return pipeline.stream(
+        st.session_state.mode, chat_message, st.session_state.chat_history, st.session_state.get("session_id")
+    )
@@ -0,0 +1,222 @@
+"""
+このファイルは、RAGの参照先Webページを取得するWeb読み込み処理のファイルです。
+複数のURLを非同期・並列に取得し（ホストごとの同時接続数とタイムアウトを制限）、
+ETag・Last-Modifiedによる条件付きリクエストで、更新のないページは再取得・再埋め込みしません。
+取得に失敗したURLは、前回取得時のキャッシュで代用します。
+"""
+
+############################################################
+# ライブラリの読み込み
+############################################################
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import httpx
+from bs4 import BeautifulSoup
+from langchain_core.documents import Document
+
+import constants as ct
+from embedding_client import run_sync
+
+
+############################################################
+# 設定関連
+############################################################
+logger = logging.getLogger(ct.LOGGER_NAME)
+
+
+############################################################
+# データ定義
+############################################################
+
+@dataclass
+class WebLoadResult:
+    """
+    URL1件分の取得結果
+
+    status:
+        "fetched": 新しい内容を取得した
+        "not_modified": サーバーが更新なし（304）と応答した（キャッシュの内容を使う）
+        "stale": 取得に失敗したため、前回のキャッシュで代用した
+        "failed": 取得に失敗し、キャッシュもない
+    """
+    url: str
+    status: str
+    docs: list = field(default_factory=list)
+    content_hash: str = ""
+    elapsed_sec: float = 0.0
+    error: str = ""
+
+
+############################################################
+# 関数定義
+############################################################
+
+def build_documents(url, html):
+    """
+    HTMLから本文を抽出し、WebBaseLoaderと同じ形式のDocumentを作成
+    """
+    soup = BeautifulSoup(html, "html.parser")
+    metadata = {"source": url}
+    if title := soup.find("title"):
+        metadata["title"] = title.get_text()
+    if description := soup.find("meta", attrs={"name": "description"}):
+        metadata["description"] = description.get("content", "No description found.")
+    if html_tag := soup.find("html"):
+        metadata["language"] = html_tag.get("lang", "No language found.")
+    return [Document(page_content=soup.get_text(), metadata=metadata)]
+
+
+def load_web_pages(urls, cache_dir=None, client=None):
+    """
+    複数のWebページを並列に取得（同期処理から呼び出す用）
+
+    Args:
+        urls: 取得するURLのリスト
+        cache_dir: HTTPキャッシュの保存先
+        client: 使用するhttpx.AsyncClient（未指定時は接続プール付きのクライアントを作成）
+
+    Returns:
+        {URL: WebLoadResult}
+    """
+    return run_sync(WebPageFetcher(cache_dir, client=client).fetch_all(urls))
+
+
+############################################################
+# クラス定義
+############################################################
+
+class HttpCache:
+    """
+    取得したページをディスクに保存するHTTPキャッシュ（URLごとに1ファイル）
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+
+    def _path(self, url):
+        return os.path.join(self.cache_dir, hashlib.sha256(url.encode("utf-8")).hexdigest() + ".json")
+
+    def get(self, url):
+        try:
+            with open(self._path(url), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, url, entry):
+        """
+        キャッシュを保存（書き込み途中のファイルを読まないよう、一時ファイルから置き換える）
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._path(url)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+
+class WebPageFetcher:
+    """
+    Webページの非同期取得（接続プール・ホストごとの同時接続数制限・タイムアウト・条件付きリクエスト）
+    """
+
+    def __init__(self, cache_dir=None, client=None, per_host_concurrency=None, timeout_sec=None):
+        self.cache = HttpCache(cache_dir or os.path.join(ct.INDEX_DIR_PATH, ct.WEB_CACHE_DIR_NAME))
+        self.client = client
+        self.per_host_concurrency = per_host_concurrency or ct.WEB_PER_HOST_CONCURRENCY
+        self.timeout_sec = timeout_sec or ct.WEB_FETCH_TIMEOUT_SEC
+        self._host_semaphores = {}
+
+    def _semaphore(self, url):
+        host = urlsplit(url).netloc
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._host_semaphores[host]
+
+    async def fetch_all(self, urls):
+        """
+        全URLを並列に取得
+
+        Returns:
+            {URL: WebLoadResult}
+        """
+        client = self.client
+        owns_client = client is None
+        if owns_client:
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=ct.WEB_MAX_CONNECTIONS),
+                timeout=self.timeout_sec,
+                follow_redirects=True,
+                headers={"User-Agent": os.environ.get("USER_AGENT", ct.WEB_USER_AGENT)},
+            )
+        try:
+            results = await asyncio.gather(*(self.fetch(client, url) for url in urls))
+        finally:
+            if owns_client:
+                await client.aclose()
+        return {result.url: result for result in results}
+
+    async def fetch(self, client, url):
+        """
+        URL1件を取得（前回のキャッシュがあれば条件付きリクエストにする）
+        """
+        started = time.perf_counter()
+        cached = self.cache.get(url)
+
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        try:
+            async with self._semaphore(url):
+                response = await client.get(url, headers=headers, timeout=self.timeout_sec)
+
+            if response.status_code == 304 and cached:
+                result = self._from_cache(url, cached, "not_modified")
+            else:
+                response.raise_for_status()
+                html = response.text
+                entry = {
+                    "url": url,
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "fetched_at": time.time(),
+                    "content_hash": hashlib.sha256(html.encode("utf-8")).hexdigest(),
+                    "html": html,
+                }
+                self.cache.put(url, entry)
+                result = WebLoadResult(
+                    url=url,
+                    status="fetched",
+                    docs=build_documents(url, html),
+                    content_hash=entry["content_hash"],
+                )
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if cached:
+                logger.warning(f"Webページの取得に失敗したため、前回取得時の内容を使います: {url}\n{error}")
+                result = self._from_cache(url, cached, "stale")
+            else:
+                logger.warning(f"Webページの取得に失敗したためスキップします: {url}\n{error}")
+                result = WebLoadResult(url=url, status="failed")
+            result.error = error
+
+        result.elapsed_sec = time.perf_counter() - started
+        return result
+
+    def _from_cache(self, url, cached, status):
+        return WebLoadResult(
+            url=url,
+            status=status,
+            docs=build_documents(url, cached["html"]),
+            content_hash=cached["content_hash"],
+        )